@@ -1,41 +1,93 @@
+import click
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_redis import FlaskRedis
+from werkzeug.utils import import_string
 import os
+import weakref
+from app.utils.replicas import RoutingSession
 
-db = SQLAlchemy()
-migrate = Migrate()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 redis_client = FlaskRedis()
 
+# Engines of the live apps. Safe for gunicorn --preload: connections opened
+# before a fork stay with the parent, and each worker starts with empty
+# pools. Redis pools reset themselves in a new process. One hook for the
+# process; an app that is garbage collected drops out of the set.
+_engines = weakref.WeakSet()
+
+def _dispose_engines():
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+os.register_at_fork(after_in_child=_dispose_engines)
+
 def create_app():
     app = Flask(__name__)
     
     # Load configuration
     app.config.from_object('app.utils.config')
     
+    # Register the JSON provider used by jsonify
+    app.json = import_string(app.config['JSON_PROVIDER'])(app)
+    
     # Initialize extensions
     db.init_app(app)
-    migrate.init_app(app, db)
     redis_client.init_app(app)
     
+    # Flask-Migrate (and alembic, slow to import) only serves the `flask db`
+    # commands, so web workers skip it
+    if click.get_current_context(silent=True) is not None:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    
     # Import models to ensure they're registered with SQLAlchemy
     from app.models.warehouse import Warehouse
     from app.models.product import Product
     from app.models.stock_movement import StockMovement
     from app.models.inventory import Inventory
+    from app.models.stock_snapshot import StockSnapshot, StockCheckpoint
+    from app.models.movement_segment import MovementSegment, MovementSegmentProduct
+    from app.models.movement_rollup import MovementRollup
+    from app.models.demand_stat import DemandStat
     
     # Register blueprints
     from app.routes.warehouse_routes import warehouse_bp
     from app.routes.product_routes import product_bp
     from app.routes.alerts import alerts_bp
+    from app.routes.inventory_routes import inventory_bp
+    from app.routes.events import events_bp
+    from app.routes.analytics import analytics_bp
+    from app.routes.metrics import metrics_bp
     
     app.register_blueprint(warehouse_bp, url_prefix='/warehouses')
     app.register_blueprint(product_bp, url_prefix='/products')
     app.register_blueprint(alerts_bp, url_prefix='/alerts')
+    app.register_blueprint(inventory_bp, url_prefix='/inventory')
+    app.register_blueprint(events_bp, url_prefix='/events')
+    app.register_blueprint(analytics_bp, url_prefix='/analytics')
+    app.register_blueprint(metrics_bp, url_prefix='/metrics')
+    
+    # Read-your-writes stickiness for read-replica routing
+    from app.utils import replicas
+    replicas.init_app(app)
+    
+    # Per-request SQL, Redis and serialization metrics
+    from app.utils import metrics
+    metrics.init_app(app)
+    
+    # Register CLI commands
+    from app.cli import stock_cli
+    app.cli.add_command(stock_cli)
     
-    # Create a context for database creation/migration when using Flask CLI
     with app.app_context():
-        db.create_all()
+        # Production leaves the schema to init.sql or migrations
+        if app.config['CREATE_SCHEMA_ON_STARTUP']:
+            db.create_all()
+        _engines.update(db.engines.values())
+    
+    # Build the product search index in the background if it is missing
+    from app.utils.search import warm_on_startup
+    warm_on_startup(app)
     
     return app
\ No newline at end of file
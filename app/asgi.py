@@ -0,0 +1,688 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from functools import wraps
+from urllib.parse import parse_qsl
+import redis.asyncio as aioredis
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException, InternalServerError, NotFound
+from werkzeug.http import parse_cookie, parse_etags
+from werkzeug.routing import Map, Rule
+from werkzeug.wrappers import Response
+from app import create_app, db
+from app.models.product import Product
+from app.models.stock_movement import StockMovement
+from app.routes.alerts import format_alert_items
+from app.routes.events import stream_args
+from app.utils.archive import ARCHIVED_COUNTS_KEY, archived_count_query
+from app.utils.cache import TOTAL_ALERTS_KEY, warehouse_alerts_key, decode_warehouse_stock
+from app.utils.etags import (
+    make_etag, page_key, cacheable_page, pack_page, unpack_page, not_modified, json_page,
+    queue_version_reads, queue_version_seeds
+)
+from app.utils.config import (
+    SQLALCHEMY_DATABASE_URI, SQLALCHEMY_ENGINE_OPTIONS, REPLICA_DATABASE_URIS,
+    REPLICA_STICKY_COOKIE, REDIS_URL, ASYNC_DATABASE_URI, ASYNC_REDIS_MAX_CONNECTIONS,
+    ASYNC_FILL_THREADS, MAX_BULK_IDS, RESPONSE_CACHE_TTL,
+    EVENT_LOG, EVENT_CHANNEL, EVENT_READ_CHUNK, SSE_HEARTBEAT
+)
+from app.utils.events import Subscription, event_key, format_event
+from app.utils.pagination import (
+    COUNT_CACHE_TTL, decode_cursor, encode_cursor, keyset_query, keyset_rows,
+    page_limit
+)
+from app.utils.readers import (
+    movement_rows, alert_rows, archived_movement_rows, serialize_rows,
+    get_product_details, get_warehouse_details, get_product_warehouse_stock,
+    get_product_stock_level, warehouse_reorder_point_rows
+)
+from app.utils.serialization import dumps, dumps_bytes, loads
+
+# Async read server for the read-heavy GET endpoints: product and warehouse
+# details, stock, movement history and alerts, plus the stock event streams.
+# Requests wait on MySQL and Redis without holding a thread, so one process
+# keeps thousands of reads and open streams in flight. Responses match the
+# Flask app's.
+#
+# Cache hits and hot-table queries run on the event loop (redis.asyncio and
+# SQLAlchemy's async engine). Cache misses are filled by the sync readers on
+# a thread pool, so single-flight leases, alert ranking and L1 invalidation
+# stay in one place; archive segments are read there too.
+#
+#   uvicorn asgi:app --port 5002 --workers 4
+
+logger = logging.getLogger(__name__)
+
+ASYNC_DRIVERS = {'mysql': 'aiomysql', 'sqlite': 'aiosqlite', 'postgresql': 'asyncpg'}
+
+_state = {'app': None, 'primary': None, 'replicas': [], 'redis': None, 'executor': None}
+_replica = ContextVar('replica', default=None)
+
+url_map = Map()
+handlers = {}
+
+def route(rule):
+    def register(handler):
+        url_map.add(Rule(rule, endpoint=handler.__name__, methods=['GET']))
+        handlers[handler.__name__] = handler
+        return handler
+    return register
+
+class Request:
+    def __init__(self, scope):
+        query_string = scope['query_string'].decode('latin-1')
+        self.args = MultiDict(parse_qsl(query_string, keep_blank_values=True))
+        self.headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+        self.cookies = parse_cookie(self.headers.get('cookie', ''))
+        self.full_path = f"{scope['path']}?{query_string}"
+        self.if_none_match = parse_etags(self.headers.get('if-none-match'))
+
+# Database and Redis access
+def async_uri(uri):
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+def _recent_writer(request):
+    # Same rule as replica_reads: clients that just wrote read the primary
+    try:
+        return float(request.cookies.get(REPLICA_STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+def connect():
+    # A connection to this request's replica, or to the primary
+    return (_replica.get() or _state['primary']).connect()
+
+async def fetch_all(statement):
+    async with connect() as conn:
+        return (await conn.execute(statement)).all()
+
+def _call_in_app(fn, args):
+    with _state['app'].app_context():
+        return fn(*args)
+
+async def in_app(fn, *args):
+    # Runs sync code in the Flask app context on the fill thread pool
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_state['executor'], _call_in_app, fn, args)
+
+async def cached_count(conn, key, statement):
+    # Async cached_count: approximate total, shared with the Flask app
+    redis = _state['redis']
+    cache_key = f"count:{key}"
+    total = await redis.get(cache_key)
+    if total is not None:
+        return int(total)
+
+    total = await conn.scalar(statement)
+    await redis.setex(cache_key, COUNT_CACHE_TTL, total)
+    return total
+
+async def archived_movement_count(conn, product_id):
+    # Async archived_movement_count, on the same Redis hash
+    redis = _state['redis']
+    count = await redis.hget(ARCHIVED_COUNTS_KEY, product_id)
+    if count is None:
+        count = await conn.scalar(archived_count_query(product_id))
+        await redis.hsetnx(ARCHIVED_COUNTS_KEY, product_id, count)
+    return int(count)
+
+async def read_versions(names, keys=()):
+    # Async read_versions: ([counter per name], [value per key])
+    pipe = _state['redis'].pipeline(transaction=False)
+    queue_version_reads(pipe, names, keys)
+    versions, *values = await pipe.execute()
+
+    missing = [name for name, version in zip(names, versions) if version is None]
+    if missing:
+        pipe = _state['redis'].pipeline(transaction=False)
+        queue_version_seeds(pipe, missing)
+        seeded = dict(zip(missing, (await pipe.execute())[1::2]))
+        versions = [seeded.get(name, version) for name, version in zip(names, versions)]
+    return [int(version) for version in versions], values
+
+# Conditional GETs, as in app/utils/etags.py
+def conditional_json(request, payload, versions, *extra):
+    etag = make_etag(versions, request.full_path, *extra)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    return json_page(dumps_bytes(payload), etag)
+
+def conditional(versions):
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(request, **values):
+            cache = cacheable_page(request.args)
+            key = page_key(request.full_path)
+            counters, cached = await read_versions(versions(**values), [key] if cache else [])
+            etag = make_etag(counters, request.full_path)
+            if request.if_none_match.contains_weak(etag):
+                return not_modified(etag)
+
+            if not cache:
+                result = await handler(request, **values)
+                if isinstance(result, tuple) or _replica.get() is not None:
+                    return result
+                return json_page(dumps_bytes(result), etag)
+
+            body = unpack_page(cached[0], etag)
+            if body is not None:
+                return json_page(body, etag)
+
+            # Cached pages are rendered from the primary
+            token = _replica.set(None)
+            try:
+                result = await handler(request, **values)
+            finally:
+                _replica.reset(token)
+            if isinstance(result, tuple):
+                return result
+            body = dumps_bytes(result)
+            await _state['redis'].setex(key, RESPONSE_CACHE_TTL, pack_page(etag, body))
+            return json_page(body, etag)
+        return wrapper
+    return decorator
+
+async def warehouse_details(warehouse_id, data=None):
+    # data: the cached value when the caller already read it
+    if data is None:
+        data = await _state['redis'].get(f"warehouse:{warehouse_id}")
+    if data is not None:
+        return loads(data)
+    return await in_app(get_warehouse_details, warehouse_id)
+
+async def product_details(product_id, data=None):
+    if data is None:
+        data = await _state['redis'].get(f"product:{product_id}")
+    if data is not None:
+        return loads(data)
+    return await in_app(get_product_details, product_id)
+
+# Products and warehouses
+@route('/products/<int:product_id>')
+async def get_product(request, product_id):
+    key = f"product:{product_id}"
+    (version,), (data,) = await read_versions([key], [key])
+    product = await product_details(product_id, data)
+    return conditional_json(request, product, [version], product['updated_at'])
+
+@route('/warehouses/<int:warehouse_id>')
+async def get_warehouse(request, warehouse_id):
+    key = f"warehouse:{warehouse_id}"
+    (version,), (data,) = await read_versions([key], [key])
+    warehouse = await warehouse_details(warehouse_id, data)
+    return conditional_json(request, warehouse, [version], warehouse['updated_at'])
+
+@route('/products/<int:product_id>/stock')
+async def get_product_stock(request, product_id):
+    data = await _state['redis'].get(f"stock:{product_id}")
+    if data is not None:
+        stock = int(data)
+    else:
+        stock = await in_app(get_product_stock_level, product_id)
+
+    return {
+        'product_id': product_id,
+        'stock_level': stock
+    }
+
+@route('/warehouses/<int:warehouse_id>/products/<int:product_id>/stock')
+async def get_warehouse_product_stock(request, warehouse_id, product_id):
+    # Warehouse, product and stock hash in one round trip when warm
+    pipe = _state['redis'].pipeline(transaction=False)
+    pipe.get(f"warehouse:{warehouse_id}")
+    pipe.get(f"product:{product_id}")
+    pipe.hgetall(f"stock:wh:{product_id}")
+    cached_warehouse, cached_product, cached_stock = await pipe.execute()
+
+    warehouse = await warehouse_details(warehouse_id, cached_warehouse)
+    product = await product_details(product_id, cached_product)
+    if cached_stock:
+        quantities = decode_warehouse_stock(cached_stock)
+    else:
+        quantities = await in_app(get_product_warehouse_stock, product_id) or {}
+
+    return {
+        'product_id': product_id,
+        'product_name': product['name'],
+        'warehouse_id': warehouse_id,
+        'warehouse_name': warehouse['name'],
+        'stock_level': quantities.get(warehouse_id, 0)
+    }
+
+@route('/products/<int:product_id>/movements')
+@conditional(lambda product_id: ['movements', f"movements:{product_id}"])
+async def get_product_movements(request, product_id):
+    columns = [StockMovement.timestamp, StockMovement.id]
+    hot_count_query = db.select(db.func.count(StockMovement.id)).where(
+        StockMovement.product_id == product_id
+    )
+    cursor = request.args.get('cursor')
+    include_total = request.args.get('include_total') in ('1', 'true')
+
+    # One connection for all of the request's queries
+    async with connect() as conn:
+        # Ensure product exists
+        if await conn.scalar(db.select(Product.id).where(Product.id == product_id)) is None:
+            raise NotFound()
+
+        # Pagination parameters
+        page = int(request.args.get('page', 1))
+        try:
+            limit = page_limit(request.args)
+        except ValueError:
+            return {'error': 'limit must be an integer'}, 400
+        offset = (page - 1) * limit
+
+        # Archive segments are only opened (off the event loop) when the
+        # product has archived movements
+        archived_count = await archived_movement_count(conn, product_id)
+
+        # Keyset pagination on (timestamp, id) when a cursor is given
+        if cursor is not None:
+            try:
+                after = decode_cursor(cursor, [datetime, int])
+            except ValueError:
+                return {'error': 'Invalid cursor'}, 400
+
+            rows = (await conn.execute(keyset_query(
+                movement_rows(product_id), columns, after, limit, descending=True
+            ).statement)).all()
+            if include_total:
+                total = await cached_count(conn, f"movements:{product_id}", hot_count_query)
+        else:
+            hot_count = await conn.scalar(hot_count_query)
+            rows = (await conn.execute(
+                movement_rows(product_id)
+                .order_by(StockMovement.timestamp.desc(), StockMovement.id.desc())
+                .offset(offset).limit(limit).statement
+            )).all()
+
+    if cursor is not None:
+        movements, next_cursor = keyset_rows(rows, columns, limit)
+        items = serialize_rows(movements)
+
+        # Past the hot table, continue into the archive
+        if next_cursor is None and archived_count:
+            if items:
+                after = [items[-1]['timestamp'], items[-1]['id']]
+            remaining = limit - len(items)
+            archived = await in_app(archived_movement_rows, product_id, 0, remaining + 1, after)
+            items += archived[:remaining]
+            if len(archived) > remaining:
+                next_cursor = encode_cursor([items[-1]['timestamp'], items[-1]['id']])
+
+        pagination = {'limit': limit, 'next_cursor': next_cursor}
+        if include_total:
+            pagination['total'] = total + archived_count
+
+        return {
+            'items': items,
+            'pagination': pagination
+        }
+
+    # Pages past the hot table are read from the archive
+    items = serialize_rows(rows)
+    if len(items) < limit and archived_count:
+        items += await in_app(
+            archived_movement_rows, product_id, max(offset - hot_count, 0), limit - len(items)
+        )
+
+    # Get total count for pagination metadata
+    total_count = hot_count + archived_count
+
+    return {
+        'items': items,
+        'pagination': {
+            'page': page,
+            'limit': limit,
+            'total': total_count,
+            'pages': (total_count + limit - 1) // limit
+        }
+    }
+
+# Alerts
+async def get_alert_page(key, after, limit):
+    # Async get_alert_page: [(product_id, deficit)] worst first, after the
+    # entry given in after
+    redis = _state['redis']
+    start = 0
+    if after is not None:
+        product_id, deficit = after
+        member = f"{product_id:012d}"
+        pipe = redis.pipeline(transaction=False)
+        pipe.zrevrank(key, member)
+        pipe.zscore(key, member)
+        rank, score = await pipe.execute()
+
+        if rank is not None and score == deficit:
+            start = rank + 1
+        else:
+            ties = await redis.zrangebyscore(key, deficit, deficit)
+            start = await redis.zcount(key, f"({deficit}", '+inf') + sum(
+                1 for m in ties if m.decode() > member
+            )
+
+    entries = await redis.zrevrange(key, start, start + limit - 1, withscores=True)
+    return [(int(member), int(score)) for member, score in entries]
+
+async def alert_items(entries, warehouse=None):
+    # Cached product details, with one query for the rest
+    product_ids = [product_id for product_id, _ in entries]
+    products = {}
+    if product_ids:
+        cached = await _state['redis'].mget([f"product:{pid}" for pid in product_ids])
+        products = {pid: loads(data) for pid, data in zip(product_ids, cached) if data is not None}
+    missing = [pid for pid in product_ids if pid not in products]
+    if missing:
+        for row in await fetch_all(alert_rows(missing).statement):
+            products[row.id] = row._asdict()
+    reorder_points = None
+    if warehouse is not None and product_ids:
+        reorder_points = dict(await fetch_all(
+            warehouse_reorder_point_rows(product_ids, warehouse['id']).statement
+        ))
+    return format_alert_items(entries, products, warehouse, reorder_points)
+
+@route('/alerts/')
+async def list_alerts(request):
+    # Alerts by total stock, or by stock in one warehouse
+    key = TOTAL_ALERTS_KEY
+    warehouse = None
+    if 'warehouse_id' in request.args:
+        try:
+            warehouse_id = int(request.args['warehouse_id'])
+        except ValueError:
+            return {'error': 'warehouse_id must be an integer'}, 400
+        warehouse = await warehouse_details(warehouse_id)
+        key = warehouse_alerts_key(warehouse_id)
+
+    # Cursor pagination when a cursor is given, worst deficit first
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        try:
+            after = decode_cursor(cursor, [int, int])
+        except ValueError:
+            return {'error': 'Invalid cursor'}, 400
+
+        try:
+            limit = page_limit(request.args)
+        except ValueError:
+            return {'error': 'limit must be an integer'}, 400
+        entries = await get_alert_page(key, after, limit + 1)
+
+        next_cursor = None
+        if len(entries) > limit:
+            entries = entries[:limit]
+            next_cursor = encode_cursor(list(entries[-1]))
+
+        return {
+            'items': await alert_items(entries, warehouse),
+            'pagination': {
+                'limit': limit,
+                'next_cursor': next_cursor,
+                'total': await _state['redis'].zcard(key)
+            }
+        }
+
+    # Without a cursor, every alert, read from the index in chunks
+    items = []
+    after = None
+    while True:
+        entries = await get_alert_page(key, after, MAX_BULK_IDS)
+        items += await alert_items(entries, warehouse)
+        if len(entries) < MAX_BULK_IDS:
+            break
+        after = entries[-1]
+
+    return items
+
+# Event streams. Same protocol as the Flask app's, but a stream waits on the
+# event loop instead of pinning a thread. One dispatcher task per process is
+# woken on EVENT_CHANNEL and fans new log entries out to the open streams.
+class AsyncSubscription(Subscription):
+    def __init__(self, matches):
+        super().__init__(matches)
+        self._ready = asyncio.Event()
+
+    async def take(self, timeout):
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.drain()
+
+_events = {'task': None, 'subscriptions': set()}
+_events_lock = asyncio.Lock()
+
+async def read_events(after, count=EVENT_READ_CHUNK):
+    # Async read_events: [(entry_id, event)] logged after after
+    entries = await _state['redis'].xrange(EVENT_LOG, min=f"({after}", max='+', count=count)
+    return [(entry_id.decode(), loads(fields[b'data'])) for entry_id, fields in entries]
+
+async def latest_event_id():
+    entries = await _state['redis'].xrevrange(EVENT_LOG, '+', '-', count=1)
+    return entries[0][0].decode() if entries else '0-0'
+
+async def log_starts_after(entry_id):
+    entries = await _state['redis'].xrange(EVENT_LOG, '-', '+', count=1)
+    return bool(entries) and event_key(entries[0][0].decode()) > event_key(entry_id)
+
+async def _dispatch_events(pubsub, last_id):
+    try:
+        async for _ in pubsub.listen():
+            # Reads everything logged since the last dispatch, so wake-ups
+            # published in a burst cost one read
+            while True:
+                entries = await read_events(last_id)
+                for entry_id, event in entries:
+                    for subscription in list(_events['subscriptions']):
+                        subscription.push(entry_id, event)
+                    last_id = entry_id
+                if len(entries) < EVENT_READ_CHUNK:
+                    break
+    except Exception:
+        # The next subscription starts a new dispatcher
+        logger.exception('Event dispatcher stopped')
+    finally:
+        await pubsub.aclose()
+
+async def subscribe(matches):
+    # The dispatcher's position is taken before the subscriber's, so nothing
+    # logged in between is skipped
+    async with _events_lock:
+        task = _events['task']
+        if task is None or task.done():
+            last_id = await latest_event_id()
+            pubsub = _state['redis'].pubsub(ignore_subscribe_messages=True)
+            await pubsub.subscribe(EVENT_CHANNEL)
+            _events['task'] = asyncio.ensure_future(_dispatch_events(pubsub, last_id))
+    subscription = AsyncSubscription(matches)
+    _events['subscriptions'].add(subscription)
+    return subscription
+
+async def event_stream(matches, last_event_id=None):
+    # Async event_stream
+    subscription = await subscribe(matches)
+    try:
+        last_id = last_event_id
+        replay = last_id is not None
+        if last_id is None:
+            last_id = await latest_event_id()
+
+        yield "retry: 3000\n\n"
+
+        while True:
+            if replay:
+                replay = False
+                if await log_starts_after(last_id):
+                    yield f"event: reset\ndata: {dumps({'last_event_id': last_id})}\n\n"
+                while True:
+                    entries = await read_events(last_id)
+                    for entry_id, event in entries:
+                        last_id = entry_id
+                        if matches(event):
+                            yield format_event(entry_id, event)
+                    if len(entries) < EVENT_READ_CHUNK:
+                        break
+
+            events, overflowed = await subscription.take(SSE_HEARTBEAT)
+            if overflowed:
+                # Dropped events are still in the log
+                replay = True
+                continue
+
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+
+            for entry_id, event in events:
+                if event_key(entry_id) <= event_key(last_id):
+                    continue
+                last_id = entry_id
+                yield format_event(entry_id, event)
+    finally:
+        _events['subscriptions'].discard(subscription)
+
+class Stream:
+    # Handler result sent chunk by chunk as the chunks iterator yields them
+    def __init__(self, chunks, content_type, headers=()):
+        self.chunks = chunks
+        self.headers = [(b'content-type', content_type.encode()), *headers]
+
+@route('/events/stock')
+async def stream_stock_events(request):
+    try:
+        matches, last_event_id = stream_args(request.args, request.headers.get('last-event-id'))
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    return Stream(
+        event_stream(matches, last_event_id), 'text/event-stream; charset=utf-8',
+        [(b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')]
+    )
+
+# ASGI protocol
+def _json_response(payload, status=200):
+    body = dumps_bytes(payload)
+    headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    return status, headers, body
+
+def _werkzeug_response(response):
+    # Sent with the headers a WSGI server would send, e.g. none describing
+    # the body of a 304
+    headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+               for name, value in response.get_wsgi_headers({}).items()]
+    return response.status_code, headers, response.get_data()
+
+def _error_response(error):
+    # Werkzeug's own response for the error, as Flask would send it
+    return _werkzeug_response(error.get_response())
+
+async def _dispatch(scope):
+    request = Request(scope)
+    adapter = url_map.bind(
+        request.headers.get('host', 'localhost'), url_scheme=scope.get('scheme', 'http'),
+        query_args=scope['query_string'].decode('latin-1')
+    )
+    token = None
+    try:
+        endpoint, values = adapter.match(scope['path'], scope['method'])
+        if _state['replicas'] and not _recent_writer(request):
+            token = _replica.set(random.choice(_state['replicas']))
+        result = await handlers[endpoint](request, **values)
+    except HTTPException as e:
+        return _error_response(e)
+    except Exception:
+        logger.exception('Error handling %s %s', scope['method'], scope['path'])
+        return _error_response(InternalServerError())
+    finally:
+        if token is not None:
+            _replica.reset(token)
+
+    if isinstance(result, Stream):
+        return 200, result.headers, result.chunks
+    if isinstance(result, Response):
+        return _werkzeug_response(result)
+    if isinstance(result, tuple):
+        return _json_response(*result)
+    return _json_response(result)
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _events['task'] is not None:
+                _events['task'].cancel()
+            for engine in [_state['primary'], *_state['replicas']]:
+                await engine.dispose()
+            await _state['redis'].aclose()
+            _state['executor'].shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def _send_chunks(chunks, send):
+    async for chunk in chunks:
+        await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def _stream(chunks, receive, send):
+    # Sends chunks until they run out or the client goes away
+    sender = asyncio.ensure_future(_send_chunks(chunks, send))
+    watcher = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        await asyncio.wait({sender, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        sender.cancel()
+        watcher.cancel()
+        await asyncio.gather(sender, watcher, return_exceptions=True)
+        await chunks.aclose()
+    if not sender.cancelled() and sender.exception() is not None:
+        logger.error('Error streaming response', exc_info=sender.exception())
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    status, headers, body = await _dispatch(scope)
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    if isinstance(body, bytes):
+        await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else body})
+    elif scope['method'] == 'HEAD':
+        await body.aclose()
+        await send({'type': 'http.response.body', 'body': b''})
+    else:
+        await _stream(body, receive, send)
+
+def create_asgi_app():
+    # The Flask app supplies the models, config and the sync readers that
+    # fill cache misses
+    _state['app'] = create_app()
+    _state['primary'] = create_async_engine(
+        ASYNC_DATABASE_URI or async_uri(SQLALCHEMY_DATABASE_URI), **SQLALCHEMY_ENGINE_OPTIONS
+    )
+    _state['replicas'] = [
+        create_async_engine(async_uri(uri), **SQLALCHEMY_ENGINE_OPTIONS)
+        for uri in REPLICA_DATABASE_URIS
+    ]
+    _state['redis'] = aioredis.Redis(connection_pool=aioredis.BlockingConnectionPool.from_url(
+        REDIS_URL, max_connections=ASYNC_REDIS_MAX_CONNECTIONS
+    ))
+    _state['executor'] = ThreadPoolExecutor(ASYNC_FILL_THREADS, thread_name_prefix='cache-fill')
+    return application
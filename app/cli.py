@@ -0,0 +1,162 @@
+from datetime import datetime, timedelta
+import os
+import socket
+import time
+import click
+from flask.cli import AppGroup
+
+stock_cli = AppGroup('stock', help='Stock ledger maintenance.')
+
+@stock_cli.command('snapshot')
+@click.option('--batch-size', default=100000, show_default=True,
+              help='Movements folded per transaction.')
+@click.option('--interval', default=0.0, show_default=True,
+              help='Keep running, sleeping this many seconds when caught up.')
+def snapshot(batch_size, interval):
+    """Advance stock snapshots past newly committed movements."""
+    from app.utils.ledger import advance_snapshot
+
+    while True:
+        folded = advance_snapshot(batch_size)
+        click.echo(f"Folded {folded} movements into stock snapshots")
+        if folded >= batch_size:
+            continue
+        if interval <= 0:
+            break
+        time.sleep(interval)
+
+@stock_cli.command('rollup')
+@click.option('--batch-size', default=100000, show_default=True,
+              help='Movements folded per transaction.')
+@click.option('--interval', default=0.0, show_default=True,
+              help='Keep running, sleeping this many seconds when caught up.')
+def rollup(batch_size, interval):
+    """Advance movement analytics rollups past newly committed movements."""
+    from app.utils.analytics import advance_rollups
+
+    while True:
+        folded = advance_rollups(batch_size)
+        click.echo(f"Folded {folded} movements into movement rollups")
+        if folded >= batch_size:
+            continue
+        if interval <= 0:
+            break
+        time.sleep(interval)
+
+@stock_cli.command('reorder-points')
+@click.option('--workers', default=None, type=int,
+              help='Worker processes [default: one per core].')
+@click.option('--chunk-products', default=None, type=int,
+              help='Product ids per unit of work [default: REORDER_CHUNK_PRODUCTS].')
+def reorder_points(workers, chunk_products):
+    """Recompute reorder points from recent demand and update alerts."""
+    from app.utils.analytics import advance_rollups
+    from app.utils.config import REORDER_CHUNK_PRODUCTS
+    from app.utils.reorder import compute_reorder_points
+
+    # Demand is read from the rollup; catch it up first
+    while advance_rollups() > 0:
+        pass
+
+    started = time.perf_counter()
+    pairs, changed = compute_reorder_points(workers, chunk_products or REORDER_CHUNK_PRODUCTS)
+    elapsed = time.perf_counter() - started
+    click.echo(f"Computed demand for {pairs} product/warehouse pairs in {elapsed:.1f}s; "
+               f"{changed} reorder points changed")
+
+@stock_cli.command('archive')
+@click.option('--days', default=180, show_default=True,
+              help='Archive movements older than this many days.')
+@click.option('--before', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Archive movements before this date instead (UTC).')
+@click.option('--segment-rows', default=1000000, show_default=True,
+              help='Movements read per archival pass.')
+def archive(days, before, segment_rows):
+    """Move old movements into compressed monthly segment files."""
+    from app.utils.analytics import advance_rollups
+    from app.utils.archive import archive_movements
+    from app.utils.ledger import advance_snapshot
+
+    if before is None:
+        before = datetime.utcnow() - timedelta(days=days)
+
+    # Only movements folded into the snapshot and the rollup are archived;
+    # catch both up first
+    while advance_snapshot() > 0:
+        pass
+    while advance_rollups() > 0:
+        pass
+
+    archived = archive_movements(before, segment_rows)
+    click.echo(f"Archived {archived} movements older than {before.isoformat()}")
+
+@stock_cli.command('ingest')
+@click.option('--consumer', default=None,
+              help='Consumer name in the stream group [default: host-pid].')
+@click.option('--batch-size', default=None, type=int,
+              help='Movements written per transaction [default: INGEST_BATCH_SIZE].')
+def ingest(consumer, batch_size):
+    """Write queued stock movements to the database (runs until stopped)."""
+    from app.utils.config import INGEST_BATCH_SIZE
+    from app.utils.ingest import drain_movements
+
+    consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+
+    def report(received, written):
+        click.echo(f"Wrote {written} of {received} queued movements")
+
+    drain_movements(consumer, batch_size or INGEST_BATCH_SIZE, on_batch=report)
+
+@stock_cli.command('flush')
+@click.option('--batch-size', default=None, type=int,
+              help='Movements written per transaction [default: INGEST_BATCH_SIZE].')
+def flush(batch_size):
+    """Write every queued stock movement now, then exit."""
+    from app.utils.config import INGEST_BATCH_SIZE
+    from app.utils.ingest import drain_movements, ingest_lag
+
+    # Joins the running workers for a share of the partitions and waits for
+    # them to write the rest; entries they hold are never taken from them
+    written = drain_movements(
+        f"flush-{socket.gethostname()}-{os.getpid()}",
+        batch_size or INGEST_BATCH_SIZE,
+        until_empty=True
+    )
+    click.echo(f"Wrote {written} queued movements")
+    click.echo(f"Backlog: {ingest_lag()['backlog']}")
+
+@stock_cli.command('reindex-search')
+@click.option('--batch-size', default=5000, show_default=True,
+              help='Products indexed per round trip.')
+def reindex_search(batch_size):
+    """Rebuild the product search index from the database."""
+    from app.utils.search import rebuild_index
+
+    total = rebuild_index(batch_size)
+    click.echo(f"Indexed {total} products for search")
+
+@stock_cli.command('rebuild-alerts')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Products reloaded per round trip.')
+def rebuild_alerts(batch_size):
+    """Rebuild the low stock alert index from inventory."""
+    from app import db
+    from app.models.product import Product
+    from app.utils.cache import clear_alerts, refresh_warehouse_stocks
+
+    # Stock hashes are rewritten too, so in stream mode flush first
+    clear_alerts()
+    last_id = 0
+    total = 0
+    while True:
+        product_ids = [pid for (pid,) in db.session.query(Product.id)
+                                                   .filter(Product.id > last_id)
+                                                   .order_by(Product.id)
+                                                   .limit(batch_size)]
+        if not product_ids:
+            break
+        refresh_warehouse_stocks(product_ids, notify=False)
+        last_id = product_ids[-1]
+        total += len(product_ids)
+
+    click.echo(f"Rebuilt alerts for {total} products")
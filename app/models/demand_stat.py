@@ -0,0 +1,22 @@
+from app import db
+from datetime import datetime
+
+class DemandStat(db.Model):
+    # Daily demand (units shipped) per (product, warehouse) over the reorder
+    # window, and the reorder point derived from it
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouse.id'), primary_key=True)
+    demand_rate = db.Column(db.Float, nullable=False)
+    demand_std = db.Column(db.Float, nullable=False)
+    reorder_point = db.Column(db.Integer, nullable=False)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'product_id': self.product_id,
+            'warehouse_id': self.warehouse_id,
+            'demand_rate': self.demand_rate,
+            'demand_std': self.demand_std,
+            'reorder_point': self.reorder_point,
+            'computed_at': self.computed_at.isoformat() if self.computed_at else None
+        }
@@ -16,8 +16,20 @@ class Inventory(db.Model):
     
     __table_args__ = (
         db.UniqueConstraint('product_id', 'warehouse_id', name='uix_inventory_product_warehouse'),
+        # Incremental exports filter on updated_at
+        db.Index('idx_inventory_updated_at', 'updated_at'),
     )
     
+    @classmethod
+    def serializer_options(cls):
+        # Loader options covering every relationship to_dict touches
+        from app.models.product import Product
+        from app.models.warehouse import Warehouse
+        return (
+            db.joinedload(cls.product).load_only(Product.name),
+            db.joinedload(cls.warehouse).load_only(Warehouse.name),
+        )
+    
     def to_dict(self):
         return {
             'id': self.id,
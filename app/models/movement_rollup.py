@@ -0,0 +1,30 @@
+from app import db
+from datetime import datetime
+
+class MovementRollup(db.Model):
+    # Units moved per (day, warehouse, product), maintained from stock_movement
+    # up to the rollup checkpoint
+    day = db.Column(db.Date, primary_key=True)
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouse.id'), primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    received = db.Column(db.Integer, default=0, nullable=False)
+    shipped = db.Column(db.Integer, default=0, nullable=False)
+    movements = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        # Range scans for the warehouse and product filters
+        db.Index('idx_rollup_warehouse_day', 'warehouse_id', 'day'),
+        db.Index('idx_rollup_product_day', 'product_id', 'day'),
+    )
+    
+    def to_dict(self):
+        return {
+            'day': self.day.isoformat() if self.day else None,
+            'warehouse_id': self.warehouse_id,
+            'product_id': self.product_id,
+            'received': self.received,
+            'shipped': self.shipped,
+            'movements': self.movements,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
@@ -0,0 +1,43 @@
+from app import db
+from datetime import datetime
+
+class MovementSegment(db.Model):
+    # Manifest of archived movement segment files. Readers only open
+    # segments listed here, so a file is visible once its row commits.
+    id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.String(7), nullable=False)  # 'YYYY-MM'
+    path = db.Column(db.String(255), nullable=False, unique=True)
+    row_count = db.Column(db.Integer, nullable=False)
+    min_movement_id = db.Column(db.Integer, nullable=False)
+    max_movement_id = db.Column(db.Integer, nullable=False)
+    min_product_id = db.Column(db.Integer, nullable=False)
+    max_product_id = db.Column(db.Integer, nullable=False)
+    min_timestamp = db.Column(db.DateTime, nullable=False)
+    max_timestamp = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('idx_segment_month', 'month'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'month': self.month,
+            'path': self.path,
+            'row_count': self.row_count,
+            'min_movement_id': self.min_movement_id,
+            'max_movement_id': self.max_movement_id,
+            'min_product_id': self.min_product_id,
+            'max_product_id': self.max_product_id,
+            'min_timestamp': self.min_timestamp.isoformat() if self.min_timestamp else None,
+            'max_timestamp': self.max_timestamp.isoformat() if self.max_timestamp else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class MovementSegmentProduct(db.Model):
+    # Rows each product has in a segment. Listings total a product's archived
+    # movements and pick the segments to open from here, not the file headers.
+    product_id = db.Column(db.Integer, primary_key=True)
+    segment_id = db.Column(db.Integer, db.ForeignKey('movement_segment.id'), primary_key=True)
+    row_count = db.Column(db.Integer, nullable=False)
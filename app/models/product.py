@@ -1,5 +1,6 @@
 from app import db
 from datetime import datetime
+from sqlalchemy.ext.hybrid import hybrid_property
 
 class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -7,6 +8,8 @@ class Product(db.Model):
     description = db.Column(db.Text, nullable=True)
     sku = db.Column(db.String(50), unique=True, nullable=True)
     min_stock_level = db.Column(db.Integer, default=10)
+    # Computed from demand by `flask stock reorder-points`; NULL without history
+    reorder_point = db.Column(db.Integer, nullable=True)
     warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouse.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -15,6 +18,28 @@ class Product(db.Model):
     movements = db.relationship('StockMovement', backref='product', lazy=True, 
                                foreign_keys='StockMovement.product_id')
     
+    __table_args__ = (
+        db.Index('idx_product_sku', 'sku'),
+        db.Index('idx_product_warehouse', 'warehouse_id'),
+        # Incremental exports filter on updated_at
+        db.Index('idx_product_updated_at', 'updated_at'),
+    )
+    
+    @hybrid_property
+    def stock_threshold(self):
+        # Alerts fire below the reorder point, or min_stock_level without one
+        return self.reorder_point if self.reorder_point is not None else self.min_stock_level
+    
+    @stock_threshold.expression
+    def stock_threshold(cls):
+        return db.func.coalesce(cls.reorder_point, cls.min_stock_level)
+    
+    @classmethod
+    def serializer_options(cls):
+        # Loader options covering every relationship to_dict touches
+        from app.models.warehouse import Warehouse
+        return (db.joinedload(cls.warehouse).load_only(Warehouse.name),)
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -22,6 +47,7 @@ class Product(db.Model):
             'description': self.description,
             'sku': self.sku,
             'min_stock_level': self.min_stock_level,
+            'reorder_point': self.reorder_point,
             'warehouse_id': self.warehouse_id,
             'warehouse_name': self.warehouse.name if self.warehouse else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
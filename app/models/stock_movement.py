@@ -9,11 +9,36 @@ class StockMovement(db.Model):
     quantity = db.Column(db.Integer, nullable=False)
     movement_type = db.Column(db.String(20), nullable=False)  # 'addition', 'removal', 'transfer'
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # Set for movements written by the ingest worker; makes redelivery idempotent
+    event_id = db.Column(db.String(32), nullable=True)
     
     # Relationships
     source_warehouse = db.relationship('Warehouse', foreign_keys=[source_warehouse_id])
     destination_warehouse = db.relationship('Warehouse', foreign_keys=[destination_warehouse_id])
     
+    __table_args__ = (
+        db.Index('idx_movement_product', 'product_id'),
+        db.Index('idx_movement_source', 'source_warehouse_id'),
+        db.Index('idx_movement_destination', 'destination_warehouse_id'),
+        db.Index('idx_movement_timestamp', 'timestamp'),
+        # Seek index for keyset pagination of a product's movement history
+        db.Index('idx_movement_product_timestamp', 'product_id', 'timestamp', 'id'),
+        db.Index('uix_movement_event_id', 'event_id', unique=True),
+    )
+    
+    @classmethod
+    def serializer_options(cls, include_product=True):
+        # Loader options covering every relationship to_dict touches
+        from app.models.product import Product
+        from app.models.warehouse import Warehouse
+        options = (
+            db.joinedload(cls.source_warehouse).load_only(Warehouse.name),
+            db.joinedload(cls.destination_warehouse).load_only(Warehouse.name),
+        )
+        if include_product:
+            options += (db.joinedload(cls.product).load_only(Product.name),)
+        return options
+    
     def to_dict(self):
         return {
             'id': self.id,
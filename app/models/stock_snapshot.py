@@ -0,0 +1,31 @@
+from app import db
+from datetime import datetime
+
+class StockSnapshot(db.Model):
+    # Stock per (product, warehouse) as of StockCheckpoint.last_movement_id
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouse.id'), primary_key=True)
+    quantity = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'product_id': self.product_id,
+            'warehouse_id': self.warehouse_id,
+            'quantity': self.quantity,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class StockCheckpoint(db.Model):
+    # Movement high-water marks, one row per consumer: every movement with
+    # id <= last_movement_id is folded into stock_snapshot (id 1) or into
+    # movement_rollup (id 2)
+    id = db.Column(db.Integer, primary_key=True)
+    last_movement_id = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'last_movement_id': self.last_movement_id,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
@@ -11,6 +11,10 @@ class Warehouse(db.Model):
     # Relationships
     products = db.relationship('Product', backref='warehouse', lazy=True)
     
+    __table_args__ = (
+        db.Index('idx_warehouse_name', 'name'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -1,25 +1,119 @@
 # Add this to app/routes/__init__.py
-from flask import Blueprint, jsonify
-from app.utils.cache import get_low_stock_alerts
-from app.models.product import Product
+from flask import Blueprint, request, jsonify
+from app.utils.cache import (
+    TOTAL_ALERTS_KEY, warehouse_alerts_key, get_alert_page,
+    count_alerts, get_cached_products
+)
+from app.utils.config import MAX_BULK_IDS
+from app.utils.pagination import decode_cursor, encode_cursor, page_limit
+from app.utils.readers import alert_rows, warehouse_reorder_point_rows, get_warehouse_details
+from app.utils.replicas import replica_reads
 
 alerts_bp = Blueprint('alerts', __name__)
 
+def alert_items(entries, warehouse=None):
+    # entries: [(product_id, deficit)] from the alert index. Product details
+    # come from the cache, with one query for the products that are not cached.
+    product_ids = [product_id for product_id, _ in entries]
+    products = get_cached_products(product_ids)
+    missing = [pid for pid in product_ids if pid not in products]
+    if missing:
+        for row in alert_rows(missing).all():
+            products[row.id] = row._asdict()
+    reorder_points = None
+    if warehouse is not None and product_ids:
+        reorder_points = dict(warehouse_reorder_point_rows(product_ids, warehouse['id']).all())
+    return format_alert_items(entries, products, warehouse, reorder_points)
+
+def format_alert_items(entries, products, warehouse=None, reorder_points=None):
+    # products: {product_id: details}; the async reader loads them itself.
+    # reorder_points: {product_id: reorder point} in the filtered warehouse.
+    reorder_points = reorder_points or {}
+    items = []
+    for product_id, deficit in entries:
+        product = products.get(product_id)
+        if product is None:
+            continue
+
+        # Deficits are measured against the reorder point when there is one;
+        # in a warehouse, the one computed for that warehouse comes first
+        threshold = product.get('reorder_point')
+        if threshold is None:
+            threshold = product['min_stock_level']
+        reorder_point = product.get('reorder_point')
+        if product_id in reorder_points:
+            threshold = reorder_point = reorder_points[product_id]
+
+        item = {
+            'id': product_id,
+            'name': product['name'],
+            'sku': product['sku'],
+            'min_stock_level': product['min_stock_level'],
+            'reorder_point': reorder_point,
+            'warehouse_id': product['warehouse_id'],
+            'warehouse_name': product['warehouse_name'],
+            'stock': threshold - deficit,
+            'deficit': deficit
+        }
+        # With a warehouse filter, stock, deficit and reorder point are for
+        # that warehouse
+        if warehouse is not None:
+            item['warehouse_id'] = warehouse['id']
+            item['warehouse_name'] = warehouse['name']
+        items.append(item)
+
+    return items
+
 @alerts_bp.route('/', methods=['GET'])
+@replica_reads
 def list_alerts():
-    # Get product IDs with low stock
-    low_stock_product_ids = get_low_stock_alerts()
-    
-    # Get product details
-    low_stock_products = Product.query.filter(Product.id.in_(low_stock_product_ids)).all()
-    
-    result = [{
-        'id': p.id,
-        'name': p.name,
-        'sku': p.sku,
-        'min_stock_level': p.min_stock_level,
-        'warehouse_id': p.warehouse_id,
-        'warehouse_name': p.warehouse.name
-    } for p in low_stock_products]
-    
-    return jsonify(result)
\ No newline at end of file
+    # Alerts by total stock, or by stock in one warehouse
+    key = TOTAL_ALERTS_KEY
+    warehouse = None
+    if 'warehouse_id' in request.args:
+        try:
+            warehouse_id = int(request.args['warehouse_id'])
+        except ValueError:
+            return jsonify({'error': 'warehouse_id must be an integer'}), 400
+        warehouse = get_warehouse_details(warehouse_id)
+        key = warehouse_alerts_key(warehouse_id)
+
+    # Cursor pagination when a cursor is given, worst deficit first
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        try:
+            after = decode_cursor(cursor, [int, int])
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+
+        try:
+            limit = page_limit(request.args)
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        entries = get_alert_page(key, after, limit + 1)
+
+        next_cursor = None
+        if len(entries) > limit:
+            entries = entries[:limit]
+            next_cursor = encode_cursor(list(entries[-1]))
+
+        return jsonify({
+            'items': alert_items(entries, warehouse),
+            'pagination': {
+                'limit': limit,
+                'next_cursor': next_cursor,
+                'total': count_alerts(key)
+            }
+        })
+
+    # Without a cursor, every alert, read from the index in chunks
+    items = []
+    after = None
+    while True:
+        entries = get_alert_page(key, after, MAX_BULK_IDS)
+        items += alert_items(entries, warehouse)
+        if len(entries) < MAX_BULK_IDS:
+            break
+        after = entries[-1]
+
+    return jsonify(items)
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+from flask import Blueprint, request, jsonify
+from app.utils.analytics import movement_totals, week_start
+from app.utils.config import ANALYTICS_DEFAULT_DAYS, ANALYTICS_MAX_DAYS
+from app.utils.readers import warehouse_names
+from app.utils.replicas import replica_reads
+
+analytics_bp = Blueprint('analytics', __name__)
+
+GRANULARITIES = {'day', 'week'}
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+@analytics_bp.route('/movements', methods=['GET'])
+@replica_reads
+def get_movement_totals():
+    # Units received and shipped per warehouse per day or week
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        return jsonify({'error': 'granularity must be day or week'}), 400
+
+    try:
+        warehouse_id = int(request.args['warehouse_id']) if 'warehouse_id' in request.args else None
+        product_id = int(request.args['product_id']) if 'product_id' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'warehouse_id and product_id must be integers'}), 400
+
+    try:
+        end = parse_date(request.args['to']) if 'to' in request.args else datetime.utcnow().date()
+        start = (parse_date(request.args['from']) if 'from' in request.args
+                 else end - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1))
+    except ValueError:
+        return jsonify({'error': 'from and to must be dates (YYYY-MM-DD)'}), 400
+
+    # Weeks are reported whole
+    if granularity == 'week':
+        start = week_start(start)
+        end = week_start(end) + timedelta(days=6)
+
+    if start > end:
+        return jsonify({'error': 'from must not be after to'}), 400
+    if (end - start).days + 1 > ANALYTICS_MAX_DAYS:
+        return jsonify({
+            'error': 'Date range too large',
+            'max_days': ANALYTICS_MAX_DAYS
+        }), 400
+
+    totals, rolled_up_to = movement_totals(start, end, warehouse_id, product_id)
+
+    periods = {}
+    for (day, wid), values in totals.items():
+        period = week_start(day) if granularity == 'week' else day
+        current = periods.setdefault((period, wid), [0, 0, 0])
+        for column, value in enumerate(values):
+            current[column] += value
+
+    names = warehouse_names({wid for _, wid in periods})
+
+    return jsonify({
+        'granularity': granularity,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'items': [
+            {
+                'period': period.isoformat(),
+                'warehouse_id': wid,
+                'warehouse_name': names.get(wid),
+                'received': received,
+                'shipped': shipped,
+                'movements': movements
+            }
+            for (period, wid), (received, shipped, movements) in sorted(periods.items())
+        ],
+        'rolled_up_to_movement_id': rolled_up_to
+    })
@@ -0,0 +1,54 @@
+from flask import Blueprint, Response, request, jsonify
+from app.utils.events import EVENT_ID, event_filter, event_stream, subscribe, unsubscribe
+from app.utils.pagination import parse_ids
+from app.utils.config import SSE_MAX_STREAMS
+
+events_bp = Blueprint('events', __name__)
+
+EVENT_TYPES = {'stock', 'alert'}
+
+def stream_args(args, last_event_id):
+    # (event filter, last event id) of a stream request; ValueError with the
+    # message to send back for invalid parameters
+    try:
+        product_ids = set(parse_ids(args.get('product_ids', '')))
+        warehouse_ids = set(parse_ids(args.get('warehouse_ids', '')))
+    except ValueError:
+        raise ValueError('product_ids and warehouse_ids must be comma-separated integers')
+
+    types = {t for t in args.get('types', '').split(',') if t}
+    if types - EVENT_TYPES:
+        raise ValueError('types must be stock and/or alert')
+
+    # EventSource sends Last-Event-ID when it reconnects; the query parameter
+    # lets a new connection resume too
+    last_event_id = last_event_id or args.get('last_event_id')
+    if last_event_id is not None and not EVENT_ID.match(last_event_id):
+        raise ValueError('Invalid Last-Event-ID')
+
+    return event_filter(product_ids, warehouse_ids, types), last_event_id
+
+@events_bp.route('/stock', methods=['GET'])
+def stream_stock_events():
+    try:
+        matches, last_event_id = stream_args(request.args, request.headers.get('Last-Event-ID'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Every open stream pins one of the worker's threads, so a worker serves
+    # at most SSE_MAX_STREAMS; the async server has no such limit
+    subscription = subscribe(matches, SSE_MAX_STREAMS)
+    if subscription is None:
+        return jsonify({
+            'error': 'Too many open event streams, retry shortly',
+            'max_streams': SSE_MAX_STREAMS
+        }), 503, {'Retry-After': '3'}
+
+    response = Response(
+        event_stream(subscription, last_event_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Also releases the slot when the stream never started
+    response.call_on_close(lambda: unsubscribe(subscription))
+    return response
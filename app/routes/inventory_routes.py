@@ -0,0 +1,99 @@
+from flask import Blueprint, request, jsonify
+from app.models.inventory import Inventory
+from app.utils.cache import get_warehouse_stock_matrix, fill_warehouse_stocks
+from app.utils.archive import archived_since
+from app.utils.config import MAX_BULK_IDS
+from app.utils.exporter import export_format, export_response, parse_updated_since
+from app.utils.ingest import ingest_lag
+from app.utils.pagination import parse_ids
+from app.utils.ledger import CHECKPOINT_ID, checkpoint_mark
+from app.utils.readers import inventory_rows, inventory_changes
+from app.utils.replicas import replica_reads
+
+inventory_bp = Blueprint('inventory', __name__)
+
+@inventory_bp.route('/matrix', methods=['GET'])
+@replica_reads
+def get_stock_matrix():
+    try:
+        product_ids = parse_ids(request.args.get('product_ids', ''))
+        warehouse_ids = parse_ids(request.args.get('warehouse_ids', ''))
+    except ValueError:
+        return jsonify({'error': 'product_ids and warehouse_ids must be comma-separated integers'}), 400
+    
+    if not product_ids or not warehouse_ids:
+        return jsonify({'error': 'product_ids and warehouse_ids are required'}), 400
+    
+    if len(product_ids) > MAX_BULK_IDS or len(warehouse_ids) > MAX_BULK_IDS:
+        return jsonify({
+            'error': 'Too many ids',
+            'max_ids': MAX_BULK_IDS
+        }), 400
+    
+    # One pipelined read of every product's per-warehouse hash
+    matrix = get_warehouse_stock_matrix(product_ids, warehouse_ids)
+    
+    # Fill misses from inventory in one query and write them back
+    missing = [pid for pid in product_ids if pid not in matrix]
+    if missing:
+        levels, pending = fill_warehouse_stocks(missing)
+        if pending:
+            return jsonify({
+                'error': 'Stock is being ingested, retry shortly',
+                'pending': pending
+            }), 503
+        for pid, (quantities, _, _) in levels.items():
+            matrix[pid] = [quantities.get(wid, 0) for wid in warehouse_ids]
+    
+    found = [pid for pid in product_ids if pid in matrix]
+    
+    return jsonify({
+        'product_ids': found,
+        'warehouse_ids': warehouse_ids,
+        'quantities': [matrix[pid] for pid in found],
+        'missing': [pid for pid in product_ids if pid not in matrix]
+    })
+
+@inventory_bp.route('/ingest', methods=['GET'])
+def get_ingest_lag():
+    # Movements queued in stream mode and not yet written to the database
+    return jsonify(ingest_lag())
+
+@inventory_bp.route('/export', methods=['GET'])
+@replica_reads
+def export_inventory():
+    # Every inventory row, streamed. after_movement limits it to the pairs
+    # moved since an earlier export, emptied ones included; updated_since to
+    # the rows changed since a time, without the emptied ones.
+    try:
+        fmt = export_format()
+    except ValueError:
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+    
+    try:
+        since = parse_updated_since(request.args['updated_since']) if 'updated_since' in request.args else None
+        after = int(request.args['after_movement']) if 'after_movement' in request.args else None
+        warehouse_id = int(request.args['warehouse_id']) if 'warehouse_id' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'updated_since must be an ISO 8601 timestamp, after_movement and warehouse_id integers'}), 400
+    
+    if since is not None and after is not None:
+        return jsonify({'error': 'updated_since and after_movement cannot be combined'}), 400
+    
+    # Every movement up to the snapshot checkpoint has committed, so the next
+    # export can resume after it without missing a late commit
+    mark = checkpoint_mark(CHECKPOINT_ID)
+    
+    if after is not None:
+        if archived_since(after):
+            return jsonify({'error': 'Movements after after_movement were archived, run a full export'}), 410
+        query = inventory_changes(after, warehouse_id)
+    else:
+        query = inventory_rows()
+        if since is not None:
+            query = query.filter(Inventory.updated_at >= since)
+        if warehouse_id is not None:
+            query = query.filter(Inventory.warehouse_id == warehouse_id)
+        query = query.order_by(Inventory.id)
+
+    return export_response(query, fmt, 'inventory', {'X-Export-Movement-Id': str(mark)})
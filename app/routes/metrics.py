@@ -0,0 +1,9 @@
+from flask import Blueprint, Response
+from app.utils.metrics import render_metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('', methods=['GET'])
+def get_metrics():
+    # Prometheus text exposition, aggregated over every worker process
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
@@ -1,13 +1,32 @@
-from flask import Blueprint, request, jsonify
+from datetime import datetime
+from flask import Blueprint, current_app, request, jsonify
 from app import db
 from app.models.product import Product
 from app.models.stock_movement import StockMovement
 from app.models.inventory import Inventory
 from app.utils.cache import (
-    get_stock_level, set_stock_level, 
-    cache_product, get_cached_product
+    get_stock_levels, set_warehouse_stocks, fill_warehouse_stocks, cache_product
 )
-from app.utils.config import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.utils.serialization import loads
+from app.utils.etags import conditional, conditional_json, read_versions
+from app.utils.config import (
+    MAX_BULK_IDS, IMPORT_CHUNK_SIZE, MAX_IMPORT_ERRORS
+)
+from app.utils.exporter import export_format, export_response, parse_updated_since
+from app.utils.importer import ProductImporter, read_csv, read_ndjson
+from app.utils.pagination import (
+    decode_cursor, encode_cursor, keyset_page, cursor_pagination, parse_ids, page_limit
+)
+from app.utils.readers import (
+    product_rows, movement_rows, archived_movement_rows, serialize_rows,
+    get_product_details, get_products_details, get_product_stock_level
+)
+from app.utils.replicas import replica_reads
+from app.utils.archive import archived_movement_count
+from app.utils.search import (
+    index_products, index_ready, ensure_index, search_product_ids, search_product_ids_sql
+)
+from app.utils.ingest import stream_mode, enqueue_addition, ReservationError
 
 product_bp = Blueprint('products', __name__)
 
@@ -25,8 +44,18 @@ def add_product():
     db.session.add(product)
     db.session.commit()
     
+    # In stream mode the initial stock is reserved in Redis and the movement
+    # is written by the ingest worker
+    if 'stock' in data and data['stock'] > 0 and stream_mode():
+        try:
+            enqueue_addition(
+                product.id, product.warehouse_id, data['stock'], product.stock_threshold
+            )
+        except ReservationError as e:
+            return jsonify(e.to_dict()), e.status
+    
     # Add initial stock movement if stock value provided
-    if 'stock' in data and data['stock'] > 0:
+    elif 'stock' in data and data['stock'] > 0:
         movement = StockMovement(
             product_id=product.id,
             destination_warehouse_id=product.warehouse_id,
@@ -54,42 +83,116 @@ def add_product():
         db.session.commit()
         
         # Cache the stock level
-        set_stock_level(product.id, data['stock'], product.min_stock_level)
+        set_warehouse_stocks({
+            product.id: ({product.warehouse_id: data['stock']}, product.stock_threshold, {})
+        }, notify=True)
     
-    # Cache product details
-    cache_product(product)
+    else:
+        # No stock yet; caching that puts the product in the alert index
+        set_warehouse_stocks({product.id: ({}, product.stock_threshold, {})}, notify=True)
+    
+    # Cache product details and make the product searchable
+    cache_product(product, changed=True)
+    index_products([product.to_dict()])
     
     return jsonify({
         'message': 'Product added successfully',
         'product': product.to_dict()
     }), 201
 
+@product_bp.route('/import', methods=['POST'])
+def import_products():
+    # Format comes from ?format= or the request content type
+    fmt = request.args.get('format')
+    if fmt is None:
+        fmt = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+
+    chunk_size = max(int(request.args.get('chunk_size', IMPORT_CHUNK_SIZE)), 1)
+
+    # Rows are read straight from the request stream, never buffered whole
+    reader = read_csv if fmt == 'csv' else read_ndjson
+    importer = ProductImporter(chunk_size, MAX_IMPORT_ERRORS)
+    summary = importer.run(reader(request.stream))
+
+    return jsonify(dict(summary, message='Import finished'))
+
+@product_bp.route('/export', methods=['GET'])
+@replica_reads
+def export_products():
+    # Whole catalog, streamed; updated_since limits it to recent changes
+    try:
+        fmt = export_format()
+    except ValueError:
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+    
+    try:
+        since = parse_updated_since(request.args['updated_since']) if 'updated_since' in request.args else None
+        warehouse_id = int(request.args['warehouse_id']) if 'warehouse_id' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'updated_since must be an ISO 8601 timestamp and warehouse_id an integer'}), 400
+    
+    query = product_rows()
+    if since is not None:
+        query = query.filter(Product.updated_at >= since)
+    if warehouse_id is not None:
+        query = query.filter(Product.warehouse_id == warehouse_id)
+    
+    return export_response(query.order_by(Product.id), fmt, 'products')
+
 @product_bp.route('/', methods=['GET'])
+@replica_reads
+@conditional(lambda: ['products'])
 def list_products():
+    # Bulk lookup by id when ?ids= is given
+    if 'ids' in request.args:
+        return get_products_bulk()
+    
     # Pagination parameters
     page = int(request.args.get('page', 1))
-    limit = min(
-        int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 
-        MAX_PAGE_SIZE
-    )
+    try:
+        limit = page_limit(request.args)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
     offset = (page - 1) * limit
     
     warehouse_id = request.args.get('warehouse_id')
     
     # Query builder
-    query = Product.query
+    query = product_rows()
+    count_query = Product.query
     
     if warehouse_id:
-        query = query.filter_by(warehouse_id=warehouse_id)
+        query = query.filter(Product.warehouse_id == warehouse_id)
+        count_query = count_query.filter_by(warehouse_id=warehouse_id)
+    
+    # Keyset pagination on id when a cursor is given
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        try:
+            after = decode_cursor(cursor, [int])
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        
+        products, next_cursor = keyset_page(query, [Product.id], after, limit)
+        count_key = None
+        if request.args.get('include_total') in ('1', 'true'):
+            count_key = f"products:{warehouse_id or 'all'}"
+        
+        return jsonify({
+            'items': serialize_rows(products),
+            'pagination': cursor_pagination(limit, next_cursor, count_key, count_query)
+        })
     
     # Get total count for pagination metadata
-    total_count = query.count()
+    total_count = count_query.count()
     
     # Get paginated products
-    products = query.offset(offset).limit(limit).all()
+    products = query.order_by(Product.id).offset(offset).limit(limit).all()
     
     result = {
-        'items': [p.to_dict() for p in products],
+        'items': serialize_rows(products),
         'pagination': {
             'page': page,
             'limit': limit,
@@ -100,44 +203,108 @@ def list_products():
     
     return jsonify(result)
 
-@product_bp.route('/<int:product_id>', methods=['GET'])
-def get_product(product_id):
-    # Try to get from cache first
-    cached_product = get_cached_product(product_id)
-    if cached_product:
-        return jsonify(cached_product)
+def get_products_bulk():
+    try:
+        product_ids = parse_ids(request.args['ids'])
+    except ValueError:
+        return jsonify({'error': 'ids must be a comma-separated list of integers'}), 400
     
-    # If not in cache, get from database
-    product = Product.query.get_or_404(product_id)
+    if len(product_ids) > MAX_BULK_IDS:
+        return jsonify({
+            'error': 'Too many ids',
+            'max_ids': MAX_BULK_IDS,
+            'requested': len(product_ids)
+        }), 400
     
-    # Cache for future requests
-    cache_product(product)
+    # Cache first, then one IN query for the misses
+    products = get_products_details(product_ids)
     
-    return jsonify(product.to_dict())
+    return jsonify({
+        'items': [products[pid] for pid in product_ids if pid in products],
+        'missing': [pid for pid in product_ids if pid not in products]
+    })
+
+@product_bp.route('/search', methods=['GET'])
+@replica_reads
+def search_products():
+    # Prefix or substring match on name and sku, served from the search index
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    
+    match = request.args.get('match', 'substring')
+    if match not in ('prefix', 'substring'):
+        return jsonify({'error': 'match must be prefix or substring'}), 400
+    
+    try:
+        limit = page_limit(request.args)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    
+    # The database answers until the index has been built
+    if index_ready():
+        product_ids = search_product_ids(query, match, limit)
+    else:
+        ensure_index(current_app._get_current_object())
+        product_ids = search_product_ids_sql(query, match, limit)
+    
+    products = get_products_details(product_ids)
+    
+    return jsonify({
+        'query': query,
+        'match': match,
+        'items': [products[pid] for pid in product_ids if pid in products]
+    })
+
+@product_bp.route('/stock', methods=['GET'])
+@replica_reads
+def get_products_stock_bulk():
+    try:
+        product_ids = parse_ids(request.args.get('ids', ''))
+    except ValueError:
+        return jsonify({'error': 'ids must be a comma-separated list of integers'}), 400
+    
+    if len(product_ids) > MAX_BULK_IDS:
+        return jsonify({
+            'error': 'Too many ids',
+            'max_ids': MAX_BULK_IDS,
+            'requested': len(product_ids)
+        }), 400
+    
+    # Cache first, then one grouped query for the misses
+    stock = get_stock_levels(product_ids)
+    missing = [pid for pid in product_ids if pid not in stock]
+    
+    if missing:
+        levels, pending = fill_warehouse_stocks(missing)
+        if pending:
+            return jsonify({
+                'error': 'Stock is being ingested, retry shortly',
+                'pending': pending
+            }), 503
+        stock.update((pid, sum(quantities.values())) for pid, (quantities, _, _) in levels.items())
+    
+    return jsonify({
+        'items': [
+            {'product_id': pid, 'stock_level': stock[pid]}
+            for pid in product_ids if pid in stock
+        ],
+        'missing': [pid for pid in product_ids if pid not in stock]
+    })
+
+@product_bp.route('/<int:product_id>', methods=['GET'])
+@replica_reads
+def get_product(product_id):
+    # Version counter and cached details in one round trip when warm
+    key = f"product:{product_id}"
+    (version,), (data,) = read_versions([key], [key])
+    product = loads(data) if data is not None else get_product_details(product_id)
+    return conditional_json(product, [version], product['updated_at'])
 
 @product_bp.route('/<int:product_id>/stock', methods=['GET'])
+@replica_reads
 def get_product_stock(product_id):
-    # Try to get from cache first
-    stock = get_stock_level(product_id)
-    
-    # If not in cache, calculate from database
-    if stock is None:
-        # Calculate stock based on movements
-        additions = db.session.query(db.func.sum(StockMovement.quantity)).filter(
-            StockMovement.product_id == product_id,
-            StockMovement.destination_warehouse_id.isnot(None)
-        ).scalar() or 0
-        
-        removals = db.session.query(db.func.sum(StockMovement.quantity)).filter(
-            StockMovement.product_id == product_id,
-            StockMovement.source_warehouse_id.isnot(None)
-        ).scalar() or 0
-        
-        stock = additions - removals
-        
-        # Cache the calculated value
-        product = Product.query.get_or_404(product_id)
-        set_stock_level(product_id, stock, product.min_stock_level)
+    stock = get_product_stock_level(product_id)
     
     return jsonify({
         'product_id': product_id,
@@ -145,37 +312,79 @@ def get_product_stock(product_id):
     })
 
 @product_bp.route('/<int:product_id>/movements', methods=['GET'])
+@replica_reads
+@conditional(lambda product_id: ['movements', f"movements:{product_id}"])
 def get_product_movements(product_id):
     # Ensure product exists
     Product.query.get_or_404(product_id)
     
     # Pagination parameters
     page = int(request.args.get('page', 1))
-    limit = min(
-        int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 
-        MAX_PAGE_SIZE
-    )
+    try:
+        limit = page_limit(request.args)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
     offset = (page - 1) * limit
     
-    # Query movements
-    movements = StockMovement.query.filter_by(product_id=product_id)\
-                                    .order_by(StockMovement.timestamp.desc())\
-                                    .offset(offset).limit(limit).all()
+    # Keyset pagination on (timestamp, id) when a cursor is given
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        try:
+            after = decode_cursor(cursor, [datetime, int])
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        
+        movements, next_cursor = keyset_page(
+            movement_rows(product_id), [StockMovement.timestamp, StockMovement.id],
+            after, limit, descending=True
+        )
+        items = serialize_rows(movements)
+        
+        # Past the hot table, continue into the archive
+        archived_count = archived_movement_count(product_id)
+        if next_cursor is None and archived_count:
+            if items:
+                after = [items[-1]['timestamp'], items[-1]['id']]
+            remaining = limit - len(items)
+            archived = archived_movement_rows(product_id, limit=remaining + 1, after=after)
+            items += archived[:remaining]
+            if len(archived) > remaining:
+                next_cursor = encode_cursor([items[-1]['timestamp'], items[-1]['id']])
+        
+        count_key = None
+        if request.args.get('include_total') in ('1', 'true'):
+            count_key = f"movements:{product_id}"
+        
+        pagination = cursor_pagination(
+            limit, next_cursor, count_key,
+            StockMovement.query.filter_by(product_id=product_id)
+        )
+        if count_key is not None:
+            pagination['total'] += archived_count
+        
+        return jsonify({
+            'items': items,
+            'pagination': pagination
+        })
+    
+    # Query movements; pages past the hot table are read from the archive
+    hot_count = StockMovement.query.filter_by(product_id=product_id).count()
+    movements = movement_rows(product_id)\
+                    .order_by(StockMovement.timestamp.desc(), StockMovement.id.desc())\
+                    .offset(offset).limit(limit).all()
+    items = serialize_rows(movements)
+    
+    archived_count = archived_movement_count(product_id)
+    if len(items) < limit and archived_count:
+        items += archived_movement_rows(
+            product_id, max(offset - hot_count, 0), limit - len(items)
+        )
     
     # Get total count for pagination metadata
-    total_count = StockMovement.query.filter_by(product_id=product_id).count()
+    total_count = hot_count + archived_count
     
     result = {
-        'items': [{
-            'id': m.id,
-            'movement_type': m.movement_type,
-            'quantity': m.quantity,
-            'source_warehouse_id': m.source_warehouse_id,
-            'source_warehouse_name': m.source_warehouse.name if m.source_warehouse else None,
-            'destination_warehouse_id': m.destination_warehouse_id,
-            'destination_warehouse_name': m.destination_warehouse.name if m.destination_warehouse else None,
-            'timestamp': m.timestamp.isoformat()
-        } for m in movements],
+        'items': items,
         'pagination': {
             'page': page,
             'limit': limit,
@@ -184,4 +393,4 @@ def get_product_movements(product_id):
         }
     }
     
-    return jsonify(result)
\ No newline at end of file
+    return jsonify(result)
@@ -5,11 +5,22 @@ from app.models.product import Product
 from app.models.stock_movement import StockMovement
 from app.models.inventory import Inventory
 from app.utils.cache import (
-    get_stock_level, set_stock_level, 
-    cache_warehouse, get_cached_warehouse,
+    cache_warehouse, refresh_warehouse_stocks, uncache_products,
     get_low_stock_alerts
 )
-from app.utils.config import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.utils.stock import (
+    upsert_inventory, decrement_inventory, delete_empty_inventory
+)
+from app.utils.pagination import decode_cursor, keyset_page, cursor_pagination, page_limit
+from app.utils.readers import (
+    product_rows, warehouse_rows, serialize_rows, get_product_details,
+    get_products_details, get_warehouse_details, get_product_warehouse_stock
+)
+from app.utils.replicas import replica_reads
+from app.utils.serialization import loads
+from app.utils.etags import conditional, conditional_json, read_versions
+from app.utils.ingest import stream_mode, enqueue_transfer, ReservationError
+from app.utils.config import MAX_TRANSFER_BATCH_SIZE
 
 warehouse_bp = Blueprint('warehouses', __name__)
 
@@ -24,7 +35,7 @@ def add_warehouse():
     db.session.commit()
     
     # Cache warehouse
-    cache_warehouse(warehouse)
+    cache_warehouse(warehouse, changed=True)
     
     return jsonify({
         'message': 'Warehouse added successfully',
@@ -32,23 +43,41 @@ def add_warehouse():
     }), 201
 
 @warehouse_bp.route('/', methods=['GET'])
+@replica_reads
+@conditional(lambda: ['warehouses'])
 def list_warehouses():
     # Pagination parameters
     page = int(request.args.get('page', 1))
-    limit = min(
-        int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 
-        MAX_PAGE_SIZE
-    )
+    try:
+        limit = page_limit(request.args)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
     offset = (page - 1) * limit
     
+    # Keyset pagination on id when a cursor is given
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        try:
+            after = decode_cursor(cursor, [int])
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        
+        warehouses, next_cursor = keyset_page(warehouse_rows(), [Warehouse.id], after, limit)
+        count_key = 'warehouses' if request.args.get('include_total') in ('1', 'true') else None
+        
+        return jsonify({
+            'items': serialize_rows(warehouses),
+            'pagination': cursor_pagination(limit, next_cursor, count_key, Warehouse.query)
+        })
+    
     # Get total count for pagination metadata
     total_count = Warehouse.query.count()
     
     # Get paginated warehouses
-    warehouses = Warehouse.query.offset(offset).limit(limit).all()
+    warehouses = warehouse_rows().order_by(Warehouse.id).offset(offset).limit(limit).all()
     
     result = {
-        'items': [w.to_dict() for w in warehouses],
+        'items': serialize_rows(warehouses),
         'pagination': {
             'page': page,
             'limit': limit,
@@ -60,42 +89,61 @@ def list_warehouses():
     return jsonify(result)
 
 @warehouse_bp.route('/<int:warehouse_id>', methods=['GET'])
+@replica_reads
 def get_warehouse(warehouse_id):
-    # Try to get from cache first
-    cached_warehouse = get_cached_warehouse(warehouse_id)
-    if cached_warehouse:
-        return jsonify(cached_warehouse)
-    
-    # If not in cache, get from database
-    warehouse = Warehouse.query.get_or_404(warehouse_id)
-    
-    # Cache for future requests
-    cache_warehouse(warehouse)
-    
-    return jsonify(warehouse.to_dict())
+    # Version counter and cached details in one round trip when warm
+    key = f"warehouse:{warehouse_id}"
+    (version,), (data,) = read_versions([key], [key])
+    warehouse = loads(data) if data is not None else get_warehouse_details(warehouse_id)
+    return conditional_json(warehouse, [version], warehouse['updated_at'])
 
 @warehouse_bp.route('/<int:warehouse_id>/products', methods=['GET'])
+@replica_reads
+@conditional(lambda warehouse_id: ['products'])
 def list_warehouse_products(warehouse_id):
     # Ensure warehouse exists
     Warehouse.query.get_or_404(warehouse_id)
     
     # Pagination parameters
     page = int(request.args.get('page', 1))
-    limit = min(
-        int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 
-        MAX_PAGE_SIZE
-    )
+    try:
+        limit = page_limit(request.args)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
     offset = (page - 1) * limit
     
+    # Keyset pagination on id when a cursor is given
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        try:
+            after = decode_cursor(cursor, [int])
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        
+        query = product_rows().filter(Product.warehouse_id == warehouse_id)
+        products, next_cursor = keyset_page(query, [Product.id], after, limit)
+        count_key = None
+        if request.args.get('include_total') in ('1', 'true'):
+            count_key = f"products:{warehouse_id}"
+        
+        return jsonify({
+            'items': serialize_rows(products),
+            'pagination': cursor_pagination(
+                limit, next_cursor, count_key,
+                Product.query.filter_by(warehouse_id=warehouse_id)
+            )
+        })
+    
     # Get total count for pagination metadata
     total_count = Product.query.filter_by(warehouse_id=warehouse_id).count()
     
     # Get paginated products
-    products = Product.query.filter_by(warehouse_id=warehouse_id)\
-                            .offset(offset).limit(limit).all()
+    products = product_rows().filter(Product.warehouse_id == warehouse_id)\
+                             .order_by(Product.id)\
+                             .offset(offset).limit(limit).all()
     
     result = {
-        'items': [p.to_dict() for p in products],
+        'items': serialize_rows(products),
         'pagination': {
             'page': page,
             'limit': limit,
@@ -113,7 +161,17 @@ def transfer_products():
     product_id = data['product_id']
     source_warehouse_id = data['source_warehouse_id']
     destination_warehouse_id = data['destination_warehouse_id']
-    quantity = data['quantity']
+    
+    try:
+        quantity = int(data['quantity'])
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid quantity'}), 400
+    
+    if quantity <= 0:
+        return jsonify({'error': 'Quantity must be positive'}), 400
+    
+    if stream_mode():
+        return queue_transfer(product_id, source_warehouse_id, destination_warehouse_id, quantity)
     
     # Validate source warehouse has the product
     product = Product.query.filter_by(
@@ -124,57 +182,38 @@ def transfer_products():
     # Check if destination warehouse exists
     Warehouse.query.get_or_404(destination_warehouse_id)
     
-    # Check current stock level in source warehouse
-    source_inventory = Inventory.query.filter_by(
-        product_id=product_id,
-        warehouse_id=source_warehouse_id
-    ).first()
-    
-    if source_inventory and source_inventory.quantity >= quantity:
-        current_stock = source_inventory.quantity
-    else:
-        # Fallback to calculating from movements if inventory record doesn't exist
-        additions = db.session.query(db.func.sum(StockMovement.quantity)).filter(
-            StockMovement.product_id == product_id,
-            StockMovement.destination_warehouse_id == source_warehouse_id
-        ).scalar() or 0
-        
-        removals = db.session.query(db.func.sum(StockMovement.quantity)).filter(
-            StockMovement.product_id == product_id,
-            StockMovement.source_warehouse_id == source_warehouse_id
+    source_key = (product_id, source_warehouse_id)
+    destination = {
+        'product_id': product_id,
+        'warehouse_id': destination_warehouse_id,
+        'quantity': quantity
+    }
+    
+    # Touch rows in (product_id, warehouse_id) order so opposite transfers
+    # of the same product cannot deadlock
+    if destination_warehouse_id < source_warehouse_id:
+        upsert_inventory([destination])
+    
+    # Decrement source stock atomically; zero affected rows means not enough stock
+    if not decrement_inventory(product_id, source_warehouse_id, quantity):
+        db.session.rollback()
+        available = db.session.query(Inventory.quantity).filter_by(
+            product_id=product_id,
+            warehouse_id=source_warehouse_id
         ).scalar() or 0
-        
-        current_stock = additions - removals
-        
-    # Ensure there's enough stock
-    if current_stock < quantity:
         return jsonify({
             'error': 'Insufficient stock',
-            'available': current_stock,
+            'available': available,
             'requested': quantity
         }), 400
     
-    # Update source inventory
-    if source_inventory:
-        source_inventory.quantity -= quantity
-        if source_inventory.quantity <= 0:
-            db.session.delete(source_inventory)
-    
-    # Update destination inventory
-    dest_inventory = Inventory.query.filter_by(
-        product_id=product_id,
-        warehouse_id=destination_warehouse_id
-    ).first()
+    if destination_warehouse_id >= source_warehouse_id:
+        upsert_inventory([destination])
     
-    if dest_inventory:
-        dest_inventory.quantity += quantity
-    else:
-        dest_inventory = Inventory(
-            product_id=product_id,
-            warehouse_id=destination_warehouse_id,
-            quantity=quantity
-        )
-        db.session.add(dest_inventory)
+    # Update product warehouse if all stock is transferred
+    moved = delete_empty_inventory([source_key])
+    if moved:
+        product.warehouse_id = destination_warehouse_id
     
     # Create transfer movement
     movement = StockMovement(
@@ -185,20 +224,15 @@ def transfer_products():
         movement_type='transfer'
     )
     
-    # Update product warehouse if all stock is transferred
-    if source_inventory is None or source_inventory.quantity <= 0:
-        product.warehouse_id = destination_warehouse_id
-    
     db.session.add(movement)
     db.session.commit()
     
     # Update cache
-    # Get total stock across all warehouses
-    total_stock = db.session.query(db.func.sum(Inventory.quantity)).filter(
-        Inventory.product_id == product_id
-    ).scalar() or 0
-    
-    set_stock_level(product_id, total_stock, product.min_stock_level)
+    # Get stock in every warehouse; the total is derived from it
+    refresh_warehouse_stocks([product_id])
+    if moved:
+        # The product followed its stock; reload it on the next read
+        uncache_products([product_id])
     
     return jsonify({
         'message': 'Product transferred successfully',
@@ -212,44 +246,259 @@ def transfer_products():
         }
     })
 
-@warehouse_bp.route('/<int:warehouse_id>/products/<int:product_id>/stock', methods=['GET'])
-def get_warehouse_product_stock(warehouse_id, product_id):
-    # Ensure warehouse and product exist
-    warehouse = Warehouse.query.get_or_404(warehouse_id)
-    product = Product.query.get_or_404(product_id)
-    
-    # Try to get from inventory model if it exists
-    inventory = Inventory.query.filter_by(
-        warehouse_id=warehouse_id,
-        product_id=product_id
-    ).first()
+def queue_transfer(product_id, source_warehouse_id, destination_warehouse_id, quantity):
+    # Stream mode: reserve the stock in Redis and let the ingest worker write
+    # the movement. As in sync mode, the source must be the product's home
+    # warehouse; the reservation checks it against transfers still queued.
+    if source_warehouse_id == destination_warehouse_id:
+        return jsonify({'error': 'Source and destination are the same'}), 400
+    
+    # Existence checks come from the cache when warm
+    product = get_product_details(product_id)
+    get_warehouse_details(source_warehouse_id)
+    get_warehouse_details(destination_warehouse_id)
+    
+    try:
+        event = enqueue_transfer(
+            product_id, source_warehouse_id, destination_warehouse_id, quantity,
+            product['warehouse_id']
+        )
+    except ReservationError as e:
+        return jsonify(e.to_dict()), e.status
     
-    if inventory:
+    return jsonify({
+        'message': 'Transfer queued',
+        'movement': {
+            'event_id': event['event_id'],
+            'product_id': product_id,
+            'source_warehouse_id': source_warehouse_id,
+            'destination_warehouse_id': destination_warehouse_id,
+            'quantity': quantity,
+            'timestamp': event['timestamp']
+        }
+    }), 202
+
+@warehouse_bp.route('/transfer/batch', methods=['POST'])
+def transfer_products_batch():
+    data = request.json or {}
+    transfers = data.get('transfers')
+
+    if not isinstance(transfers, list) or not transfers:
+        return jsonify({'error': 'transfers must be a non-empty list'}), 400
+
+    if len(transfers) > MAX_TRANSFER_BATCH_SIZE:
         return jsonify({
+            'error': 'Batch too large',
+            'max_batch_size': MAX_TRANSFER_BATCH_SIZE,
+            'requested': len(transfers)
+        }), 400
+
+    results = [None] * len(transfers)
+    valid = []
+
+    # Validate shape of every item before touching the database
+    for index, item in enumerate(transfers):
+        try:
+            product_id = int(item['product_id'])
+            source_warehouse_id = int(item['source_warehouse_id'])
+            destination_warehouse_id = int(item['destination_warehouse_id'])
+            quantity = int(item['quantity'])
+        except (KeyError, TypeError, ValueError):
+            results[index] = {'index': index, 'status': 'failed', 'error': 'Invalid transfer'}
+            continue
+
+        if quantity <= 0:
+            results[index] = {'index': index, 'status': 'failed', 'error': 'Quantity must be positive'}
+            continue
+
+        if source_warehouse_id == destination_warehouse_id:
+            results[index] = {'index': index, 'status': 'failed', 'error': 'Source and destination are the same'}
+            continue
+
+        valid.append((index, product_id, source_warehouse_id, destination_warehouse_id, quantity))
+
+    product_ids = {t[1] for t in valid}
+    warehouse_ids = {t[2] for t in valid} | {t[3] for t in valid}
+    
+    if stream_mode():
+        return queue_transfer_batch(valid, results, product_ids, warehouse_ids)
+
+    # Set-based lookups for products and warehouses
+    products = {}
+    if product_ids:
+        products = {
+            row.id: row for row in db.session.query(
+                Product.id, Product.warehouse_id, Product.min_stock_level
+            ).filter(Product.id.in_(product_ids)).all()
+        }
+
+    existing_warehouses = set()
+    if warehouse_ids:
+        existing_warehouses = {
+            row.id for row in db.session.query(Warehouse.id)
+                                          .filter(Warehouse.id.in_(warehouse_ids)).all()
+        }
+
+    # Lock every affected inventory row in a fixed order to avoid deadlocks
+    pairs = sorted({(t[1], t[2]) for t in valid} | {(t[1], t[3]) for t in valid})
+    stock = {}
+    if pairs:
+        locked = db.session.query(
+            Inventory.product_id, Inventory.warehouse_id, Inventory.quantity
+        ).filter(
+            db.tuple_(Inventory.product_id, Inventory.warehouse_id).in_(pairs)
+        ).order_by(
+            Inventory.product_id, Inventory.warehouse_id
+        ).with_for_update().all()
+        stock = {(row.product_id, row.warehouse_id): row.quantity for row in locked}
+
+    home_warehouse = {pid: row.warehouse_id for pid, row in products.items()}
+    deltas = {}
+    movements = []
+
+    # Apply transfers in request order against the locked quantities
+    for index, product_id, source_warehouse_id, destination_warehouse_id, quantity in valid:
+        if product_id not in products or home_warehouse[product_id] != source_warehouse_id:
+            results[index] = {'index': index, 'status': 'failed', 'error': 'Product not found in source warehouse'}
+            continue
+
+        if destination_warehouse_id not in existing_warehouses:
+            results[index] = {'index': index, 'status': 'failed', 'error': 'Destination warehouse not found'}
+            continue
+
+        source_key = (product_id, source_warehouse_id)
+        destination_key = (product_id, destination_warehouse_id)
+        available = stock.get(source_key, 0)
+
+        if available < quantity:
+            results[index] = {
+                'index': index,
+                'status': 'failed',
+                'error': 'Insufficient stock',
+                'available': available,
+                'requested': quantity
+            }
+            continue
+
+        stock[source_key] = available - quantity
+        stock[destination_key] = stock.get(destination_key, 0) + quantity
+        deltas[source_key] = deltas.get(source_key, 0) - quantity
+        deltas[destination_key] = deltas.get(destination_key, 0) + quantity
+
+        # Update product warehouse if all stock is transferred
+        if stock[source_key] <= 0:
+            home_warehouse[product_id] = destination_warehouse_id
+
+        movements.append({
             'product_id': product_id,
-            'product_name': product.name,
-            'warehouse_id': warehouse_id,
-            'warehouse_name': warehouse.name,
-            'stock_level': inventory.quantity
+            'source_warehouse_id': source_warehouse_id,
+            'destination_warehouse_id': destination_warehouse_id,
+            'quantity': quantity,
+            'movement_type': 'transfer'
         })
+
+        results[index] = {
+            'index': index,
+            'status': 'succeeded',
+            'product_id': product_id,
+            'source_warehouse_id': source_warehouse_id,
+            'destination_warehouse_id': destination_warehouse_id,
+            'quantity': quantity
+        }
+
+    if movements:
+        db.session.execute(db.insert(StockMovement), movements)
+
+        upsert_inventory([
+            {'product_id': pid, 'warehouse_id': wid, 'quantity': delta}
+            for (pid, wid), delta in sorted(deltas.items()) if delta
+        ])
+        delete_empty_inventory([key for key, delta in deltas.items() if delta < 0])
+
+        moved_products = [
+            {'id': pid, 'warehouse_id': wid}
+            for pid, wid in home_warehouse.items()
+            if wid != products[pid].warehouse_id
+        ]
+        if moved_products:
+            db.session.execute(db.update(Product), moved_products)
+
+    db.session.commit()
+
+    # Refresh every touched stock key in one pipeline
+    touched = {m['product_id'] for m in movements}
+    refresh_warehouse_stocks(touched)
+    # Products that followed their stock are reloaded on the next read
+    uncache_products([
+        pid for pid, wid in home_warehouse.items() if wid != products[pid].warehouse_id
+    ])
+
+    return batch_response(results)
+
+def batch_response(results, status=200):
+    succeeded = sum(1 for r in results if r['status'] in ('succeeded', 'queued'))
     
-    # If no inventory record exists, calculate from movements
-    additions = db.session.query(db.func.sum(StockMovement.quantity)).filter(
-        StockMovement.product_id == product_id,
-        StockMovement.destination_warehouse_id == warehouse_id
-    ).scalar() or 0
+    return jsonify({
+        'message': 'Batch transfer processed',
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'results': results
+    }), status
+
+def queue_transfer_batch(valid, results, product_ids, warehouse_ids):
+    # Stream mode: each transfer is reserved in Redis on its own, in request order
+    products = get_products_details(list(product_ids))
+    existing_warehouses = {
+        row.id for row in db.session.query(Warehouse.id)
+                                      .filter(Warehouse.id.in_(warehouse_ids)).all()
+    } if warehouse_ids else set()
+    
+    for index, product_id, source_warehouse_id, destination_warehouse_id, quantity in valid:
+        if product_id not in products:
+            results[index] = {'index': index, 'status': 'failed', 'error': 'Product not found in source warehouse'}
+            continue
+        if source_warehouse_id not in existing_warehouses:
+            results[index] = {'index': index, 'status': 'failed', 'error': 'Source warehouse not found'}
+            continue
+        if destination_warehouse_id not in existing_warehouses:
+            results[index] = {'index': index, 'status': 'failed', 'error': 'Destination warehouse not found'}
+            continue
+        
+        try:
+            event = enqueue_transfer(
+                product_id, source_warehouse_id, destination_warehouse_id, quantity,
+                products[product_id]['warehouse_id']
+            )
+        except ReservationError as e:
+            results[index] = {'index': index, 'status': 'failed', **e.to_dict()}
+            continue
+        
+        results[index] = {
+            'index': index,
+            'status': 'queued',
+            'event_id': event['event_id'],
+            'product_id': product_id,
+            'source_warehouse_id': source_warehouse_id,
+            'destination_warehouse_id': destination_warehouse_id,
+            'quantity': quantity
+        }
     
-    removals = db.session.query(db.func.sum(StockMovement.quantity)).filter(
-        StockMovement.product_id == product_id,
-        StockMovement.source_warehouse_id == warehouse_id
-    ).scalar() or 0
+    return batch_response(results, 202)
+
+@warehouse_bp.route('/<int:warehouse_id>/products/<int:product_id>/stock', methods=['GET'])
+@replica_reads
+def get_warehouse_product_stock(warehouse_id, product_id):
+    # Ensure warehouse and product exist; both come from the cache when warm
+    warehouse = get_warehouse_details(warehouse_id)
+    product = get_product_details(product_id)
     
-    stock_level = additions - removals
+    # Stock per warehouse is cached as one hash per product
+    quantities = get_product_warehouse_stock(product_id) or {}
     
     return jsonify({
         'product_id': product_id,
-        'product_name': product.name,
+        'product_name': product['name'],
         'warehouse_id': warehouse_id,
-        'warehouse_name': warehouse.name,
-        'stock_level': stock_level
-    })
\ No newline at end of file
+        'warehouse_name': warehouse['name'],
+        'stock_level': quantities.get(warehouse_id, 0)
+    })
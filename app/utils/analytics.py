@@ -0,0 +1,189 @@
+from datetime import date, timedelta
+from app import db
+from app.models.movement_rollup import MovementRollup
+from app.models.stock_movement import StockMovement
+from app.models.stock_snapshot import StockCheckpoint
+from app.utils.ledger import checkpoint_mark, lock_checkpoint, settled_window
+from app.utils.stock import upsert_rows
+
+# Movement analytics. movement_rollup holds units received and shipped per
+# (day, warehouse, product) for every movement up to its own checkpoint row.
+# Queries read the rollup rows for the requested range plus the few movements
+# past the checkpoint, so their cost follows the range, not the history.
+
+ROLLUP_CHECKPOINT_ID = 2
+
+# Columns of the aggregated value arrays
+RECEIVED, SHIPPED, MOVEMENTS = range(3)
+
+EPOCH = date(1970, 1, 1)
+
+# numpy is imported where it is used; the routes importing this module
+# should not pay for it at worker startup
+
+def _fold(keys, values):
+    # Sums the value rows that share a key row: (unique keys, totals)
+    import numpy as np
+
+    if not len(keys):
+        return keys, values
+    unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+    totals = np.zeros((len(unique), values.shape[1]), dtype=np.int64)
+    np.add.at(totals, inverse.reshape(-1), values)
+    return unique, totals
+
+def aggregate_movements(rows):
+    # rows: [(product_id, source_warehouse_id, destination_warehouse_id,
+    # quantity, timestamp)]. Returns (keys, totals): keys are (day, warehouse_id,
+    # product_id) rows with day in days since the epoch, totals are
+    # (received, shipped, movements) rows. A transfer counts in both warehouses.
+    import numpy as np
+
+    if not rows:
+        return np.empty((0, 3), dtype=np.int64), np.empty((0, 3), dtype=np.int64)
+
+    data = np.array(
+        [(row[0], row[1] or 0, row[2] or 0, row[3]) for row in rows],
+        dtype=np.int64
+    )
+    days = np.array([row[4] for row in rows], dtype='datetime64[D]').astype(np.int64)
+    product_ids, sources, destinations, quantities = data.T
+
+    received = destinations > 0
+    shipped = sources > 0
+    zeros = np.zeros(len(rows), dtype=np.int64)
+    ones = np.ones(len(rows), dtype=np.int64)
+
+    keys = np.concatenate([
+        np.column_stack([days, destinations, product_ids])[received],
+        np.column_stack([days, sources, product_ids])[shipped]
+    ])
+    values = np.concatenate([
+        np.column_stack([quantities, zeros, ones])[received],
+        np.column_stack([zeros, quantities, ones])[shipped]
+    ])
+    return _fold(keys, values)
+
+def _movement_rows(*criteria):
+    return db.session.query(
+        StockMovement.product_id,
+        StockMovement.source_warehouse_id,
+        StockMovement.destination_warehouse_id,
+        StockMovement.quantity,
+        StockMovement.timestamp
+    ).filter(*criteria)
+
+def _aggregate_streamed(query, chunk_size):
+    # Aggregates a movement query chunk by chunk, so memory follows the number
+    # of distinct keys rather than the number of movements
+    import numpy as np
+
+    keys, totals = aggregate_movements([])
+    result = db.session.execute(
+        query.statement.execution_options(yield_per=chunk_size)
+    )
+    for chunk in result.partitions(chunk_size):
+        chunk_keys, chunk_totals = aggregate_movements(chunk)
+        keys, totals = _fold(
+            np.concatenate([keys, chunk_keys]),
+            np.concatenate([totals, chunk_totals])
+        )
+    return keys, totals
+
+def _to_date(day):
+    return EPOCH + timedelta(days=int(day))
+
+# Writes: fold settled movements into the rollup
+def advance_rollups(batch_size=100000, chunk_size=10000):
+    # Folds up to batch_size settled movements past the rollup checkpoint into
+    # movement_rollup. Returns the number of movements folded.
+    low = checkpoint_mark(ROLLUP_CHECKPOINT_ID)
+    high, count = settled_window(low, batch_size)
+    if not count:
+        return 0
+
+    checkpoint = lock_checkpoint(ROLLUP_CHECKPOINT_ID)
+    if checkpoint.last_movement_id != low:
+        # Another run folded this window first
+        db.session.commit()
+        return 0
+
+    keys, totals = _aggregate_streamed(
+        _movement_rows(StockMovement.id > low, StockMovement.id <= high),
+        chunk_size
+    )
+
+    upsert_rows(MovementRollup, [
+        {
+            'day': _to_date(day),
+            'warehouse_id': int(warehouse_id),
+            'product_id': int(product_id),
+            'received': int(received),
+            'shipped': int(shipped),
+            'movements': int(movements)
+        }
+        for (day, warehouse_id, product_id), (received, shipped, movements)
+        in zip(keys.tolist(), totals.tolist())
+    ], index_elements=['day', 'warehouse_id', 'product_id'],
+       add=['received', 'shipped', 'movements'])
+
+    checkpoint.last_movement_id = high
+    db.session.commit()
+    return count
+
+def rollup_checkpoint():
+    checkpoint = db.session.get(StockCheckpoint, ROLLUP_CHECKPOINT_ID)
+    return checkpoint.last_movement_id if checkpoint else 0
+
+# Reads
+def movement_totals(start, end, warehouse_id=None, product_id=None):
+    # {(day, warehouse_id): [received, shipped, movements]} for start <= day
+    # <= end, optionally for one warehouse and/or product. Also returns the
+    # rollup checkpoint the totals were read at.
+    high_water = rollup_checkpoint()
+
+    query = db.session.query(
+        MovementRollup.day,
+        MovementRollup.warehouse_id,
+        db.func.sum(MovementRollup.received),
+        db.func.sum(MovementRollup.shipped),
+        db.func.sum(MovementRollup.movements)
+    ).filter(MovementRollup.day >= start, MovementRollup.day <= end)
+    if warehouse_id is not None:
+        query = query.filter(MovementRollup.warehouse_id == warehouse_id)
+    if product_id is not None:
+        query = query.filter(MovementRollup.product_id == product_id)
+
+    totals = {}
+    for day, wid, received, shipped, movements in query.group_by(
+        MovementRollup.day, MovementRollup.warehouse_id
+    ):
+        totals[(day, wid)] = [int(received), int(shipped), int(movements)]
+
+    # Movements past the checkpoint are not rolled up yet
+    recent = _movement_rows(
+        StockMovement.id > high_water,
+        StockMovement.timestamp >= start,
+        StockMovement.timestamp < end + timedelta(days=1)
+    )
+    if warehouse_id is not None:
+        recent = recent.filter(db.or_(
+            StockMovement.source_warehouse_id == warehouse_id,
+            StockMovement.destination_warehouse_id == warehouse_id
+        ))
+    if product_id is not None:
+        recent = recent.filter(StockMovement.product_id == product_id)
+
+    keys, recent_totals = aggregate_movements(recent.all())
+    for (day, wid, _), values in zip(keys.tolist(), recent_totals.tolist()):
+        if warehouse_id is not None and wid != warehouse_id:
+            continue
+        current = totals.setdefault((_to_date(day), wid), [0, 0, 0])
+        for column, value in enumerate(values):
+            current[column] += value
+
+    return totals, high_water
+
+def week_start(day):
+    # Weeks start on Monday
+    return day - timedelta(days=day.weekday())
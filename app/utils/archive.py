@@ -0,0 +1,351 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from app import db, redis_client
+from app.models.stock_movement import StockMovement
+from app.models.stock_snapshot import StockCheckpoint
+from app.models.movement_segment import MovementSegment, MovementSegmentProduct
+from app.utils.config import ARCHIVE_DIR, ARCHIVE_SEGMENT_ROWS, ARCHIVE_BLOCK_ROWS
+from app.utils.analytics import ROLLUP_CHECKPOINT_ID
+from app.utils.etags import bump_versions
+from app.utils.ledger import CHECKPOINT_ID
+
+# Segment file layout:
+#   MAGIC | header length (uint32 LE) | JSON header | compressed column blocks
+# Rows are sorted by (product_id, timestamp desc, id desc) and split into
+# blocks; each block stores every column as a zlib-compressed int64 array and
+# carries its min/max product_id, so a lookup only inflates blocks that can
+# hold the product. The header also counts rows per product; the counts are
+# copied into movement_segment_product so listings never read headers.
+MAGIC = b'INVSEG1\n'
+COLUMNS = (
+    'id', 'product_id', 'source_warehouse_id', 'destination_warehouse_id',
+    'quantity', 'movement_type', 'timestamp'
+)
+EPOCH = datetime(1970, 1, 1)
+DELETE_CHUNK_SIZE = 1000
+SEGMENT_CACHE_SIZE = 64
+ARCHIVED_COUNTS_KEY = 'archive:counts'
+
+def _to_micros(value):
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+def _from_micros(value):
+    return EPOCH + timedelta(microseconds=value)
+
+def _pack(values):
+    data = array('q', values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return zlib.compress(data.tobytes(), 6)
+
+def _unpack(data):
+    values = array('q')
+    values.frombytes(zlib.decompress(data))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def _row_key(row):
+    return (row.product_id, -_to_micros(row.timestamp), -row.id)
+
+# Writing
+def write_segment(path, rows, block_rows=ARCHIVE_BLOCK_ROWS):
+    # rows: movement rows of one month. Written to a temporary file and
+    # renamed into place, so a crash never leaves a partial segment behind.
+    rows = sorted(rows, key=_row_key)
+    movement_types = sorted({row.movement_type for row in rows})
+    type_index = {name: i for i, name in enumerate(movement_types)}
+
+    products = {}
+    for row in rows:
+        products[row.product_id] = products.get(row.product_id, 0) + 1
+
+    blocks = []
+    payload = bytearray()
+    for start in range(0, len(rows), block_rows):
+        chunk = rows[start:start + block_rows]
+        columns = {
+            'id': [row.id for row in chunk],
+            'product_id': [row.product_id for row in chunk],
+            # Warehouse ids start at 1, so 0 stands for NULL
+            'source_warehouse_id': [row.source_warehouse_id or 0 for row in chunk],
+            'destination_warehouse_id': [row.destination_warehouse_id or 0 for row in chunk],
+            'quantity': [row.quantity for row in chunk],
+            'movement_type': [type_index[row.movement_type] for row in chunk],
+            'timestamp': [_to_micros(row.timestamp) for row in chunk]
+        }
+        block = {
+            'rows': len(chunk),
+            'min_product_id': chunk[0].product_id,
+            'max_product_id': chunk[-1].product_id,
+            'columns': {}
+        }
+        for name in COLUMNS:
+            data = _pack(columns[name])
+            block['columns'][name] = [len(payload), len(data)]
+            payload += data
+        blocks.append(block)
+
+    header = json.dumps({
+        'rows': len(rows),
+        'movement_types': movement_types,
+        'products': {str(pid): count for pid, count in products.items()},
+        'blocks': blocks
+    }, separators=(',', ':')).encode()
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+# Reading
+class Segment:
+    # Read-only, memory-mapped view of one segment file
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'Not a movement segment: {path}')
+        start = len(MAGIC)
+        (header_length,) = struct.unpack('<I', self._data[start:start + 4])
+        start += 4
+        header = json.loads(self._data[start:start + header_length])
+
+        self.rows = header['rows']
+        self.movement_types = header['movement_types']
+        self.products = {int(pid): count for pid, count in header['products'].items()}
+        self.blocks = header['blocks']
+        self._data_start = start + header_length
+
+    def _column(self, block, name):
+        offset, length = block['columns'][name]
+        start = self._data_start + offset
+        return _unpack(self._data[start:start + length])
+
+    def product_rows(self, product_id):
+        # Movements of one product, newest first
+        if product_id not in self.products:
+            return []
+
+        rows = []
+        for block in self.blocks:
+            if not block['min_product_id'] <= product_id <= block['max_product_id']:
+                continue
+            product_ids = self._column(block, 'product_id')
+            lo = bisect_left(product_ids, product_id)
+            hi = bisect_right(product_ids, product_id)
+            if lo == hi:
+                continue
+
+            columns = {
+                name: self._column(block, name)[lo:hi]
+                for name in COLUMNS if name != 'product_id'
+            }
+            for i in range(hi - lo):
+                rows.append({
+                    'id': columns['id'][i],
+                    'movement_type': self.movement_types[columns['movement_type'][i]],
+                    'quantity': columns['quantity'][i],
+                    'source_warehouse_id': columns['source_warehouse_id'][i] or None,
+                    'destination_warehouse_id': columns['destination_warehouse_id'][i] or None,
+                    'timestamp': _from_micros(columns['timestamp'][i])
+                })
+        return rows
+
+_segments = OrderedDict()
+_segments_lock = threading.Lock()
+
+def open_segment(path):
+    # Segments are immutable, so open ones are kept in a small LRU
+    with _segments_lock:
+        segment = _segments.get(path)
+        if segment is not None:
+            _segments.move_to_end(path)
+            return segment
+
+    segment = Segment(os.path.join(ARCHIVE_DIR, path))
+    with _segments_lock:
+        _segments[path] = segment
+        while len(_segments) > SEGMENT_CACHE_SIZE:
+            _segments.popitem(last=False)
+    return segment
+
+def _segments_for(product_id):
+    # Manifest entries holding rows of product_id, newest month first
+    return MovementSegment.query.join(
+        MovementSegmentProduct, MovementSegmentProduct.segment_id == MovementSegment.id
+    ).filter(
+        MovementSegmentProduct.product_id == product_id
+    ).order_by(MovementSegment.month.desc(), MovementSegment.id).all()
+
+def archived_count_query(product_id):
+    return db.select(
+        db.func.coalesce(db.func.sum(MovementSegmentProduct.row_count), 0)
+    ).where(MovementSegmentProduct.product_id == product_id)
+
+def archived_movement_count(product_id):
+    # Cached in one Redis hash. Archival runs overwrite the fields of the
+    # products they touch; fills only set missing fields, so a fill read
+    # before an archival commit never hides its totals.
+    count = redis_client.hget(ARCHIVED_COUNTS_KEY, product_id)
+    if count is None:
+        count = db.session.scalar(archived_count_query(product_id))
+        redis_client.hsetnx(ARCHIVED_COUNTS_KEY, product_id, count)
+    return int(count)
+
+def archived_since(movement_id):
+    # Whether a movement after movement_id was moved into a segment file
+    return db.session.query(
+        db.exists().where(MovementSegment.max_movement_id > movement_id)
+    ).scalar()
+
+def archived_movements(product_id, after=None):
+    # Yields archived movements of a product newest first, as dicts without
+    # warehouse names. after: (timestamp, id) keyset position to seek past.
+    months = OrderedDict()
+    for entry in _segments_for(product_id):
+        if after is not None and entry.min_timestamp > after[0]:
+            continue
+        months.setdefault(entry.month, []).append(entry)
+
+    for entries in months.values():
+        rows = []
+        for entry in entries:
+            rows.extend(open_segment(entry.path).product_rows(product_id))
+        # Segments of one month come from separate runs and may interleave
+        if len(entries) > 1:
+            rows.sort(key=lambda row: (row['timestamp'], row['id']), reverse=True)
+
+        for row in rows:
+            if after is not None and (row['timestamp'], row['id']) >= tuple(after):
+                continue
+            yield row
+
+# Archival
+def _add_segment_products(segment_id, products):
+    db.session.execute(db.insert(MovementSegmentProduct), [
+        {'product_id': product_id, 'segment_id': segment_id, 'row_count': count}
+        for product_id, count in products.items()
+    ])
+
+def _refresh_archived_counts(product_ids):
+    # Fresh totals for the archived_movement_count cache, after a commit
+    product_ids = sorted(product_ids)
+    for start in range(0, len(product_ids), DELETE_CHUNK_SIZE):
+        counts = dict(
+            db.session.query(
+                MovementSegmentProduct.product_id,
+                db.func.sum(MovementSegmentProduct.row_count)
+            ).filter(
+                MovementSegmentProduct.product_id.in_(product_ids[start:start + DELETE_CHUNK_SIZE])
+            ).group_by(MovementSegmentProduct.product_id).all()
+        )
+        if counts:
+            redis_client.hset(ARCHIVED_COUNTS_KEY, mapping=counts)
+
+def index_segments():
+    # Copies per-product row counts out of the headers of segments listed
+    # before movement_segment_product existed. Returns segments indexed.
+    entries = MovementSegment.query.filter(
+        ~db.exists().where(MovementSegmentProduct.segment_id == MovementSegment.id)
+    ).all()
+    product_ids = set()
+    for entry in entries:
+        products = open_segment(entry.path).products
+        _add_segment_products(entry.id, products)
+        product_ids.update(products)
+    db.session.commit()
+    _refresh_archived_counts(product_ids)
+    return len(entries)
+
+def archive_movements(before, segment_rows=ARCHIVE_SEGMENT_ROWS):
+    # Moves movements older than before into monthly segment files. Only
+    # movements already folded into stock_snapshot and movement_rollup are
+    # archived, so those rows stand in for them. Returns rows archived.
+    checkpoints = [
+        db.session.get(StockCheckpoint, checkpoint_id)
+        for checkpoint_id in (CHECKPOINT_ID, ROLLUP_CHECKPOINT_ID)
+    ]
+    high_water = min(
+        checkpoint.last_movement_id if checkpoint else 0
+        for checkpoint in checkpoints
+    )
+    archivable = db.and_(
+        StockMovement.id <= high_water,
+        StockMovement.timestamp < before
+    )
+
+    index_segments()
+
+    archived = 0
+    while True:
+        rows = db.session.query(
+            StockMovement.id,
+            StockMovement.product_id,
+            StockMovement.source_warehouse_id,
+            StockMovement.destination_warehouse_id,
+            StockMovement.quantity,
+            StockMovement.movement_type,
+            StockMovement.timestamp
+        ).filter(archivable).order_by(StockMovement.id).limit(segment_rows).all()
+        if not rows:
+            db.session.commit()
+            return archived
+
+        months = {}
+        for row in rows:
+            months.setdefault(row.timestamp.strftime('%Y-%m'), []).append(row)
+
+        # Files first, then manifest rows and deletes in one transaction: a
+        # failure leaves at most an unlisted file, rewritten by the next run
+        for month, month_rows in sorted(months.items()):
+            min_id = min(row.id for row in month_rows)
+            max_id = max(row.id for row in month_rows)
+            path = f"{month}/segment-{min_id}-{max_id}.seg"
+            write_segment(os.path.join(ARCHIVE_DIR, path), month_rows)
+            products = {}
+            for row in month_rows:
+                products[row.product_id] = products.get(row.product_id, 0) + 1
+            segment = MovementSegment(
+                month=month,
+                path=path,
+                row_count=len(month_rows),
+                min_movement_id=min_id,
+                max_movement_id=max_id,
+                min_product_id=min(row.product_id for row in month_rows),
+                max_product_id=max(row.product_id for row in month_rows),
+                min_timestamp=min(row.timestamp for row in month_rows),
+                max_timestamp=max(row.timestamp for row in month_rows)
+            )
+            db.session.add(segment)
+            db.session.flush()
+            _add_segment_products(segment.id, products)
+
+        ids = [row.id for row in rows]
+        for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+            db.session.execute(
+                db.delete(StockMovement).where(
+                    StockMovement.id.in_(ids[start:start + DELETE_CHUNK_SIZE])
+                )
+            )
+        db.session.commit()
+        _refresh_archived_counts({row.product_id for row in rows})
+        # Histories read the same, but pages rendered mid-move are dropped
+        bump_versions(['movements'])
+        archived += len(rows)
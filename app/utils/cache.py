@@ -1,50 +1,587 @@
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from redis.exceptions import WatchError
 from app import redis_client
-import json
+from app.utils.config import (
+    L1_CACHE_SIZE, L1_CACHE_TTL, CACHE_INVALIDATION_CHANNEL,
+    CACHE_TTL, CACHE_TTL_JITTER, EARLY_REFRESH_WINDOW,
+    RECOMPUTE_LEASE
+)
+from app.utils.etags import queue_version_bumps, version_key
+from app.utils.events import queue_stock_events
+from app.utils.local_cache import LocalCache
+from app.utils.replicas import use_primary
+from app.utils.serialization import dumps_bytes, loads
+from app.utils.stock import warehouse_stock_for
+
+# In-process (L1) cache in front of Redis
+local_cache = LocalCache(L1_CACHE_SIZE, L1_CACHE_TTL)
+redis_stats = {'hits': 0, 'misses': 0}
+
+_listener = {'pid': None, 'thread': None, 'origin': None}
+_listener_lock = threading.Lock()
+
+def _on_invalidate(message):
+    data = loads(message['data'])
+    if data.get('origin') != _listener['origin']:
+        local_cache.delete(*data['keys'])
+
+def _on_listener_error(error, pubsub, thread):
+    # Without invalidations the L1 may serve stale data; drop it and let the
+    # next cache access resubscribe
+    thread.stop()
+    pubsub.close()
+    _listener['thread'] = None
+    local_cache.clear()
+
+def _l1_ready():
+    # Subscribes once per process, so workers forked after create_app get
+    # their own listener thread
+    if local_cache.maxsize <= 0:
+        return False
+
+    thread = _listener['thread']
+    if _listener['pid'] == os.getpid() and thread is not None and thread.is_alive():
+        return True
+
+    with _listener_lock:
+        thread = _listener['thread']
+        if _listener['pid'] == os.getpid() and thread is not None and thread.is_alive():
+            return True
+
+        local_cache.clear()
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{CACHE_INVALIDATION_CHANNEL: _on_invalidate})
+            thread = pubsub.run_in_thread(
+                sleep_time=1, daemon=True, exception_handler=_on_listener_error
+            )
+        except Exception:
+            _listener['thread'] = None
+            return False
+
+        _listener.update(pid=os.getpid(), thread=thread, origin=f"{os.getpid()}:{id(thread)}")
+        return True
+
+def _cached_get(key, decode):
+    use_l1 = _l1_ready()
+    if use_l1:
+        value = local_cache.get(key)
+        if value is not None:
+            return value
+
+    data = redis_client.get(key)
+    if data is None:
+        redis_stats['misses'] += 1
+        return None
+
+    redis_stats['hits'] += 1
+    value = decode(data)
+    if use_l1:
+        local_cache.set(key, value)
+    return value
+
+def _cached_get_many(keys, decode):
+    # Returns {key: value} for hits; L1 first, then one MGET for the rest
+    found = {}
+    use_l1 = _l1_ready()
+    remaining = keys
+    if use_l1:
+        remaining = []
+        for key in keys:
+            value = local_cache.get(key)
+            if value is None:
+                remaining.append(key)
+            else:
+                found[key] = value
+
+    if remaining:
+        for key, data in zip(remaining, redis_client.mget(remaining)):
+            if data is None:
+                redis_stats['misses'] += 1
+                continue
+            redis_stats['hits'] += 1
+            value = decode(data)
+            found[key] = value
+            if use_l1:
+                local_cache.set(key, value)
+
+    return found
+
+def _publish_invalidation(pipe, keys, local_values=None):
+    # Queues the eviction message on pipe so it costs no extra round trip.
+    # This worker keeps local_values (if given) instead of evicting them.
+    if _l1_ready():
+        if local_values is not None:
+            for key, value in local_values.items():
+                local_cache.set(key, value)
+        else:
+            local_cache.delete(*keys)
+
+    pipe.publish(
+        CACHE_INVALIDATION_CHANNEL,
+        dumps_bytes({'origin': _listener['origin'], 'keys': list(keys)})
+    )
+
+# Single-flight recomputation
+def cache_ttl():
+    # Jittered TTL so keys written together do not expire together
+    return int(CACHE_TTL * (1 + random.random() * CACHE_TTL_JITTER))
+
+def _acquire_lease(key):
+    token = uuid.uuid4().hex
+    if redis_client.set(f"lock:{key}", token, nx=True, px=int(RECOMPUTE_LEASE * 1000)):
+        return token
+    return None
+
+def _release_lease(key, token):
+    # Compare-and-delete, so an expired lease taken over by another worker
+    # is left alone
+    lock_key = f"lock:{key}"
+    with redis_client.pipeline() as pipe:
+        try:
+            pipe.watch(lock_key)
+            if pipe.get(lock_key) == token.encode():
+                pipe.multi()
+                pipe.delete(lock_key)
+                pipe.execute()
+        except WatchError:
+            pass
+
+def _refresh_early(pttl):
+    # Probabilistic early expiration: the closer the key is to expiring, the
+    # more likely a reader recomputes it ahead of time
+    if pttl is None or pttl < 0:
+        return False
+    return pttl / 1000 < EARLY_REFRESH_WINDOW * -math.log(1 - random.random())
+
+def get_or_compute(key, decode, compute, early_refresh=False):
+    # Cached value for key, or compute() once across all workers on a miss.
+    # compute() must write the cache itself and return the value; it reads
+    # the primary, so a lagging replica never fills the cache.
+    compute = use_primary()(compute)
+    use_l1 = _l1_ready()
+    if use_l1:
+        value = local_cache.get(key)
+        if value is not None:
+            return value
+
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.get(key)
+    if early_refresh:
+        pipe.pttl(key)
+    result = pipe.execute()
+
+    if result[0] is not None:
+        redis_stats['hits'] += 1
+        value = decode(result[0])
+        if early_refresh and _refresh_early(result[1]):
+            # Only one reader refreshes; everyone else keeps the current value
+            token = _acquire_lease(key)
+            if token is not None:
+                try:
+                    return compute()
+                finally:
+                    _release_lease(key, token)
+        if use_l1:
+            local_cache.set(key, value)
+        return value
+
+    redis_stats['misses'] += 1
+    token = _acquire_lease(key)
+    while token is None:
+        # Another worker is recomputing; wait for its result while its lease
+        # is held. If the lease ends without one (the holder failed or ran
+        # past RECOMPUTE_LEASE), exactly one waiter takes it over.
+        time.sleep(0.02)
+        data = redis_client.get(key)
+        if data is not None:
+            return decode(data)
+        token = _acquire_lease(key)
+
+    try:
+        # The previous lease holder may have filled the key just before we
+        # acquired the lease
+        data = redis_client.get(key)
+        if data is not None:
+            return decode(data)
+        return compute()
+    finally:
+        _release_lease(key, token)
+
+def get_cache_stats():
+    return {'l1': local_cache.stats(), 'redis': dict(redis_stats)}
 
 # Stock level caching
 def get_stock_level(product_id):
-    stock = redis_client.get(f"stock:{product_id}")
-    return int(stock) if stock else None
+    return _cached_get(f"stock:{product_id}", int)
+
+def get_stock_levels(product_ids):
+    # {product_id: stock} for cached products only
+    found = _cached_get_many([f"stock:{pid}" for pid in product_ids], int)
+    return {pid: found[f"stock:{pid}"] for pid in product_ids if f"stock:{pid}" in found}
 
 def set_stock_level(product_id, stock, min_stock_level=None):
-    redis_client.set(f"stock:{product_id}", stock)
+    key = f"stock:{product_id}"
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.set(key, stock)
     
-    # Set alert if stock level is below threshold
-    if min_stock_level is not None and stock < min_stock_level:
-        set_low_stock_alert(product_id)
+    # Rank the product in the alert index if stock is below threshold
+    queue_alert(pipe, TOTAL_ALERTS_KEY, product_id, stock, min_stock_level)
+    
+    _publish_invalidation(pipe, [key], {key: stock})
+    pipe.execute()
+
+# Per-warehouse stock: one hash per product mapping warehouse_id -> quantity.
+# The _loaded field marks a hash that is cached but may hold no warehouses;
+# _min keeps the alert threshold and _min:{warehouse_id} the warehouse's
+# reorder point, for alert updates made straight on the hash.
+def _warehouse_stock_key(product_id):
+    return f"stock:wh:{product_id}"
+
+def decode_warehouse_stock(data):
+    return {int(k): int(v) for k, v in data.items() if not k.startswith(b'_')}
+
+def decode_thresholds(data):
+    # (alert threshold, {warehouse_id: reorder point}) of a cached hash
+    min_stock_level = data.get(b'_min')
+    if min_stock_level is not None:
+        min_stock_level = int(min_stock_level)
+    warehouse_levels = {
+        int(k[5:]): int(v) for k, v in data.items() if k.startswith(b'_min:')
+    }
+    return min_stock_level, warehouse_levels
+
+def get_warehouse_stock(product_id):
+    # {warehouse_id: quantity}, or None on a cache miss
+    data = redis_client.hgetall(_warehouse_stock_key(product_id))
+    if not data:
+        return None
+    return decode_warehouse_stock(data)
+
+def get_warehouse_stock_matrix(product_ids, warehouse_ids):
+    # {product_id: [quantity per warehouse_id]} for cached products, one pipeline
+    pipe = redis_client.pipeline(transaction=False)
+    for product_id in product_ids:
+        pipe.hmget(_warehouse_stock_key(product_id), '_loaded', *warehouse_ids)
+
+    matrix = {}
+    for product_id, values in zip(product_ids, pipe.execute()):
+        if values[0] is None:
+            continue
+        matrix[product_id] = [int(v) if v is not None else 0 for v in values[1:]]
+    return matrix
+
+def queue_warehouse_stocks(pipe, levels, previous=None, notify=False):
+    # Queues the writes of set_warehouse_stocks on pipe, so callers can make
+    # them part of a larger MULTI. previous: {product_id: warehouse ids cached
+    # before}, whose alerts are dropped when the product left the warehouse.
+    # notify: also publish stock/alert events (stock changed, not a reload)
+    # and bump the products' movement history versions.
+    previous = previous or {}
+    for product_id, (quantities, min_stock_level, warehouse_levels) in levels.items():
+        key = _warehouse_stock_key(product_id)
+        stock = sum(quantities.values())
+        fields = {'_loaded': 1, **quantities}
+        if min_stock_level is not None:
+            fields['_min'] = min_stock_level
+        for warehouse_id, reorder_point in warehouse_levels.items():
+            fields[f'_min:{warehouse_id}'] = reorder_point
+        pipe.delete(key)
+        pipe.hset(key, mapping=fields)
+        pipe.set(f"stock:{product_id}", stock)
+
+        queue_alert(pipe, TOTAL_ALERTS_KEY, product_id, stock, min_stock_level)
+        for warehouse_id, quantity in quantities.items():
+            queue_alert(
+                pipe, warehouse_alerts_key(warehouse_id), product_id, quantity,
+                warehouse_levels.get(warehouse_id, min_stock_level)
+            )
+        removed = set(previous.get(product_id, ())) - set(quantities)
+        for warehouse_id in removed:
+            queue_alert(pipe, warehouse_alerts_key(warehouse_id), product_id, 0, None)
+        if notify:
+            queue_stock_events(
+                pipe, product_id, quantities, min_stock_level, removed, warehouse_levels
+            )
+            queue_version_bumps(pipe, [f"movements:{product_id}"])
+
+    keys = [f"stock:{pid}" for pid in levels]
+    if len(levels) == 1:
+        product_id, (quantities, _, _) = next(iter(levels.items()))
+        _publish_invalidation(pipe, keys, {keys[0]: sum(quantities.values())})
     else:
-        clear_low_stock_alert(product_id)
+        _publish_invalidation(pipe, keys)
+
+def set_warehouse_stocks(levels, notify=False):
+    # levels: {product_id: ({warehouse_id: quantity}, min_stock_level,
+    # {warehouse_id: reorder point})}.
+    # Rewrites each product's hash, total stock key and alerts; one read of
+    # the cached warehouse ids, then one transaction. The write is not
+    # ordered against others, so it is only used for products no other
+    # request can have written yet; write paths on existing products use
+    # refresh_warehouse_stocks. notify=True publishes the change to event
+    # streams.
+    if not levels:
+        return
+
+    pipe = redis_client.pipeline(transaction=False)
+    for product_id in levels:
+        pipe.hkeys(_warehouse_stock_key(product_id))
+    previous = {
+        product_id: [int(k) for k in keys if not k.startswith(b'_')]
+        for product_id, keys in zip(levels, pipe.execute())
+    }
+
+    pipe = redis_client.pipeline(transaction=True)
+    queue_warehouse_stocks(pipe, levels, previous, notify)
+    pipe.execute()
+
+# Hash writes are ordered by a counter per product (version:stock:wh:{id}).
+# A write path bumps it after it commits and before it reads inventory, and
+# the hash is only written while the counter still holds the value seen
+# before the read. An older read that lands late is dropped, and the last
+# writer to bump read every commit that bumped before it.
+def pending_key(product_id):
+    # Stream events queued for the product and not yet in inventory
+    return f"ingest:pending:{product_id}"
+
+def _write_warehouse_stocks(levels, versions, notify=False, fill=False):
+    # Writes the levels of products whose counter still holds versions[pid].
+    # fill: a miss fill, also skipped where the hash was written meanwhile or
+    # stream events are pending.
+    product_ids = list(levels)
+    watched = [version_key(_warehouse_stock_key(pid)) for pid in product_ids]
+    if fill:
+        watched += [_warehouse_stock_key(pid) for pid in product_ids]
+        watched += [pending_key(pid) for pid in product_ids]
+
+    while True:
+        with redis_client.pipeline() as pipe:
+            try:
+                pipe.watch(*watched)
+                reads = redis_client.pipeline(transaction=False)
+                for product_id in product_ids:
+                    reads.get(version_key(_warehouse_stock_key(product_id)))
+                    reads.hkeys(_warehouse_stock_key(product_id))
+                    reads.get(pending_key(product_id))
+                results = reads.execute()
+
+                current = {}
+                previous = {}
+                for i, product_id in enumerate(product_ids):
+                    version, fields, pending = results[3 * i:3 * i + 3]
+                    if (int(version) if version is not None else None) != versions[product_id]:
+                        continue
+                    if fill and (fields or int(pending or 0) > 0):
+                        continue
+                    current[product_id] = levels[product_id]
+                    previous[product_id] = [int(k) for k in fields if not k.startswith(b'_')]
+                if not current:
+                    return
+
+                pipe.multi()
+                queue_warehouse_stocks(pipe, current, previous, notify)
+                pipe.execute()
+                return
+            except WatchError:
+                continue
+
+def refresh_warehouse_stocks(product_ids, notify=True):
+    # Write paths, after their commit: reloads the products' stock from
+    # inventory and rewrites their hashes, unless a later write overtook
+    # this one. notify as in set_warehouse_stocks.
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+
+    pipe = redis_client.pipeline(transaction=False)
+    queue_version_bumps(pipe, [_warehouse_stock_key(pid) for pid in product_ids])
+    versions = dict(zip(product_ids, pipe.execute()[1::2]))
+    _write_warehouse_stocks(warehouse_stock_for(product_ids), versions, notify)
+
+def fill_warehouse_stocks(product_ids):
+    # Read misses: ({product_id: levels as in warehouse_stock_for} for
+    # existing products, [product ids with stream events pending]). Inventory
+    # lags the stock of pending products, so they are neither loaded nor
+    # cached; the others are cached unless a write got there first.
+    product_ids = list(product_ids)
+    if not product_ids:
+        return {}, []
+
+    pipe = redis_client.pipeline(transaction=False)
+    for product_id in product_ids:
+        pipe.get(version_key(_warehouse_stock_key(product_id)))
+        pipe.get(pending_key(product_id))
+    results = pipe.execute()
+
+    versions = {}
+    pending = []
+    for i, product_id in enumerate(product_ids):
+        version, queued = results[2 * i:2 * i + 2]
+        if int(queued or 0) > 0:
+            pending.append(product_id)
+        else:
+            versions[product_id] = int(version) if version is not None else None
+
+    levels = warehouse_stock_for(list(versions))
+    if levels:
+        _write_warehouse_stocks(levels, versions, fill=True)
+    return levels, pending
+
+def set_stock_thresholds(thresholds):
+    # thresholds: {product_id: (alert threshold, {warehouse_id: reorder
+    # point})}. Re-ranks the alerts of cached products from their cached
+    # quantities; uncached products pick up the thresholds from the database
+    # when they are loaded. The hashes are watched, so a concurrent stock
+    # change makes the write retry.
+    product_ids = list(thresholds)
+    keys = [_warehouse_stock_key(pid) for pid in product_ids]
+    while True:
+        with redis_client.pipeline() as pipe:
+            try:
+                pipe.watch(*keys)
+                reads = redis_client.pipeline(transaction=False)
+                for key in keys:
+                    reads.hgetall(key)
 
-# Low stock alerts
-def set_low_stock_alert(product_id):
-    redis_client.sadd("low_stock_alerts", product_id)
+                levels = {}
+                for product_id, data in zip(product_ids, reads.execute()):
+                    if data:
+                        levels[product_id] = (decode_warehouse_stock(data), *thresholds[product_id])
 
-def clear_low_stock_alert(product_id):
-    redis_client.srem("low_stock_alerts", product_id)
+                pipe.multi()
+                queue_warehouse_stocks(pipe, levels)
+                pipe.execute()
+                return len(levels)
+            except WatchError:
+                continue
+
+# Low stock alerts: alerts:total ranks products by total deficit
+# (min_stock_level - stock), alerts:wh:{warehouse_id} ranks the products held
+# in a warehouse by their deficit there. Members are zero-padded product ids,
+# so products with the same deficit sort by id.
+TOTAL_ALERTS_KEY = "alerts:total"
+
+def warehouse_alerts_key(warehouse_id):
+    return f"alerts:wh:{warehouse_id}"
+
+def _alert_member(product_id):
+    return f"{product_id:012d}"
+
+def queue_alert(pipe, key, product_id, stock, min_stock_level):
+    if min_stock_level is not None and stock < min_stock_level:
+        pipe.zadd(key, {_alert_member(product_id): min_stock_level - stock})
+    else:
+        pipe.zrem(key, _alert_member(product_id))
 
 def get_low_stock_alerts():
-    return [int(pid) for pid in redis_client.smembers("low_stock_alerts")]
-
-# Cache product details
-def cache_product(product):
-    redis_client.setex(
-        f"product:{product.id}", 
-        3600,  # Cache for 1 hour
-        json.dumps(product.to_dict())
+    # Every product below its threshold in total, worst first
+    return [int(m) for m in redis_client.zrevrange(TOTAL_ALERTS_KEY, 0, -1)]
+
+def count_alerts(key):
+    return redis_client.zcard(key)
+
+def get_alert_page(key, after, limit):
+    # [(product_id, deficit)] worst first, starting after the entry given in
+    # after. Seeks by rank, so a page costs O(log n + limit) however many
+    # alerts there are.
+    start = 0
+    if after is not None:
+        product_id, deficit = after
+        member = _alert_member(product_id)
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.zrevrank(key, member)
+        pipe.zscore(key, member)
+        rank, score = pipe.execute()
+
+        if rank is not None and score == deficit:
+            start = rank + 1
+        else:
+            # The cursor's product changed since the last page: count what
+            # ranks ahead of its old position instead
+            ties = redis_client.zrangebyscore(key, deficit, deficit)
+            start = redis_client.zcount(key, f"({deficit}", '+inf') + sum(
+                1 for m in ties if m.decode() > member
+            )
+
+    entries = redis_client.zrevrange(key, start, start + limit - 1, withscores=True)
+    return [(int(member), int(score)) for member, score in entries]
+
+def clear_alerts():
+    # Drops every alert index; used before a full rebuild
+    keys = [TOTAL_ALERTS_KEY, 'low_stock_alerts']
+    keys += list(redis_client.scan_iter(match='alerts:wh:*', count=1000))
+    redis_client.delete(*keys)
+
+# Cache product details. Write paths pass changed=True (the product was
+# written, not reloaded) to bump its version counters for conditional GETs.
+def cache_product(product, changed=False):
+    key = f"product:{product.id}"
+    data = product.to_dict()
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.setex(
+        key, 
+        cache_ttl(),  # Cache for about 1 hour
+        dumps_bytes(data)
     )
+    if changed:
+        queue_version_bumps(pipe, ['products', key])
+    _publish_invalidation(pipe, [key], {key: data})
+    pipe.execute()
+
+def cache_products(products, changed=False):
+    # products: serialized product dicts, written in one round trip
+    if not products:
+        return
+
+    pipe = redis_client.pipeline(transaction=False)
+    keys = [f"product:{product['id']}" for product in products]
+    for key, product in zip(keys, products):
+        pipe.setex(key, cache_ttl(), dumps_bytes(product))
+    if changed:
+        queue_version_bumps(pipe, ['products', *keys])
+    _publish_invalidation(pipe, keys)
+    pipe.execute()
+
+def uncache_products(product_ids):
+    # Drops products whose rows changed; the next read reloads them
+    keys = [f"product:{pid}" for pid in product_ids]
+    if not keys:
+        return
+
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.delete(*keys)
+    queue_version_bumps(pipe, ['products', *keys])
+    _publish_invalidation(pipe, keys)
+    pipe.execute()
 
 def get_cached_product(product_id):
-    data = redis_client.get(f"product:{product_id}")
-    return json.loads(data) if data else None
-
-# Cache warehouse details
-def cache_warehouse(warehouse):
-    redis_client.setex(
-        f"warehouse:{warehouse.id}", 
-        3600,  # Cache for 1 hour
-        json.dumps(warehouse.to_dict())
+    return _cached_get(f"product:{product_id}", loads)
+
+def get_cached_products(product_ids):
+    # {product_id: product dict} for cached products only
+    found = _cached_get_many([f"product:{pid}" for pid in product_ids], loads)
+    return {pid: found[f"product:{pid}"] for pid in product_ids if f"product:{pid}" in found}
+
+# Cache warehouse details; changed=True as for cache_product
+def cache_warehouse(warehouse, changed=False):
+    key = f"warehouse:{warehouse.id}"
+    data = warehouse.to_dict()
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.setex(
+        key, 
+        cache_ttl(),  # Cache for about 1 hour
+        dumps_bytes(data)
     )
+    if changed:
+        queue_version_bumps(pipe, ['warehouses', key])
+    _publish_invalidation(pipe, [key], {key: data})
+    pipe.execute()
 
 def get_cached_warehouse(warehouse_id):
-    data = redis_client.get(f"warehouse:{warehouse_id}")
-    return json.loads(data) if data else None
\ No newline at end of file
+    return _cached_get(f"warehouse:{warehouse_id}", loads)
\ No newline at end of file
@@ -7,9 +7,153 @@ load_dotenv()
 SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URI', 'mysql+pymysql://inventory_user:inventory_password@db/inventory')
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pool of every engine. SQLite keeps its own pool class, so only
+# pre-ping and recycle apply to it.
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 280))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+SQLALCHEMY_ENGINE_OPTIONS = {'pool_pre_ping': DB_POOL_PRE_PING, 'pool_recycle': DB_POOL_RECYCLE}
+if not SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+    SQLALCHEMY_ENGINE_OPTIONS.update(
+        pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT
+    )
+
+# Read replicas (comma-separated URIs). Read-only handlers query one of them,
+# except for clients that wrote within REPLICA_STICKY_SECONDS, which are
+# recognised by the REPLICA_STICKY_COOKIE cookie set on their writes.
+REPLICA_DATABASE_URIS = [uri.strip() for uri in os.getenv('REPLICA_DATABASE_URIS', '').split(',') if uri.strip()]
+SQLALCHEMY_BINDS = {f'replica_{i}': uri for i, uri in enumerate(REPLICA_DATABASE_URIS)}
+REPLICA_BIND_KEYS = list(SQLALCHEMY_BINDS)
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 5))
+REPLICA_STICKY_COOKIE = os.getenv('REPLICA_STICKY_COOKIE', 'db_primary_until')
+
+# Async read server (asgi.py, run with uvicorn): its queries use SQLAlchemy's
+# async engine on ASYNC_DATABASE_URI, by default the database URIs above with
+# an async driver. Each process opens at most ASYNC_REDIS_MAX_CONNECTIONS Redis
+# connections, and fills cache misses with the sync readers on up to
+# ASYNC_FILL_THREADS threads.
+ASYNC_DATABASE_URI = os.getenv('ASYNC_DATABASE_URI')
+ASYNC_REDIS_MAX_CONNECTIONS = int(os.getenv('ASYNC_REDIS_MAX_CONNECTIONS', 200))
+ASYNC_FILL_THREADS = int(os.getenv('ASYNC_FILL_THREADS', 16))
+
+# Schema creation on startup (db.create_all). Production sets it to 0 and
+# creates the schema with init.sql or migrations, so workers start without
+# introspecting every table.
+CREATE_SCHEMA_ON_STARTUP = os.getenv('CREATE_SCHEMA_ON_STARTUP', '1') == '1'
+
 # Redis configuration
 REDIS_URL = os.getenv('REDIS_URL', 'redis://redis:6379/0')
 
+# In-process (L1) cache in front of Redis; a size of 0 disables it
+L1_CACHE_SIZE = int(os.getenv('L1_CACHE_SIZE', 10000))
+L1_CACHE_TTL = float(os.getenv('L1_CACHE_TTL', 30))
+CACHE_INVALIDATION_CHANNEL = os.getenv('CACHE_INVALIDATION_CHANNEL', 'cache:invalidate')
+
+# Product/warehouse cache TTL in seconds, stretched by up to CACHE_TTL_JITTER
+CACHE_TTL = int(os.getenv('CACHE_TTL', 3600))
+CACHE_TTL_JITTER = float(os.getenv('CACHE_TTL_JITTER', 0.1))
+
+# Stampede protection: keys are refreshed early within EARLY_REFRESH_WINDOW
+# seconds of expiring; a miss is recomputed by one lease holder while other
+# callers wait for its result. A lease held longer than RECOMPUTE_LEASE
+# seconds is taken over by one waiter, so it should outlast the slowest
+# recompute.
+EARLY_REFRESH_WINDOW = float(os.getenv('EARLY_REFRESH_WINDOW', 60))
+RECOMPUTE_LEASE = float(os.getenv('RECOMPUTE_LEASE', 5))
+
+# Conditional GETs: the first RESPONSE_CACHE_PAGES pages of product, warehouse
+# and movement listings are cached whole for up to RESPONSE_CACHE_TTL seconds
+# (0 disables the page cache; ETags and 304s stay on)
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 300))
+RESPONSE_CACHE_PAGES = int(os.getenv('RESPONSE_CACHE_PAGES', 3))
+
+# JSON provider used by jsonify; must encode datetimes as ISO 8601.
+# The default one uses orjson when it is installed.
+JSON_PROVIDER = os.getenv('JSON_PROVIDER', 'app.utils.serialization.FastJSONProvider')
+
 # Pagination defaults
 DEFAULT_PAGE_SIZE = 10
-MAX_PAGE_SIZE = 100
\ No newline at end of file
+MAX_PAGE_SIZE = 100
+
+# Batch limits
+MAX_BULK_IDS = int(os.getenv('MAX_BULK_IDS', 500))
+MAX_TRANSFER_BATCH_SIZE = int(os.getenv('MAX_TRANSFER_BATCH_SIZE', 5000))
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', 1000))
+MAX_IMPORT_ERRORS = int(os.getenv('MAX_IMPORT_ERRORS', 1000))
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 5000))
+# Movement archive: segment files live under ARCHIVE_DIR, one directory per
+# month, with rows compressed in blocks of ARCHIVE_BLOCK_ROWS
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+ARCHIVE_SEGMENT_ROWS = int(os.getenv('ARCHIVE_SEGMENT_ROWS', 1000000))
+ARCHIVE_BLOCK_ROWS = int(os.getenv('ARCHIVE_BLOCK_ROWS', 4096))
+
+# Movement ingestion: 'sync' writes movements inside the request; 'stream'
+# reserves stock in Redis and queues movements on MOVEMENT_STREAM for the
+# `flask stock ingest` worker. The stream is split by product id into
+# INGEST_PARTITIONS partitions, each written by one worker at a time; change
+# the count only with an empty backlog. A worker that stops renewing its
+# partitions for INGEST_CLAIM_IDLE_MS loses them to the others.
+MOVEMENT_INGEST_MODE = os.getenv('MOVEMENT_INGEST_MODE', 'sync')
+MOVEMENT_STREAM = os.getenv('MOVEMENT_STREAM', 'stream:movements')
+MOVEMENT_STREAM_GROUP = os.getenv('MOVEMENT_STREAM_GROUP', 'movement-writers')
+INGEST_PARTITIONS = int(os.getenv('INGEST_PARTITIONS', 8))
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', 1000))
+INGEST_BLOCK_MS = int(os.getenv('INGEST_BLOCK_MS', 1000))
+INGEST_CLAIM_IDLE_MS = int(os.getenv('INGEST_CLAIM_IDLE_MS', 30000))
+RESERVE_RETRIES = int(os.getenv('RESERVE_RETRIES', 50))
+
+# Stock/alert event streams (GET /events/stock): events are logged in the
+# capped EVENT_LOG stream for resuming, and each connection buffers at most
+# SSE_BUFFER_SIZE events before it falls back to reading the log
+EVENT_LOG = os.getenv('EVENT_LOG', 'events:stock')
+EVENT_CHANNEL = os.getenv('EVENT_CHANNEL', 'events:stock')
+EVENT_LOG_SIZE = int(os.getenv('EVENT_LOG_SIZE', 100000))
+EVENT_READ_CHUNK = int(os.getenv('EVENT_READ_CHUNK', 500))
+SSE_BUFFER_SIZE = int(os.getenv('SSE_BUFFER_SIZE', 1000))
+SSE_HEARTBEAT = float(os.getenv('SSE_HEARTBEAT', 15))
+# Streams one Flask worker process serves at once. Each pins one of its
+# GUNICORN_THREADS, so keep it well below that; the async server (asgi.py)
+# holds no thread per stream and has no limit.
+SSE_MAX_STREAMS = int(os.getenv('SSE_MAX_STREAMS', 8))
+
+# Movement analytics (GET /analytics/movements): days covered when no range
+# is given, and the largest range one request may ask for
+ANALYTICS_DEFAULT_DAYS = int(os.getenv('ANALYTICS_DEFAULT_DAYS', 30))
+ANALYTICS_MAX_DAYS = int(os.getenv('ANALYTICS_MAX_DAYS', 366))
+
+# Reorder points (`flask stock reorder-points`): demand is read over the last
+# REORDER_WINDOW_DAYS days; REORDER_SERVICE_Z is the safety-stock z-score
+# (1.65 covers about 95% of lead times)
+REORDER_WINDOW_DAYS = int(os.getenv('REORDER_WINDOW_DAYS', 90))
+REORDER_LEAD_TIME_DAYS = float(os.getenv('REORDER_LEAD_TIME_DAYS', 7))
+REORDER_SERVICE_Z = float(os.getenv('REORDER_SERVICE_Z', 1.65))
+REORDER_CHUNK_PRODUCTS = int(os.getenv('REORDER_CHUNK_PRODUCTS', 20000))
+REORDER_READ_CHUNK = int(os.getenv('REORDER_READ_CHUNK', 50000))
+
+# Product search (GET /products/search): words are indexed from SEARCH_MIN_CHARS
+# characters, and one query reads at most SEARCH_SCAN_LIMIT index entries.
+# Each worker builds the index in the background on its first request when it
+# does not exist yet.
+SEARCH_MIN_CHARS = int(os.getenv('SEARCH_MIN_CHARS', 2))
+SEARCH_SCAN_LIMIT = int(os.getenv('SEARCH_SCAN_LIMIT', 5000))
+SEARCH_BUILD_BATCH = int(os.getenv('SEARCH_BUILD_BATCH', 5000))
+SEARCH_BUILD_LEASE = int(os.getenv('SEARCH_BUILD_LEASE', 600))
+SEARCH_WARM_ON_STARTUP = os.getenv('SEARCH_WARM_ON_STARTUP', '1') == '1'
+
+# Request metrics (GET /metrics): each process adds its totals to the
+# METRICS_KEY hash at most every METRICS_FLUSH_INTERVAL seconds. Requests
+# slower than SLOW_REQUEST_MS are logged with their SQL (0 disables).
+METRICS_KEY = os.getenv('METRICS_KEY', 'metrics:requests')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 0))
+SLOW_REQUEST_MAX_STATEMENTS = int(os.getenv('SLOW_REQUEST_MAX_STATEMENTS', 50))
+
+# Request profiling: with PROFILE_ENABLED, requests sent with "X-Profile: 1"
+# (or a PROFILE_SAMPLE_RATE fraction of all requests) are sampled every
+# PROFILE_INTERVAL seconds and the folded stacks written to PROFILE_DIR
+PROFILE_ENABLED = os.getenv('PROFILE_ENABLED', '0') == '1'
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
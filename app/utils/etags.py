@@ -0,0 +1,150 @@
+import hashlib
+import time
+from functools import wraps
+from flask import Response, g, jsonify, make_response, request
+from app import redis_client
+from app.utils.config import RESPONSE_CACHE_TTL, RESPONSE_CACHE_PAGES
+from app.utils.replicas import use_primary
+
+# Conditional GETs. Write paths bump version counters in Redis, in the
+# pipelines they already send: one per table ('products', 'warehouses',
+# 'movements') and one per entity ('product:{id}', 'warehouse:{id}',
+# 'movements:{product_id}'). A response's weak ETag hashes the counters it
+# depends on with its URL (and updated_at for details), so If-None-Match is
+# answered with a 304 from Redis alone. Hot listing pages are also cached
+# whole, under their URL and stored with the ETag they were rendered for.
+
+def version_key(name):
+    return f"version:{name}"
+
+def _seed():
+    # Counters start at the current time in microseconds, so a counter lost
+    # with Redis never returns to a value an older ETag was built from
+    return time.time_ns() // 1000
+
+def queue_version_bumps(pipe, names):
+    seed = _seed()
+    for name in names:
+        pipe.set(version_key(name), seed, nx=True)
+        pipe.incr(version_key(name))
+
+def bump_versions(names):
+    if not names:
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    queue_version_bumps(pipe, names)
+    pipe.execute()
+
+def queue_version_reads(pipe, names, keys=()):
+    # Reads the counters, then the cache entries in keys, on one pipeline
+    pipe.mget([version_key(name) for name in names])
+    for key in keys:
+        pipe.get(key)
+
+def queue_version_seeds(pipe, names):
+    # Starts missing counters; their values are every second result
+    seed = _seed()
+    for name in names:
+        pipe.set(version_key(name), seed, nx=True)
+        pipe.get(version_key(name))
+
+def read_versions(names, keys=()):
+    # ([counter per name], [value per key]) in one round trip, plus one more
+    # the first time a counter is read
+    pipe = redis_client.pipeline(transaction=False)
+    queue_version_reads(pipe, names, keys)
+    versions, *values = pipe.execute()
+
+    missing = [name for name, version in zip(names, versions) if version is None]
+    if missing:
+        pipe = redis_client.pipeline(transaction=False)
+        queue_version_seeds(pipe, missing)
+        seeded = dict(zip(missing, pipe.execute()[1::2]))
+        versions = [seeded.get(name, version) for name, version in zip(names, versions)]
+    return [int(version) for version in versions], values
+
+def make_etag(versions, url, *extra):
+    # Weak ETag value (without W/ and quotes) of a response at url
+    raw = '|'.join(str(part) for part in (*versions, url, *extra))
+    return hashlib.blake2b(raw.encode(), digest_size=12).hexdigest()
+
+# Listing page cache
+def page_key(url):
+    return f"page:{url}"
+
+def cacheable_page(args):
+    # Hot listing pages: the first RESPONSE_CACHE_PAGES pages, and the first
+    # page of cursor pagination. Deeper pages and lookups by id are only
+    # ETagged.
+    if RESPONSE_CACHE_TTL <= 0 or args.get('cursor') or 'ids' in args:
+        return False
+    try:
+        return int(args.get('page', 1)) <= RESPONSE_CACHE_PAGES
+    except ValueError:
+        return False
+
+def pack_page(etag, body):
+    return etag.encode() + b' ' + body
+
+def unpack_page(data, etag):
+    # The cached body if it was rendered for etag, else None
+    if data is None:
+        return None
+    cached_etag, _, body = data.partition(b' ')
+    return body if cached_etag == etag.encode() else None
+
+# Responses
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag, weak=True)
+    return response
+
+def json_page(body, etag):
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    return response
+
+def conditional_json(payload, versions, *extra):
+    # JSON response with a weak ETag, or a 304 if the client holds it.
+    # payload must come from a cache filled from the primary.
+    etag = make_etag(versions, request.full_path, *extra)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    response = jsonify(payload)
+    response.set_etag(etag, weak=True)
+    return response
+
+def conditional(versions):
+    # Conditional GETs for a listing view whose response only changes with
+    # the counters named by versions(**view_args). Hot pages are rendered
+    # from the primary, like every other cache fill, and cached whole.
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            cache = cacheable_page(request.args)
+            key = page_key(request.full_path)
+            counters, values = read_versions(versions(**kwargs), [key] if cache else [])
+            etag = make_etag(counters, request.full_path)
+            if request.if_none_match.contains_weak(etag):
+                return not_modified(etag)
+
+            if not cache:
+                response = make_response(view(**kwargs))
+                # A replica may lag behind the counters, so what it returned
+                # is not tagged
+                if response.status_code == 200 and g.get('_db_replica') is None:
+                    response.set_etag(etag, weak=True)
+                return response
+
+            body = unpack_page(values[0], etag)
+            if body is not None:
+                return json_page(body, etag)
+
+            with use_primary():
+                response = make_response(view(**kwargs))
+            if response.status_code == 200:
+                redis_client.setex(key, RESPONSE_CACHE_TTL, pack_page(etag, response.get_data()))
+                response.set_etag(etag, weak=True)
+            return response
+        return wrapper
+    return decorator
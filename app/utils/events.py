@@ -0,0 +1,238 @@
+import os
+import re
+import threading
+from collections import deque
+from datetime import datetime
+from app import redis_client
+from app.utils.config import (
+    EVENT_LOG, EVENT_CHANNEL, EVENT_LOG_SIZE, EVENT_READ_CHUNK,
+    SSE_BUFFER_SIZE, SSE_HEARTBEAT
+)
+from app.utils.serialization import dumps, dumps_bytes, loads
+
+# Stock and alert change events. Write paths append each event to the capped
+# EVENT_LOG stream and publish a wake-up on EVENT_CHANNEL in the same
+# pipeline. Each process runs one dispatcher thread that reads new log
+# entries when woken and fans them out to the open event-stream connections.
+# The log ids double as SSE event ids, so clients resume from the log.
+
+EVENT_ID = re.compile(r'^\d+-\d+$')
+
+# Write side
+def queue_stock_events(pipe, product_id, quantities, min_stock_level, removed=(),
+                       warehouse_levels=None):
+    # Queues a 'stock' event, plus an 'alert' event when the product is below
+    # its threshold in total or in a warehouse. removed: warehouse ids the
+    # product just left, reported with quantity 0. warehouse_levels:
+    # {warehouse_id: reorder point}, the thresholds of those warehouses.
+    warehouse_levels = warehouse_levels or {}
+    warehouses = {str(wid): quantity for wid, quantity in quantities.items()}
+    for warehouse_id in removed:
+        warehouses.setdefault(str(warehouse_id), 0)
+    stock = sum(quantities.values())
+    now = datetime.utcnow().isoformat()
+
+    low_stock = min_stock_level is not None and stock < min_stock_level
+    events = [{
+        'type': 'stock',
+        'product_id': product_id,
+        'stock': stock,
+        'min_stock_level': min_stock_level,
+        'low_stock': low_stock,
+        'warehouses': warehouses,
+        'timestamp': now
+    }]
+
+    deficits = {}
+    for wid, quantity in warehouses.items():
+        threshold = warehouse_levels.get(int(wid), min_stock_level)
+        if threshold is not None and quantity < threshold:
+            deficits[wid] = threshold - quantity
+    if low_stock or deficits:
+        events.append({
+            'type': 'alert',
+            'product_id': product_id,
+            'min_stock_level': min_stock_level,
+            'deficit': min_stock_level - stock if low_stock else None,
+            'warehouses': deficits,
+            'timestamp': now
+        })
+
+    for event in events:
+        pipe.xadd(
+            EVENT_LOG, {'data': dumps_bytes(event)},
+            maxlen=EVENT_LOG_SIZE, approximate=True
+        )
+    pipe.publish(EVENT_CHANNEL, b'1')
+
+# Read side
+def event_key(entry_id):
+    # Sort key of a log entry id
+    ms, seq = entry_id.split('-')
+    return int(ms), int(seq)
+
+def read_events(after, count=EVENT_READ_CHUNK):
+    # [(entry_id, event)] logged after the entry id in after
+    entries = redis_client.xrange(EVENT_LOG, min=f"({after}", max='+', count=count)
+    return [(entry_id.decode(), loads(fields[b'data'])) for entry_id, fields in entries]
+
+def latest_event_id():
+    entries = redis_client.xrevrange(EVENT_LOG, '+', '-', count=1)
+    return entries[0][0].decode() if entries else '0-0'
+
+def _log_starts_after(entry_id):
+    # True when entries following entry_id may have been trimmed from the log
+    entries = redis_client.xrange(EVENT_LOG, '-', '+', count=1)
+    return bool(entries) and event_key(entries[0][0].decode()) > event_key(entry_id)
+
+class Subscription:
+    # One event-stream connection: a filter and a bounded buffer. When the
+    # buffer fills up it is dropped and the connection replays from the log.
+    def __init__(self, matches):
+        self.matches = matches
+        self._buffer = deque()
+        self._overflowed = False
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def push(self, entry_id, event):
+        if not self.matches(event):
+            return
+        with self._lock:
+            if len(self._buffer) >= SSE_BUFFER_SIZE:
+                self._buffer.clear()
+                self._overflowed = True
+            else:
+                self._buffer.append((entry_id, event))
+        self._ready.set()
+
+    def take(self, timeout):
+        # (buffered events, whether events were dropped since the last call)
+        self._ready.wait(timeout)
+        return self.drain()
+
+    def drain(self):
+        with self._lock:
+            self._ready.clear()
+            events = list(self._buffer)
+            self._buffer.clear()
+            overflowed, self._overflowed = self._overflowed, False
+        return events, overflowed
+
+_dispatcher = {'pid': None, 'thread': None, 'last_id': None}
+_dispatcher_lock = threading.Lock()
+_subscriptions = set()
+
+def _dispatch(message):
+    # Reads everything logged since the last dispatch, so wake-ups published
+    # in a burst cost one read
+    while True:
+        entries = read_events(_dispatcher['last_id'])
+        for entry_id, event in entries:
+            for subscription in list(_subscriptions):
+                subscription.push(entry_id, event)
+            _dispatcher['last_id'] = entry_id
+        if len(entries) < EVENT_READ_CHUNK:
+            return
+
+def _on_dispatcher_error(error, pubsub, thread):
+    thread.stop()
+    pubsub.close()
+    _dispatcher['thread'] = None
+
+def _ensure_dispatcher():
+    # One listener per process, started on the first subscription
+    thread = _dispatcher['thread']
+    if _dispatcher['pid'] == os.getpid() and thread is not None and thread.is_alive():
+        return
+
+    with _dispatcher_lock:
+        thread = _dispatcher['thread']
+        if _dispatcher['pid'] == os.getpid() and thread is not None and thread.is_alive():
+            return
+
+        _dispatcher['last_id'] = latest_event_id()
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{EVENT_CHANNEL: _dispatch})
+        thread = pubsub.run_in_thread(
+            sleep_time=1, daemon=True, exception_handler=_on_dispatcher_error
+        )
+        _dispatcher.update(pid=os.getpid(), thread=thread)
+
+def subscribe(matches, limit=None):
+    # A new subscription, or None when limit subscriptions are already open
+    _ensure_dispatcher()
+    subscription = Subscription(matches)
+    with _dispatcher_lock:
+        if limit is not None and len(_subscriptions) >= limit:
+            return None
+        _subscriptions.add(subscription)
+    return subscription
+
+def unsubscribe(subscription):
+    _subscriptions.discard(subscription)
+
+def event_filter(product_ids=None, warehouse_ids=None, types=None):
+    # Warehouse ids are string keys in events
+    warehouse_ids = {str(wid) for wid in warehouse_ids or ()}
+
+    def matches(event):
+        if types and event['type'] not in types:
+            return False
+        if product_ids and event['product_id'] not in product_ids:
+            return False
+        if warehouse_ids and not any(wid in event['warehouses'] for wid in warehouse_ids):
+            return False
+        return True
+
+    return matches
+
+def format_event(entry_id, event):
+    return f"id: {entry_id}\nevent: {event['type']}\ndata: {dumps(event)}\n\n"
+
+def event_stream(subscription, last_event_id=None):
+    # Server-sent events for one subscription. Events after last_event_id are
+    # replayed from the log first; a 'reset' event tells the client that the
+    # log no longer reaches back that far and it should reload its state.
+    matches = subscription.matches
+    try:
+        # Position is fixed before the first write to the client, so nothing
+        # logged after the subscription started is skipped
+        last_id = last_event_id
+        replay = last_id is not None
+        if last_id is None:
+            last_id = latest_event_id()
+
+        yield "retry: 3000\n\n"
+
+        while True:
+            if replay:
+                replay = False
+                if _log_starts_after(last_id):
+                    yield f"event: reset\ndata: {dumps({'last_event_id': last_id})}\n\n"
+                while True:
+                    entries = read_events(last_id)
+                    for entry_id, event in entries:
+                        last_id = entry_id
+                        if matches(event):
+                            yield format_event(entry_id, event)
+                    if len(entries) < EVENT_READ_CHUNK:
+                        break
+
+            events, overflowed = subscription.take(SSE_HEARTBEAT)
+            if overflowed:
+                # Dropped events are still in the log
+                replay = True
+                continue
+
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+
+            for entry_id, event in events:
+                if event_key(entry_id) <= event_key(last_id):
+                    continue
+                last_id = entry_id
+                yield format_event(entry_id, event)
+    finally:
+        unsubscribe(subscription)
@@ -0,0 +1,81 @@
+import csv
+import io
+from datetime import date, datetime, timezone
+from flask import Response, request, stream_with_context
+from app import db
+from app.utils.config import EXPORT_CHUNK_SIZE
+from app.utils.serialization import dumps_bytes
+
+# Streaming exports. Rows are read through a server-side cursor in batches of
+# EXPORT_CHUNK_SIZE and each batch is encoded and sent before the next one is
+# fetched, so memory stays flat whatever the table size.
+
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+def export_format():
+    # Format comes from ?format= or the Accept header; ValueError if unknown
+    fmt = request.args.get('format')
+    if fmt is None:
+        fmt = 'csv' if request.accept_mimetypes.best == 'text/csv' else 'ndjson'
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(fmt)
+    return fmt
+
+def parse_updated_since(value):
+    # ISO 8601 timestamp (UTC); ValueError if malformed
+    since = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    return since
+
+def _batches(query):
+    result = db.session.execute(
+        query.statement.execution_options(stream_results=True, yield_per=EXPORT_CHUNK_SIZE)
+    )
+    columns = list(result.keys())
+    yield columns
+    for rows in result.partitions(EXPORT_CHUNK_SIZE):
+        yield rows
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def write_ndjson(query):
+    batches = _batches(query)
+    columns = next(batches)
+    for rows in batches:
+        yield b''.join(dumps_bytes(dict(zip(columns, row))) + b'\n' for row in rows)
+
+def write_csv(query):
+    batches = _batches(query)
+    columns = next(batches)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows([_csv_value(value) for value in row] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def export_response(query, fmt, name, headers=None):
+    # Streams query as an attachment. X-Export-Started-At can be passed back
+    # as updated_since to export only what changed after this export began.
+    started_at = datetime.utcnow().isoformat()
+    writer = write_csv if fmt == 'csv' else write_ndjson
+    return Response(
+        stream_with_context(writer(query)),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={
+            'Content-Disposition': f'attachment; filename={name}.{fmt}',
+            'X-Export-Started-At': started_at,
+            'X-Accel-Buffering': 'no',
+            **(headers or {})
+        }
+    )
@@ -0,0 +1,269 @@
+import csv
+import json
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+from app import db
+from app.models.product import Product
+from app.models.warehouse import Warehouse
+from app.models.stock_movement import StockMovement
+from app.models.inventory import Inventory
+from app.utils.cache import cache_products, set_warehouse_stocks
+from app.utils.search import index_products
+
+# Stream readers. Lines are decoded one at a time, so a line that is not
+# UTF-8 is reported as INVALID_UTF8 after every row before it was read.
+INVALID_UTF8 = object()
+
+def read_ndjson(stream):
+    for line_number, line in enumerate(stream, start=1):
+        try:
+            line = line.decode('utf-8').strip()
+        except UnicodeDecodeError:
+            yield line_number, INVALID_UTF8
+            continue
+        if not line:
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError:
+            yield line_number, None
+
+def _utf8_lines(stream):
+    for line in stream:
+        yield line.decode('utf-8')
+
+def read_csv(stream):
+    # Line 1 is the header row. A record can span lines, so reading stops at
+    # the first line that is not UTF-8.
+    line_number = 0
+    try:
+        for line_number, row in enumerate(csv.DictReader(_utf8_lines(stream)), start=2):
+            yield line_number, {k: v for k, v in row.items() if v not in ('', None)}
+    except UnicodeDecodeError:
+        yield line_number + 1, INVALID_UTF8
+
+# Row validation
+def _optional_int(value, default):
+    return default if value is None else int(value)
+
+def parse_row(row):
+    if row is INVALID_UTF8:
+        raise ValueError('Invalid UTF-8')
+    if not isinstance(row, dict):
+        raise ValueError('Malformed row')
+    if not row.get('name'):
+        raise ValueError('name is required')
+    for field in ('name', 'sku', 'description'):
+        if row.get(field) is not None and not isinstance(row[field], str):
+            raise ValueError(f'{field} must be a string')
+    if row.get('warehouse_id') is None:
+        raise ValueError('warehouse_id is required')
+
+    try:
+        warehouse_id = int(row['warehouse_id'])
+        stock = _optional_int(row.get('stock'), 0)
+        min_stock_level = _optional_int(row.get('min_stock_level'), 10)
+    except (TypeError, ValueError):
+        raise ValueError('warehouse_id, stock and min_stock_level must be integers')
+
+    if stock < 0:
+        raise ValueError('stock must not be negative')
+
+    return {
+        'name': row['name'],
+        'description': row.get('description'),
+        'sku': row.get('sku'),
+        'min_stock_level': min_stock_level,
+        'warehouse_id': warehouse_id
+    }, stock
+
+class ProductImporter:
+    def __init__(self, chunk_size, max_errors):
+        self.chunk_size = chunk_size
+        self.max_errors = max_errors
+        self.processed = 0
+        self.imported = 0
+        self.failed = 0
+        self.not_cached = 0
+        self.chunks = 0
+        self.errors = []
+        self.seen_skus = set()
+        self.warehouse_names = {}
+
+    def error(self, line_number, message):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line_number, 'error': message})
+
+    def run(self, rows):
+        chunk = []
+        for line_number, row in rows:
+            self.processed += 1
+            try:
+                values, stock = parse_row(row)
+            except ValueError as e:
+                self.error(line_number, str(e))
+                continue
+
+            chunk.append((line_number, values, stock))
+            if len(chunk) >= self.chunk_size:
+                self.flush(chunk)
+                chunk = []
+
+        if chunk:
+            self.flush(chunk)
+
+        return self.summary()
+
+    def summary(self):
+        return {
+            'processed': self.processed,
+            'imported': self.imported,
+            'failed': self.failed,
+            'not_cached': self.not_cached,
+            'chunks': self.chunks,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors)
+        }
+
+    def _load_warehouses(self, warehouse_ids):
+        missing = set(warehouse_ids) - set(self.warehouse_names)
+        if missing:
+            self.warehouse_names.update(
+                db.session.query(Warehouse.id, Warehouse.name)
+                          .filter(Warehouse.id.in_(missing)).all()
+            )
+
+    def _insert_products(self, rows):
+        dialect = db.session.get_bind().dialect
+        if dialect.insert_executemany_returning_sort_by_parameter_order:
+            result = db.session.execute(
+                db.insert(Product).returning(Product.id, sort_by_parameter_order=True),
+                rows
+            )
+            return [row.id for row in result]
+
+        # Backends without ordered RETURNING (MySQL): one executemany insert,
+        # then the chunk's ids in one query by SKU, which is unique. Rows
+        # without a SKU cannot be looked up and get their ids from a flush.
+        keyed = [row for row in rows if row['sku']]
+        ids = {}
+        if keyed:
+            db.session.execute(db.insert(Product), keyed)
+            ids = dict(
+                db.session.query(Product.sku, Product.id)
+                          .filter(Product.sku.in_([row['sku'] for row in keyed])).all()
+            )
+
+        unkeyed = [Product(**row) for row in rows if not row['sku']]
+        if unkeyed:
+            db.session.add_all(unkeyed)
+            db.session.flush()
+        unkeyed_ids = iter([p.id for p in unkeyed])
+
+        return [ids[row['sku']] if row['sku'] else next(unkeyed_ids) for row in rows]
+
+    def flush(self, chunk):
+        self.chunks += 1
+        self._load_warehouses({values['warehouse_id'] for _, values, _ in chunk})
+
+        skus = [values['sku'] for _, values, _ in chunk if values['sku']]
+        existing_skus = set()
+        if skus:
+            existing_skus = {
+                sku for (sku,) in db.session.query(Product.sku)
+                                            .filter(Product.sku.in_(skus)).all()
+            }
+
+        accepted = []
+        for line_number, values, stock in chunk:
+            if values['warehouse_id'] not in self.warehouse_names:
+                self.error(line_number, 'Warehouse not found')
+                continue
+            sku = values['sku']
+            if sku and (sku in existing_skus or sku in self.seen_skus):
+                self.error(line_number, 'Duplicate sku')
+                continue
+            if sku:
+                self.seen_skus.add(sku)
+            accepted.append((line_number, values, stock))
+
+        if not accepted:
+            return
+
+        now = datetime.utcnow()
+        product_rows = [
+            dict(values, created_at=now, updated_at=now) for _, values, _ in accepted
+        ]
+
+        try:
+            product_ids = self._insert_products(product_rows)
+
+            movements = []
+            inventories = []
+            for product_id, (_, values, stock) in zip(product_ids, accepted):
+                if stock > 0:
+                    movements.append({
+                        'product_id': product_id,
+                        'destination_warehouse_id': values['warehouse_id'],
+                        'quantity': stock,
+                        'movement_type': 'addition',
+                        'timestamp': now
+                    })
+                    inventories.append({
+                        'product_id': product_id,
+                        'warehouse_id': values['warehouse_id'],
+                        'quantity': stock,
+                        'created_at': now,
+                        'updated_at': now
+                    })
+
+            if movements:
+                db.session.execute(db.insert(StockMovement), movements)
+                db.session.execute(db.insert(Inventory), inventories)
+
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            for line_number, _, _ in accepted:
+                self.error(line_number, f'Chunk failed: {e.__class__.__name__}')
+            return
+
+        self.imported += len(accepted)
+
+        # Warm the cache for the whole chunk in pipelined writes
+        cached = []
+        levels = {}
+        for product_id, row, (_, _, stock) in zip(product_ids, product_rows, accepted):
+            cached.append({
+                'id': product_id,
+                'name': row['name'],
+                'description': row['description'],
+                'sku': row['sku'],
+                'min_stock_level': row['min_stock_level'],
+                'reorder_point': None,
+                'warehouse_id': row['warehouse_id'],
+                'warehouse_name': self.warehouse_names[row['warehouse_id']],
+                'created_at': now.isoformat(),
+                'updated_at': now.isoformat()
+            })
+            quantities = {row['warehouse_id']: stock} if stock > 0 else {}
+            levels[product_id] = (quantities, row['min_stock_level'], {})
+
+        # The chunk is committed: a failure here leaves it out of the stock
+        # cache and alerts, the product cache or the search index (counted in
+        # not_cached), and the import goes on
+        failed = False
+        for write, args in (
+            (set_warehouse_stocks, (levels, True)),
+            (cache_products, (cached, True)),
+            (index_products, (cached,))
+        ):
+            try:
+                write(*args)
+            except Exception:
+                current_app.logger.exception('Import chunk %d: %s failed', self.chunks, write.__name__)
+                failed = True
+        if failed:
+            self.not_cached += len(cached)
@@ -0,0 +1,482 @@
+import time
+import uuid
+from datetime import datetime
+from flask import current_app
+from redis.exceptions import ResponseError, WatchError
+from sqlalchemy.exc import IntegrityError
+from app import db, redis_client
+from app.models.product import Product
+from app.models.stock_movement import StockMovement
+from app.utils.cache import (
+    queue_warehouse_stocks, queue_alert, warehouse_alerts_key,
+    decode_warehouse_stock, decode_thresholds, uncache_products, pending_key
+)
+from app.utils.etags import bump_versions
+from app.utils.events import queue_stock_events
+from app.utils.config import (
+    MOVEMENT_INGEST_MODE, MOVEMENT_STREAM, MOVEMENT_STREAM_GROUP, INGEST_PARTITIONS,
+    INGEST_BATCH_SIZE, INGEST_BLOCK_MS, INGEST_CLAIM_IDLE_MS, RESERVE_RETRIES
+)
+from app.utils.serialization import dumps_bytes, loads
+from app.utils.stock import (
+    upsert_inventory, delete_empty_inventory, negative_inventory, warehouse_stock_for
+)
+
+# Write-behind movements. In stream mode the per-warehouse stock hash in
+# Redis is the source of truth for reservations: a request checks and moves
+# stock in the hash and appends the movement event to MOVEMENT_STREAM in one
+# MULTI. The ingest worker later writes the events to stock_movement and
+# inventory. ingest:pending:{product_id} counts queued events per product;
+# while it is non-zero inventory lags the hash and must not be loaded into it,
+# and the product row may lag too: ingest:home:{product_id} then holds the
+# home warehouse the queued transfers move the product to, if any.
+#
+# A product's events must be written in stream order: a transfer written
+# before the addition it moves would debit stock that is not there yet. The
+# stream is therefore split into INGEST_PARTITIONS partitions by product id,
+# and each partition is written by one worker at a time, the holder of its
+# lease (ingest:lease:{partition}), which writes the partition's entries in
+# id order and takes over those left pending by the previous holder.
+
+class ReservationError(Exception):
+    def __init__(self, error, status=400, **details):
+        super().__init__(error)
+        self.error = error
+        self.status = status
+        self.details = details
+
+    def to_dict(self):
+        return {'error': self.error, **self.details}
+
+class NegativeStockError(Exception):
+    # A batch would leave stock below zero: events were written out of order
+    # or inventory was changed behind the stream. The batch is rolled back.
+    pass
+
+def stream_mode():
+    return MOVEMENT_INGEST_MODE == 'stream'
+
+def partition_stream(partition):
+    # Partition 0 keeps the unpartitioned name, so entries queued before
+    # partitioning are still written
+    if partition == 0:
+        return MOVEMENT_STREAM
+    return f"{MOVEMENT_STREAM}:{partition}"
+
+def product_stream(product_id):
+    return partition_stream(product_id % INGEST_PARTITIONS)
+
+def _new_event(movement_type, product_id, source_warehouse_id,
+               destination_warehouse_id, quantity):
+    return {
+        'event_id': uuid.uuid4().hex,
+        'movement_type': movement_type,
+        'product_id': product_id,
+        'source_warehouse_id': source_warehouse_id,
+        'destination_warehouse_id': destination_warehouse_id,
+        'quantity': quantity,
+        'timestamp': datetime.utcnow().isoformat()
+    }
+
+def home_key(product_id):
+    return f"ingest:home:{product_id}"
+
+def _queue_event(pipe, event):
+    pipe.incr(pending_key(event['product_id']))
+    pipe.xadd(product_stream(event['product_id']), {'event': dumps_bytes(event)})
+
+def _watched_quantities(pipe, product_id):
+    # ({warehouse_id: quantity}, thresholds) from the watched stock hash, where
+    # thresholds is (min_stock_level, {warehouse_id: reorder point}). A
+    # missing hash is filled from inventory, which is only safe with no
+    # events queued. Returns (quantities, thresholds, levels to write back or
+    # None, events pending, queued home warehouse or None).
+    key = f"stock:wh:{product_id}"
+    pipe.watch(key, pending_key(product_id), home_key(product_id))
+    data = pipe.hgetall(key)
+    pending, home = pipe.mget(pending_key(product_id), home_key(product_id))
+    pending = int(pending or 0)
+    home = int(home) if pending > 0 and home is not None else None
+    if data:
+        return decode_warehouse_stock(data), decode_thresholds(data), None, pending, home
+
+    if pending > 0:
+        raise ReservationError('Stock is being ingested, retry shortly', 503)
+
+    levels = warehouse_stock_for([product_id])
+    if product_id not in levels:
+        raise ReservationError('Product not found', 404)
+    quantities, min_stock_level, warehouse_levels = levels[product_id]
+    return dict(quantities), (min_stock_level, warehouse_levels), levels, pending, home
+
+def _reserve(product_id, apply):
+    # Runs apply(pipe, quantities, thresholds, home) inside a WATCH/MULTI
+    # on the stock hash, retrying when another request changed it first.
+    # home: the queued home warehouse, None when the product row is current.
+    for _ in range(RESERVE_RETRIES):
+        with redis_client.pipeline() as pipe:
+            try:
+                quantities, thresholds, levels, pending, home = _watched_quantities(pipe, product_id)
+                pipe.multi()
+                if levels is not None:
+                    queue_warehouse_stocks(pipe, levels)
+                if not pending:
+                    # Nothing queued, so a home left by earlier events is stale
+                    pipe.delete(home_key(product_id))
+                result = apply(pipe, quantities, thresholds, home)
+                pipe.execute()
+                return result
+            except WatchError:
+                continue
+    raise ReservationError('Too much contention on product stock, retry shortly', 503)
+
+def enqueue_transfer(product_id, source_warehouse_id, destination_warehouse_id, quantity,
+                     home_warehouse_id):
+    # Moves stock between warehouses in the hash and queues the movement.
+    # As in the synchronous path, the source must be the product's home
+    # warehouse: home_warehouse_id from the product row, unless queued
+    # transfers already moved it. Returns the queued event.
+    def apply(pipe, quantities, thresholds, home):
+        if home is None:
+            home = home_warehouse_id
+        if home != source_warehouse_id:
+            raise ReservationError('Product not found in source warehouse', 404)
+
+        available = quantities.get(source_warehouse_id, 0)
+        if available < quantity:
+            raise ReservationError(
+                'Insufficient stock', available=available, requested=quantity
+            )
+
+        min_stock_level, warehouse_levels = thresholds
+        key = f"stock:wh:{product_id}"
+        if available == quantity:
+            # Mirrors the deleted inventory row; the product follows its stock
+            pipe.hdel(key, source_warehouse_id)
+            home = destination_warehouse_id
+            pipe.set(home_key(product_id), home)
+            queue_alert(pipe, warehouse_alerts_key(source_warehouse_id), product_id, 0, None)
+        else:
+            pipe.hincrby(key, source_warehouse_id, -quantity)
+            queue_alert(
+                pipe, warehouse_alerts_key(source_warehouse_id), product_id,
+                available - quantity,
+                warehouse_levels.get(source_warehouse_id, min_stock_level)
+            )
+        pipe.hincrby(key, destination_warehouse_id, quantity)
+        queue_alert(
+            pipe, warehouse_alerts_key(destination_warehouse_id), product_id,
+            quantities.get(destination_warehouse_id, 0) + quantity,
+            warehouse_levels.get(destination_warehouse_id, min_stock_level)
+        )
+
+        event = _new_event(
+            'transfer', product_id, source_warehouse_id,
+            destination_warehouse_id, quantity
+        )
+        event['home_warehouse_id'] = home
+        _queue_event(pipe, event)
+
+        quantities[source_warehouse_id] = available - quantity
+        quantities[destination_warehouse_id] = quantities.get(destination_warehouse_id, 0) + quantity
+        removed = [wid for wid, qty in quantities.items() if qty == 0]
+        queue_stock_events(
+            pipe, product_id,
+            {wid: qty for wid, qty in quantities.items() if qty},
+            min_stock_level, removed, warehouse_levels
+        )
+        return event
+
+    return _reserve(product_id, apply)
+
+def enqueue_addition(product_id, warehouse_id, quantity, min_stock_level):
+    # Adds stock to a warehouse in the hash and queues the movement. Also
+    # refreshes the product's total stock key and low stock alert.
+    def apply(pipe, quantities, thresholds, _):
+        quantities[warehouse_id] = quantities.get(warehouse_id, 0) + quantity
+        queue_warehouse_stocks(
+            pipe, {product_id: (quantities, min_stock_level, thresholds[1])}, notify=True
+        )
+        event = _new_event('addition', product_id, None, warehouse_id, quantity)
+        _queue_event(pipe, event)
+        return event
+
+    return _reserve(product_id, apply)
+
+# Batch writer
+WORKERS_KEY = 'ingest:workers'
+
+def _lease_key(partition):
+    return f"ingest:lease:{partition}"
+
+def _ensure_groups():
+    for partition in range(INGEST_PARTITIONS):
+        try:
+            redis_client.xgroup_create(
+                partition_stream(partition), MOVEMENT_STREAM_GROUP, id='0', mkstream=True
+            )
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+def _renew_lease(partition, consumer):
+    # Compare-and-extend: False when the lease expired and another worker
+    # took the partition
+    key = _lease_key(partition)
+    with redis_client.pipeline() as pipe:
+        try:
+            pipe.watch(key)
+            if pipe.get(key) != consumer.encode():
+                return False
+            pipe.multi()
+            pipe.pexpire(key, INGEST_CLAIM_IDLE_MS)
+            pipe.execute()
+            return True
+        except WatchError:
+            return False
+
+def _release_lease(partition, consumer):
+    key = _lease_key(partition)
+    with redis_client.pipeline() as pipe:
+        try:
+            pipe.watch(key)
+            if pipe.get(key) == consumer.encode():
+                pipe.multi()
+                pipe.delete(key)
+                pipe.execute()
+        except WatchError:
+            pass
+
+def _balance_leases(consumer):
+    # Registers the worker and returns the partitions it holds after renewing
+    # its leases, giving up partitions beyond its share of the live workers,
+    # and taking free ones up to that share
+    now = time.time()
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.zadd(WORKERS_KEY, {consumer: now})
+    pipe.zremrangebyscore(WORKERS_KEY, '-inf', now - INGEST_CLAIM_IDLE_MS / 1000)
+    pipe.zcard(WORKERS_KEY)
+    for partition in range(INGEST_PARTITIONS):
+        pipe.get(_lease_key(partition))
+    results = pipe.execute()
+    share = -(-INGEST_PARTITIONS // max(results[2], 1))
+    owners = results[3:]
+
+    mine = [p for p, owner in enumerate(owners) if owner == consumer.encode()]
+    for partition in mine[share:]:
+        _release_lease(partition, consumer)
+    held = {p for p in mine[:share] if _renew_lease(p, consumer)}
+    for partition, owner in enumerate(owners):
+        if len(held) >= share:
+            break
+        if owner is None and redis_client.set(
+            _lease_key(partition), consumer, nx=True, px=INGEST_CLAIM_IDLE_MS
+        ):
+            held.add(partition)
+    return held
+
+def _leave(consumer):
+    for partition in range(INGEST_PARTITIONS):
+        _release_lease(partition, consumer)
+    redis_client.zrem(WORKERS_KEY, consumer)
+
+def write_events(events):
+    # Writes events to stock_movement and inventory in one transaction.
+    # Events whose event_id is already stored are skipped, so redelivered
+    # stream entries are harmless. Raises NegativeStockError, before
+    # committing, when a source warehouse would go below zero. Returns the
+    # number of movements written.
+    unique = {}
+    for event in events:
+        unique.setdefault(event['event_id'], event)
+
+    stored = {
+        event_id for (event_id,) in db.session.query(StockMovement.event_id)
+                                              .filter(StockMovement.event_id.in_(list(unique))).all()
+    }
+    events = [event for event_id, event in unique.items() if event_id not in stored]
+    if not events:
+        return 0
+
+    movements = []
+    deltas = {}
+    for event in events:
+        product_id = event['product_id']
+        source_warehouse_id = event['source_warehouse_id']
+        destination_warehouse_id = event['destination_warehouse_id']
+        quantity = event['quantity']
+
+        movements.append({
+            'event_id': event['event_id'],
+            'product_id': product_id,
+            'source_warehouse_id': source_warehouse_id,
+            'destination_warehouse_id': destination_warehouse_id,
+            'quantity': quantity,
+            'movement_type': event['movement_type'],
+            'timestamp': datetime.fromisoformat(event['timestamp'])
+        })
+        if source_warehouse_id is not None:
+            key = (product_id, source_warehouse_id)
+            deltas[key] = deltas.get(key, 0) - quantity
+        if destination_warehouse_id is not None:
+            key = (product_id, destination_warehouse_id)
+            deltas[key] = deltas.get(key, 0) + quantity
+
+    db.session.execute(db.insert(StockMovement), movements)
+    upsert_inventory([
+        {'product_id': pid, 'warehouse_id': wid, 'quantity': delta}
+        for (pid, wid), delta in sorted(deltas.items()) if delta
+    ])
+
+    # Emptied source rows are deleted and, as in the synchronous transfer
+    # path, the product follows its stock to the destination warehouse. The
+    # reservation decided the move; transfers carry the home they leave.
+    sources = sorted({
+        (e['product_id'], e['source_warehouse_id'])
+        for e in events if e['source_warehouse_id'] is not None
+    })
+    negative = negative_inventory(sources)
+    if negative:
+        raise NegativeStockError(f"Stock below zero for (product, warehouse) {negative}")
+    delete_empty_inventory(sources)
+
+    moved = {}
+    for event in events:
+        home_warehouse_id = event.get('home_warehouse_id')
+        if home_warehouse_id is not None and home_warehouse_id != event['source_warehouse_id']:
+            moved[event['product_id']] = home_warehouse_id
+    if moved:
+        db.session.execute(db.update(Product), [
+            {'id': pid, 'warehouse_id': wid} for pid, wid in moved.items()
+        ])
+
+    db.session.commit()
+    uncache_products(moved)
+    bump_versions([f"movements:{pid}" for pid in {e['product_id'] for e in events}])
+    return len(movements)
+
+def _acknowledge(partition, entries):
+    # Acks and deletes written entries, so the stream length is the backlog,
+    # then lowers the pending counters of the entries this call acked
+    stream = partition_stream(partition)
+    pipe = redis_client.pipeline(transaction=False)
+    for entry_id, _ in entries:
+        pipe.xack(stream, MOVEMENT_STREAM_GROUP, entry_id)
+    acked = pipe.execute()
+
+    pipe = redis_client.pipeline(transaction=False)
+    for (entry_id, fields), count in zip(entries, acked):
+        if count:
+            pipe.decr(pending_key(loads(fields[b'event'])['product_id']))
+    pipe.xdel(stream, *[entry_id for entry_id, _ in entries])
+    pipe.execute()
+
+def _pending_entries(partition, consumer, batch_size):
+    # The partition's unacked entries, oldest first: ours from a failed
+    # batch and those of a previous holder. Only the lease holder reads the
+    # partition, so they are claimed at once.
+    _, entries, *_ = redis_client.xautoclaim(
+        partition_stream(partition), MOVEMENT_STREAM_GROUP, consumer,
+        0, start_id='0-0', count=batch_size
+    )
+    return entries
+
+def _new_entries(partitions, consumer, batch_size, block_ms):
+    # [(partition, entries)] delivered for the first time
+    streams = {partition_stream(p): '>' for p in sorted(partitions)}
+    partition_of = {partition_stream(p): p for p in partitions}
+    response = redis_client.xreadgroup(
+        MOVEMENT_STREAM_GROUP, consumer, streams, count=batch_size, block=block_ms
+    )
+    return [
+        (partition_of[stream.decode() if isinstance(stream, bytes) else stream], entries)
+        for stream, entries in response or [] if entries
+    ]
+
+def _write_batch(partition, consumer, entries):
+    # Writes one partition's entries in order; None when they stay pending
+    # for a retry
+    if not _renew_lease(partition, consumer):
+        # Taken over; the new holder writes them
+        return None
+    try:
+        count = write_events([loads(fields[b'event']) for _, fields in entries])
+    except (IntegrityError, NegativeStockError) as e:
+        # IntegrityError: a previous holder whose lease expired mid-batch
+        # stored some of these events; they are deduplicated on the retry
+        db.session.rollback()
+        current_app.logger.warning('Ingest batch on partition %d not written: %s', partition, e)
+        return None
+
+    _acknowledge(partition, entries)
+    return count
+
+def drain_movements(consumer, batch_size=INGEST_BATCH_SIZE, block_ms=INGEST_BLOCK_MS,
+                    until_empty=False, on_batch=None):
+    # Writes queued movements in batches of up to batch_size from the
+    # partitions this worker holds; delivery is at-least-once. Runs forever
+    # unless until_empty is set, in which case it returns once every
+    # partition is empty, waiting for other workers to write theirs.
+    # Returns the number of movements written.
+    _ensure_groups()
+    written = 0
+    try:
+        while True:
+            held = _balance_leases(consumer)
+            batches = [(p, _pending_entries(p, consumer, batch_size)) for p in sorted(held)]
+            batches = [(p, entries) for p, entries in batches if entries]
+            if not batches and held:
+                batches = _new_entries(
+                    held, consumer, batch_size, None if until_empty else block_ms
+                )
+
+            failed = False
+            for partition, entries in batches:
+                count = _write_batch(partition, consumer, entries)
+                if count is None:
+                    failed = True
+                    continue
+                written += count
+                if on_batch is not None:
+                    on_batch(len(entries), count)
+
+            if batches and not failed:
+                continue
+            if until_empty and not failed and ingest_lag()['backlog'] == 0:
+                return written
+            if failed or not held or until_empty:
+                time.sleep(block_ms / 1000)
+    finally:
+        _leave(consumer)
+
+def ingest_lag():
+    # Backlog of the partitions: acked entries are deleted, so their lengths
+    # count queued plus in-flight events
+    pipe = redis_client.pipeline(transaction=False)
+    for partition in range(INGEST_PARTITIONS):
+        pipe.xlen(partition_stream(partition))
+        pipe.xrange(partition_stream(partition), '-', '+', count=1)
+    results = pipe.execute()
+    backlog = sum(results[0::2])
+
+    in_flight = 0
+    for partition in range(INGEST_PARTITIONS):
+        try:
+            in_flight += redis_client.xpending(
+                partition_stream(partition), MOVEMENT_STREAM_GROUP
+            )['pending']
+        except ResponseError:
+            pass
+
+    oldest_age = 0.0
+    oldest = [entries[0][0] for entries in results[1::2] if entries]
+    if oldest:
+        created_ms = min(int(entry_id.split(b'-')[0]) for entry_id in oldest)
+        oldest_age = max(time.time() - created_ms / 1000, 0.0)
+
+    return {
+        'mode': MOVEMENT_INGEST_MODE,
+        'backlog': backlog,
+        'in_flight': in_flight,
+        'oldest_event_age_seconds': round(oldest_age, 3)
+    }
@@ -0,0 +1,152 @@
+from sqlalchemy.exc import OperationalError
+from app import db
+from app.models.stock_movement import StockMovement
+from app.models.stock_snapshot import StockSnapshot, StockCheckpoint
+from app.utils.stock import upsert_rows
+
+CHECKPOINT_ID = 1
+
+# Reads: snapshot plus the movements newer than the high-water mark
+def _high_water_mark():
+    return db.session.query(
+        db.func.coalesce(db.func.max(StockCheckpoint.last_movement_id), 0)
+    ).filter(StockCheckpoint.id == CHECKPOINT_ID).scalar_subquery()
+
+def ledger_stock(product_id, warehouse_id=None):
+    # Stock of a product, in one warehouse or across all of them. Cost depends
+    # on the movements since the last snapshot, not on the whole history.
+    snapshot = db.session.query(
+        db.func.coalesce(db.func.sum(StockSnapshot.quantity), 0)
+    ).filter(StockSnapshot.product_id == product_id)
+
+    if warehouse_id is None:
+        incoming = StockMovement.destination_warehouse_id.isnot(None)
+        outgoing = StockMovement.source_warehouse_id.isnot(None)
+    else:
+        snapshot = snapshot.filter(StockSnapshot.warehouse_id == warehouse_id)
+        incoming = StockMovement.destination_warehouse_id == warehouse_id
+        outgoing = StockMovement.source_warehouse_id == warehouse_id
+
+    recent = db.session.query(
+        db.func.coalesce(db.func.sum(
+            db.case((incoming, StockMovement.quantity), else_=0)
+        ), 0) - db.func.coalesce(db.func.sum(
+            db.case((outgoing, StockMovement.quantity), else_=0)
+        ), 0)
+    ).filter(
+        StockMovement.product_id == product_id,
+        StockMovement.id > _high_water_mark()
+    )
+
+    stock = db.session.query(
+        snapshot.scalar_subquery() + recent.scalar_subquery()
+    ).scalar()
+    return int(stock or 0)
+
+# Writes: fold committed movements into the snapshot
+def lock_checkpoint(checkpoint_id):
+    # The checkpoint row, locked for the rest of the transaction
+    checkpoint = db.session.query(StockCheckpoint).filter_by(
+        id=checkpoint_id
+    ).with_for_update().first()
+    if checkpoint is None:
+        checkpoint = StockCheckpoint(id=checkpoint_id, last_movement_id=0)
+        db.session.add(checkpoint)
+        db.session.flush()
+    return checkpoint
+
+def checkpoint_mark(checkpoint_id):
+    # High-water mark of a checkpoint, read without locking it
+    return db.session.query(
+        db.func.coalesce(db.func.max(StockCheckpoint.last_movement_id), 0)
+    ).filter(StockCheckpoint.id == checkpoint_id).scalar()
+
+def wait_for_in_flight(low, high):
+    # Returns once every transaction that inserted a movement with an id in
+    # (low, high] has committed or rolled back; ids are allocated before
+    # commit, so a lower id can still commit after a higher one. On MySQL a
+    # locking read waits on the uncommitted rows in the range; on PostgreSQL a
+    # SHARE lock waits for every open writer. SQLite has one writer at a time,
+    # whose new ids are above every committed one. Ends the transaction.
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'mysql':
+        db.session.query(db.func.count(StockMovement.id)).filter(
+            StockMovement.id > low, StockMovement.id <= high
+        ).with_for_update(read=True).scalar()
+    elif dialect == 'postgresql':
+        db.session.execute(db.text(
+            f"LOCK TABLE {StockMovement.__tablename__} IN SHARE MODE"
+        ))
+    db.session.commit()
+
+def settled_window(low, batch_size):
+    # (highest id, count) of the next batch_size movements after low, once no
+    # transaction can still commit a movement below the highest id. Ends the
+    # transaction; callers lock their checkpoint afterwards.
+    window = db.session.query(StockMovement.id).filter(
+        StockMovement.id > low
+    ).order_by(StockMovement.id).limit(batch_size).subquery()
+    high = db.session.query(db.func.max(window.c.id)).scalar()
+    if high is None:
+        db.session.commit()
+        return None, 0
+
+    try:
+        wait_for_in_flight(low, high)
+    except OperationalError:
+        # A writer held a movement in the window past the lock wait
+        # timeout; try again on the next run
+        db.session.rollback()
+        return None, 0
+
+    count = db.session.query(db.func.count(StockMovement.id)).filter(
+        StockMovement.id > low, StockMovement.id <= high
+    ).scalar()
+    return high, count
+
+def advance_snapshot(batch_size=100000):
+    # Folds up to batch_size settled movements past the high-water mark into
+    # stock_snapshot. Returns the number of movements folded.
+    low = checkpoint_mark(CHECKPOINT_ID)
+    high, count = settled_window(low, batch_size)
+    if not count:
+        return 0
+
+    checkpoint = lock_checkpoint(CHECKPOINT_ID)
+    if checkpoint.last_movement_id != low:
+        # Another run folded this window first
+        db.session.commit()
+        return 0
+
+    in_window = db.and_(StockMovement.id > low, StockMovement.id <= high)
+    deltas = {}
+
+    incoming = db.session.query(
+        StockMovement.product_id,
+        StockMovement.destination_warehouse_id,
+        db.func.sum(StockMovement.quantity).label('quantity')
+    ).filter(
+        in_window, StockMovement.destination_warehouse_id.isnot(None)
+    ).group_by(StockMovement.product_id, StockMovement.destination_warehouse_id)
+
+    outgoing = db.session.query(
+        StockMovement.product_id,
+        StockMovement.source_warehouse_id,
+        (-db.func.sum(StockMovement.quantity)).label('quantity')
+    ).filter(
+        in_window, StockMovement.source_warehouse_id.isnot(None)
+    ).group_by(StockMovement.product_id, StockMovement.source_warehouse_id)
+
+    for query in (incoming, outgoing):
+        for product_id, warehouse_id, quantity in query:
+            key = (product_id, warehouse_id)
+            deltas[key] = deltas.get(key, 0) + int(quantity)
+
+    upsert_rows(StockSnapshot, [
+        {'product_id': pid, 'warehouse_id': wid, 'quantity': delta}
+        for (pid, wid), delta in sorted(deltas.items()) if delta
+    ], index_elements=['product_id', 'warehouse_id'], add=['quantity'])
+
+    checkpoint.last_movement_id = high
+    db.session.commit()
+    return count
@@ -0,0 +1,280 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from functools import partial
+from flask import current_app, g, has_request_context, request
+from redis.exceptions import RedisError
+from sqlalchemy import event
+from app import db, redis_client
+from app.utils.config import (
+    METRICS_KEY, METRICS_FLUSH_INTERVAL, SLOW_REQUEST_MS, SLOW_REQUEST_MAX_STATEMENTS,
+    PROFILE_ENABLED, PROFILE_SAMPLE_RATE, PROFILE_INTERVAL, PROFILE_DIR
+)
+
+# Request instrumentation. Each request collects its SQL, Redis and
+# serialization counts and times in flask.g; when the response is closed,
+# after its last byte was sent, they are added to per-process totals. These
+# are merged into the METRICS_KEY hash in Redis at most every
+# METRICS_FLUSH_INTERVAL seconds. /metrics renders the merged totals, so
+# every worker process reports the same numbers.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS = {
+    'http_requests_total': ('counter', 'Requests handled'),
+    'http_request_duration_seconds': ('histogram', 'Request latency'),
+    'db_statements_total': ('counter', 'SQL statements executed'),
+    'db_statement_duration_seconds_total': ('counter', 'Time spent in SQL statements'),
+    'redis_commands_total': ('counter', 'Redis commands sent'),
+    'redis_command_duration_seconds_total': ('counter', 'Time spent in Redis round trips'),
+    'serialization_duration_seconds_total': ('counter', 'Time spent encoding JSON responses'),
+}
+
+_totals = Counter()
+_totals_lock = threading.Lock()
+_flushed = {'at': time.monotonic()}
+
+# Request-scoped collection
+def _request_stats():
+    if has_request_context():
+        return g.get('_metrics')
+    return None
+
+def add_timing(kind, seconds, count=1):
+    # kind: 'sql', 'redis' or 'serialize'
+    stats = _request_stats()
+    if stats is not None:
+        stats[kind + '_count'] += count
+        stats[kind + '_time'] += seconds
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _request_stats()
+    if stats is None:
+        return
+    elapsed = time.perf_counter() - context._metrics_started
+    stats['sql_count'] += 1
+    stats['sql_time'] += elapsed
+    statements = stats['statements']
+    if statements is not None and len(statements) < SLOW_REQUEST_MAX_STATEMENTS:
+        statements.append((round(elapsed * 1000, 3), statement))
+
+def instrument_engine(engine):
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+def instrument_redis(client):
+    # Wraps one client's commands and pipelines; pub/sub is not counted
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    def timed_execute_command(*args, **options):
+        started = time.perf_counter()
+        try:
+            return execute_command(*args, **options)
+        finally:
+            add_timing('redis', time.perf_counter() - started)
+
+    def timed_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def timed_execute(*execute_args, **execute_kwargs):
+            count = len(pipe.command_stack)
+            started = time.perf_counter()
+            try:
+                return execute(*execute_args, **execute_kwargs)
+            finally:
+                add_timing('redis', time.perf_counter() - started, count)
+
+        pipe.execute = timed_execute
+        return pipe
+
+    client.execute_command = timed_execute_command
+    client.pipeline = timed_pipeline
+
+# Sampling profiler
+class StackSampler:
+    # Samples one thread's stack every interval seconds from a helper thread
+    # and counts the stacks in collapsed (flame graph) form
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if frames:
+                self.stacks[';'.join(reversed(frames))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+def _profile_requested():
+    if not PROFILE_ENABLED:
+        return False
+    if request.headers.get('X-Profile') == '1':
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def _profile_name(endpoint):
+    return f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{endpoint}.folded"
+
+def _write_profile(stacks, name):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, name), 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+
+# Request hooks
+def _start_request():
+    g._metrics = {
+        'started': time.perf_counter(),
+        'sql_count': 0, 'sql_time': 0.0,
+        'redis_count': 0, 'redis_time': 0.0,
+        'serialize_count': 0, 'serialize_time': 0.0,
+        'statements': [] if SLOW_REQUEST_MS > 0 else None,
+        'sampler': None
+    }
+    if _profile_requested():
+        g._metrics['sampler'] = StackSampler(threading.get_ident()).start()
+
+def _finish_request(response):
+    # Recorded once the server closes the response, so streamed bodies
+    # (exports, event streams) count their whole duration and, when streamed
+    # with the request context, their SQL and Redis work. The profile name is
+    # fixed now, as headers go out before the body.
+    stats = g.get('_metrics')
+    if stats is None:
+        return response
+
+    endpoint = request.endpoint or 'unmatched'
+    profile = None
+    if stats['sampler'] is not None:
+        profile = _profile_name(endpoint)
+        response.headers['X-Profile'] = profile
+
+    response.call_on_close(partial(
+        _close_request, stats, current_app.logger, endpoint, request.method,
+        request.full_path, response.status_code, profile
+    ))
+    return response
+
+def _close_request(stats, logger, endpoint, method, path, status, profile):
+    elapsed = time.perf_counter() - stats['started']
+    _record(endpoint, method, status, elapsed, stats)
+
+    if profile is not None:
+        _write_profile(stats['sampler'].stop(), profile)
+
+    if SLOW_REQUEST_MS > 0 and elapsed * 1000 >= SLOW_REQUEST_MS:
+        logger.warning(
+            'Slow request %s %s (%s): %.1f ms, %d SQL statements in %.1f ms, '
+            '%d Redis commands in %.1f ms, serialization %.1f ms\n%s',
+            method, path, endpoint, elapsed * 1000,
+            stats['sql_count'], stats['sql_time'] * 1000,
+            stats['redis_count'], stats['redis_time'] * 1000,
+            stats['serialize_time'] * 1000,
+            '\n'.join(f"  {ms} ms: {statement}" for ms, statement in stats['statements'])
+        )
+
+    flush_metrics()
+
+def _labels(**labels):
+    return ','.join(f'{name}="{value}"' for name, value in labels.items())
+
+def _record(endpoint, method, status, elapsed, stats):
+    route = _labels(endpoint=endpoint, method=method)
+    with _totals_lock:
+        _totals[f"http_requests_total|{_labels(endpoint=endpoint, method=method, status=status)}"] += 1
+        for bound in LATENCY_BUCKETS:
+            if elapsed <= bound:
+                _totals[f'http_request_duration_seconds_bucket|{route},le="{bound}"'] += 1
+        _totals[f'http_request_duration_seconds_bucket|{route},le="+Inf"'] += 1
+        _totals[f"http_request_duration_seconds_sum|{route}"] += elapsed
+        _totals[f"http_request_duration_seconds_count|{route}"] += 1
+        _totals[f"db_statements_total|{route}"] += stats['sql_count']
+        _totals[f"db_statement_duration_seconds_total|{route}"] += stats['sql_time']
+        _totals[f"redis_commands_total|{route}"] += stats['redis_count']
+        _totals[f"redis_command_duration_seconds_total|{route}"] += stats['redis_time']
+        _totals[f"serialization_duration_seconds_total|{route}"] += stats['serialize_time']
+
+# Aggregation and exposition
+def flush_metrics(force=False):
+    # Adds this process's totals to the shared hash. On a Redis error they
+    # are kept and sent with the next flush.
+    if not force and time.monotonic() - _flushed['at'] < METRICS_FLUSH_INTERVAL:
+        return
+    with _totals_lock:
+        pending = dict(_totals)
+        _totals.clear()
+        _flushed['at'] = time.monotonic()
+    if not pending:
+        return
+
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for field, value in pending.items():
+            pipe.hincrbyfloat(METRICS_KEY, field, value)
+        pipe.execute()
+    except RedisError:
+        with _totals_lock:
+            _totals.update(pending)
+
+def _format_value(value):
+    return str(int(value)) if value == int(value) else repr(value)
+
+def _sort_key(sample):
+    # Histogram buckets in increasing le order within each label set
+    labels, _ = sample
+    route, _, bound = labels.partition(',le="')
+    return route, float(bound.rstrip('"').replace('+Inf', 'inf') or 0)
+
+def render_metrics():
+    # Prometheus text exposition of the shared totals
+    flush_metrics(force=True)
+    samples = {}
+    for field, value in redis_client.hgetall(METRICS_KEY).items():
+        series, labels = field.decode().split('|', 1)
+        samples.setdefault(series, []).append((labels, float(value)))
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        series_names = [name]
+        if kind == 'histogram':
+            series_names = [f"{name}_bucket", f"{name}_sum", f"{name}_count"]
+        for series in series_names:
+            for labels, value in sorted(samples.get(series, ()), key=_sort_key):
+                lines.append(f"{series}{{{labels}}} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+def init_app(app):
+    # Registered by create_app: engine events, Redis wrappers, request hooks
+    with app.app_context():
+        for engine in db.engines.values():
+            instrument_engine(engine)
+    instrument_redis(redis_client._redis_client)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
@@ -0,0 +1,96 @@
+import base64
+import json
+from datetime import datetime
+from app import db, redis_client
+from app.utils.config import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+
+COUNT_CACHE_TTL = 60
+
+# Query parameters
+def parse_ids(value):
+    # Comma-separated id list, de-duplicated in request order
+    ids = []
+    for part in value.split(','):
+        part = part.strip()
+        if part:
+            ids.append(int(part))
+    return list(dict.fromkeys(ids))
+
+def page_limit(args):
+    # ?limit= clamped to 1..MAX_PAGE_SIZE; ValueError when not an integer
+    limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+# Opaque cursors
+def encode_cursor(values):
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor, types):
+    # Returns None for an empty cursor (first page), raises ValueError if malformed
+    if not cursor:
+        return None
+
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+    if not isinstance(values, list) or len(values) != len(types):
+        raise ValueError('Invalid cursor')
+
+    try:
+        return [
+            datetime.fromisoformat(v) if t is datetime else t(v)
+            for v, t in zip(values, types)
+        ]
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+# Keyset pagination
+def keyset_query(query, columns, cursor_values, limit, descending=False):
+    # Seek past the cursor on an indexed key instead of using OFFSET; fetches
+    # one row more than the page to tell whether another page follows
+    if cursor_values is not None:
+        conditions = []
+        for i, column in enumerate(columns):
+            equal = [c == v for c, v in zip(columns[:i], cursor_values[:i])]
+            seek = column < cursor_values[i] if descending else column > cursor_values[i]
+            conditions.append(db.and_(*equal, seek))
+        query = query.filter(db.or_(*conditions))
+
+    order = [c.desc() if descending else c.asc() for c in columns]
+    return query.order_by(*order).limit(limit + 1)
+
+def keyset_page(query, columns, cursor_values, limit, descending=False):
+    rows = keyset_query(query, columns, cursor_values, limit, descending).all()
+    return keyset_rows(rows, columns, limit)
+
+def keyset_rows(rows, columns, limit):
+    # (page, next cursor or None) from the rows of keyset_query
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, c.key) for c in columns])
+
+    return rows, next_cursor
+
+def cursor_pagination(limit, next_cursor, count_key=None, query=None):
+    pagination = {'limit': limit, 'next_cursor': next_cursor}
+    if count_key is not None:
+        pagination['total'] = cached_count(count_key, query)
+    return pagination
+
+def cached_count(key, query):
+    # Approximate total, refreshed at most every COUNT_CACHE_TTL seconds
+    cache_key = f"count:{key}"
+    total = redis_client.get(cache_key)
+    if total is not None:
+        return int(total)
+
+    total = query.order_by(None).count()
+    redis_client.setex(cache_key, COUNT_CACHE_TTL, total)
+    return total
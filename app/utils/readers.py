@@ -0,0 +1,236 @@
+from flask import abort, has_app_context
+from app import db
+from app.models.demand_stat import DemandStat
+from app.models.product import Product
+from app.models.warehouse import Warehouse
+from app.models.inventory import Inventory
+from app.models.stock_movement import StockMovement
+from app.utils.archive import archived_movements
+from app.utils.ledger import ledger_stock
+from app.utils.replicas import use_primary
+from app.utils.cache import (
+    cache_product, cache_products, cache_warehouse, get_cached_products,
+    get_cached_warehouse, get_or_compute, get_warehouse_stock, fill_warehouse_stocks,
+    set_stock_level
+)
+from app.utils.serialization import loads
+
+# Column-only read queries for listing endpoints. They return Core rows
+# instead of ORM objects, so a page is serialized without hydrating models.
+# Outside an app context they are built unbound, and the async reader
+# (app/asgi.py) executes their .statement on its own engine.
+def _query(*entities):
+    if has_app_context():
+        return db.session.query(*entities)
+    return db.Query(entities)
+
+def product_rows():
+    return _query(
+        Product.id,
+        Product.name,
+        Product.description,
+        Product.sku,
+        Product.min_stock_level,
+        Product.reorder_point,
+        Product.warehouse_id,
+        Warehouse.name.label('warehouse_name'),
+        Product.created_at,
+        Product.updated_at
+    ).outerjoin(Warehouse, Warehouse.id == Product.warehouse_id)
+
+def inventory_rows():
+    return _query(
+        Inventory.id,
+        Inventory.product_id,
+        Inventory.warehouse_id,
+        Inventory.quantity,
+        Inventory.created_at,
+        Inventory.updated_at
+    )
+
+def inventory_changes(after_movement_id, warehouse_id=None):
+    # Inventory of every (product, warehouse) pair a movement after
+    # after_movement_id touched, in pair order. Emptied pairs have no row
+    # left and come back with quantity 0 and no id.
+    pairs = []
+    for column in (StockMovement.source_warehouse_id, StockMovement.destination_warehouse_id):
+        select = db.select(
+            StockMovement.product_id.label('product_id'),
+            column.label('warehouse_id')
+        ).where(StockMovement.id > after_movement_id, column.isnot(None))
+        if warehouse_id is not None:
+            select = select.where(column == warehouse_id)
+        pairs.append(select)
+    touched = db.union(*pairs).subquery()
+
+    return _query(
+        Inventory.id,
+        touched.c.product_id,
+        touched.c.warehouse_id,
+        db.func.coalesce(Inventory.quantity, 0).label('quantity'),
+        Inventory.created_at,
+        Inventory.updated_at
+    ).select_from(touched).outerjoin(Inventory, db.and_(
+        Inventory.product_id == touched.c.product_id,
+        Inventory.warehouse_id == touched.c.warehouse_id
+    )).order_by(touched.c.product_id, touched.c.warehouse_id)
+
+def warehouse_rows():
+    return _query(
+        Warehouse.id,
+        Warehouse.name,
+        Warehouse.location,
+        Warehouse.created_at,
+        Warehouse.updated_at
+    )
+
+def movement_rows(product_id):
+    source = db.aliased(Warehouse)
+    destination = db.aliased(Warehouse)
+    return _query(
+        StockMovement.id,
+        StockMovement.movement_type,
+        StockMovement.quantity,
+        StockMovement.source_warehouse_id,
+        source.name.label('source_warehouse_name'),
+        StockMovement.destination_warehouse_id,
+        destination.name.label('destination_warehouse_name'),
+        StockMovement.timestamp
+    ).outerjoin(
+        source, source.id == StockMovement.source_warehouse_id
+    ).outerjoin(
+        destination, destination.id == StockMovement.destination_warehouse_id
+    ).filter(StockMovement.product_id == product_id)
+
+def alert_rows(product_ids):
+    return _query(
+        Product.id,
+        Product.name,
+        Product.sku,
+        Product.min_stock_level,
+        Product.reorder_point,
+        Product.warehouse_id,
+        Warehouse.name.label('warehouse_name')
+    ).outerjoin(
+        Warehouse, Warehouse.id == Product.warehouse_id
+    ).filter(Product.id.in_(product_ids))
+
+def warehouse_reorder_point_rows(product_ids, warehouse_id):
+    # Reorder points of the products in one warehouse, which rank its alerts
+    return _query(
+        DemandStat.product_id,
+        DemandStat.reorder_point
+    ).filter(
+        DemandStat.warehouse_id == warehouse_id,
+        DemandStat.product_id.in_(product_ids)
+    )
+
+def warehouse_names(warehouse_ids):
+    # {warehouse_id: name} in one query
+    if not warehouse_ids:
+        return {}
+    return dict(db.session.query(Warehouse.id, Warehouse.name)
+                          .filter(Warehouse.id.in_(warehouse_ids)).all())
+
+def archived_movement_rows(product_id, offset=0, limit=None, after=None):
+    # Archived movements in the shape of movement_rows, newest first
+    movements = []
+    for i, movement in enumerate(archived_movements(product_id, after)):
+        if limit is not None and i >= offset + limit:
+            break
+        if i >= offset:
+            movements.append(movement)
+
+    warehouse_ids = {
+        movement[key] for movement in movements
+        for key in ('source_warehouse_id', 'destination_warehouse_id')
+    } - {None}
+    names = warehouse_names(warehouse_ids)
+
+    for movement in movements:
+        movement['source_warehouse_name'] = names.get(movement['source_warehouse_id'])
+        movement['destination_warehouse_name'] = names.get(movement['destination_warehouse_id'])
+    return movements
+
+def serialize_rows(rows):
+    # Datetimes are left for the JSON provider to encode
+    return [row._asdict() for row in rows]
+
+# Cached detail lookups shared by the blueprints
+def get_product_details(product_id):
+    def load_product():
+        # If not in cache, get from database
+        product = Product.query.options(*Product.serializer_options()).get_or_404(product_id)
+        
+        # Cache for future requests
+        cache_product(product)
+        
+        return product.to_dict()
+    
+    # Try to get from cache first; only one worker reloads a missing key
+    return get_or_compute(f"product:{product_id}", loads, load_product, early_refresh=True)
+
+def get_products_details(product_ids):
+    # {product_id: details} from the cache, with one query for the misses
+    products = get_cached_products(product_ids)
+    missing = [pid for pid in product_ids if pid not in products]
+    
+    if missing:
+        with use_primary():
+            loaded = serialize_rows(product_rows().filter(Product.id.in_(missing)).all())
+        cache_products(loaded)
+        products.update((p['id'], p) for p in loaded)
+    
+    return products
+
+def get_warehouse_details(warehouse_id):
+    # Try to get from cache first
+    cached_warehouse = get_cached_warehouse(warehouse_id)
+    if cached_warehouse:
+        return cached_warehouse
+    
+    # If not in cache, get from the primary database
+    with use_primary():
+        warehouse = Warehouse.query.get_or_404(warehouse_id)
+    
+    # Cache for future requests
+    cache_warehouse(warehouse)
+    
+    return warehouse.to_dict()
+
+def get_product_warehouse_stock(product_id):
+    # {warehouse_id: quantity} from the per-warehouse hash, filled from
+    # inventory on a miss; None if the product does not exist
+    quantities = get_warehouse_stock(product_id)
+    if quantities is not None:
+        return quantities
+    
+    levels, pending = fill_warehouse_stocks([product_id])
+    if pending:
+        abort(503, 'Stock is being ingested, retry shortly')
+    if product_id not in levels:
+        return None
+    
+    return levels[product_id][0]
+
+def get_product_stock_level(product_id):
+    def compute_stock():
+        # Sum the per-warehouse stock hash when it is cached
+        quantities = get_warehouse_stock(product_id)
+        if quantities is not None:
+            stock = sum(quantities.values())
+            product = Product.query.get_or_404(product_id)
+            set_stock_level(product_id, stock, product.stock_threshold)
+            return stock
+        
+        # Calculate stock from the latest snapshot plus newer movements
+        stock = ledger_stock(product_id)
+        
+        # Cache the calculated value
+        product = Product.query.get_or_404(product_id)
+        set_stock_level(product_id, stock, product.stock_threshold)
+        
+        return stock
+    
+    # Try to get from cache first; only one worker recomputes a missing key
+    return get_or_compute(f"stock:{product_id}", int, compute_stock)
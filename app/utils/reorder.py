@@ -0,0 +1,240 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import numpy as np
+from app import db
+from app.models.demand_stat import DemandStat
+from app.models.movement_rollup import MovementRollup
+from app.models.product import Product
+from app.utils.config import (
+    MAX_BULK_IDS, REORDER_WINDOW_DAYS, REORDER_LEAD_TIME_DAYS,
+    REORDER_SERVICE_Z, REORDER_CHUNK_PRODUCTS, REORDER_READ_CHUNK
+)
+
+# Dynamic reorder points. Demand is the units a warehouse ships per day, read
+# from movement_rollup over the last REORDER_WINDOW_DAYS complete days. For
+# each (product, warehouse) the daily mean and standard deviation give
+#
+#   reorder point = ceil(rate * lead time + z * std * sqrt(lead time))
+#
+# and a product's reorder point, which replaces min_stock_level as its alert
+# threshold, sums the warehouse rates and variances. Products are processed
+# in id ranges, spread over worker processes.
+
+def reorder_points(product_ids, warehouse_ids, shipped, window_days,
+                   lead_time_days=REORDER_LEAD_TIME_DAYS, service_z=REORDER_SERVICE_Z):
+    # Arrays of daily shipments, one entry per (product, warehouse, day) with
+    # shipments; days without any count as zero demand. Returns (pairs,
+    # products): pairs has product_id, warehouse_id, demand_rate, demand_std
+    # and reorder_point arrays, products has product_id and reorder_point.
+    product_ids = np.asarray(product_ids, dtype=np.int64)
+    warehouse_ids = np.asarray(warehouse_ids, dtype=np.int64)
+    shipped = np.asarray(shipped, dtype=np.float64)
+    if not len(product_ids):
+        empty_ids = np.empty(0, dtype=np.int64)
+        empty = np.empty(0, dtype=np.float64)
+        return (
+            {'product_id': empty_ids, 'warehouse_id': empty_ids, 'demand_rate': empty,
+             'demand_std': empty, 'reorder_point': empty_ids},
+            {'product_id': empty_ids, 'reorder_point': empty_ids}
+        )
+
+    order = np.lexsort((warehouse_ids, product_ids))
+    product_ids = product_ids[order]
+    warehouse_ids = warehouse_ids[order]
+    shipped = shipped[order]
+
+    # One group per (product, warehouse)
+    starts = np.flatnonzero(np.concatenate([
+        [True],
+        (product_ids[1:] != product_ids[:-1]) | (warehouse_ids[1:] != warehouse_ids[:-1])
+    ]))
+    rate = np.add.reduceat(shipped, starts) / window_days
+    variance = np.maximum(np.add.reduceat(shipped * shipped, starts) / window_days - rate * rate, 0)
+    pair_products = product_ids[starts]
+
+    def reorder_point(rate, variance):
+        return np.ceil(
+            rate * lead_time_days + service_z * np.sqrt(variance * lead_time_days)
+        ).astype(np.int64)
+
+    # Warehouses are treated as independent, so rates and variances add up
+    product_starts = np.flatnonzero(np.concatenate([
+        [True], pair_products[1:] != pair_products[:-1]
+    ]))
+    product_rate = np.add.reduceat(rate, product_starts)
+    product_variance = np.add.reduceat(variance, product_starts)
+
+    pairs = {
+        'product_id': pair_products,
+        'warehouse_id': warehouse_ids[starts],
+        'demand_rate': rate,
+        'demand_std': np.sqrt(variance),
+        'reorder_point': reorder_point(rate, variance)
+    }
+    products = {
+        'product_id': pair_products[product_starts],
+        'reorder_point': reorder_point(product_rate, product_variance)
+    }
+    return pairs, products
+
+def demand_window(today=None):
+    # (first day, last day) of the complete days the engine reads
+    end = (today or datetime.utcnow().date()) - timedelta(days=1)
+    return end - timedelta(days=REORDER_WINDOW_DAYS - 1), end
+
+def _read_shipments(first_id, last_id, start, end):
+    # [[product_id, warehouse_id, shipped]] per day for the products in
+    # [first_id, last_id], streamed in chunks
+    query = db.select(
+        MovementRollup.product_id,
+        MovementRollup.warehouse_id,
+        MovementRollup.shipped
+    ).where(
+        MovementRollup.product_id.between(first_id, last_id),
+        MovementRollup.day.between(start, end),
+        MovementRollup.shipped > 0
+    ).execution_options(yield_per=REORDER_READ_CHUNK)
+
+    chunks = [
+        np.array(chunk, dtype=np.int64).reshape(-1, 3)
+        for chunk in db.session.execute(query).partitions(REORDER_READ_CHUNK)
+    ]
+    if not chunks:
+        return np.empty((0, 3), dtype=np.int64)
+    return np.concatenate(chunks)
+
+def compute_range(first_id, last_id, start, end):
+    # Recomputes demand and reorder points for the products in [first_id,
+    # last_id] in one transaction. Returns (pairs written, {product_id: (new
+    # alert threshold, {warehouse_id: reorder point})} for products whose
+    # threshold or warehouse reorder points changed).
+    shipments = _read_shipments(first_id, last_id, start, end)
+    window_days = (end - start).days + 1
+    pairs, products = reorder_points(
+        shipments[:, 0], shipments[:, 1], shipments[:, 2], window_days
+    )
+    computed = dict(zip(products['product_id'].tolist(), products['reorder_point'].tolist()))
+
+    current = db.session.query(
+        Product.id, Product.reorder_point, Product.min_stock_level
+    ).filter(Product.id.between(first_id, last_id)).all()
+
+    # Per-warehouse reorder points before and after, which rank the
+    # warehouse alerts; warehouses without one use the product threshold
+    previous = {}
+    for product_id, warehouse_id, reorder_point in db.session.query(
+        DemandStat.product_id, DemandStat.warehouse_id, DemandStat.reorder_point
+    ).filter(DemandStat.product_id.between(first_id, last_id)):
+        previous.setdefault(product_id, {})[warehouse_id] = reorder_point
+    warehouse_levels = {}
+    for product_id, warehouse_id, reorder_point in zip(
+        pairs['product_id'].tolist(), pairs['warehouse_id'].tolist(),
+        pairs['reorder_point'].tolist()
+    ):
+        warehouse_levels.setdefault(product_id, {})[warehouse_id] = reorder_point
+
+    # Products without shipments in the window fall back to min_stock_level
+    updates = []
+    thresholds = {}
+    for product_id, reorder_point, min_stock_level in current:
+        new = computed.get(product_id)
+        levels = warehouse_levels.get(product_id, {})
+        if new != reorder_point:
+            updates.append({'pid': product_id, 'rp': new})
+        elif levels == previous.get(product_id, {}):
+            continue
+        threshold = new if new is not None else min_stock_level
+        thresholds[product_id] = (threshold, levels)
+
+    db.session.execute(
+        db.delete(DemandStat).where(DemandStat.product_id.between(first_id, last_id))
+    )
+    now = datetime.utcnow()
+    rows = [
+        {
+            'product_id': product_id,
+            'warehouse_id': warehouse_id,
+            'demand_rate': rate,
+            'demand_std': std,
+            'reorder_point': reorder_point,
+            'computed_at': now
+        }
+        for product_id, warehouse_id, rate, std, reorder_point in zip(
+            pairs['product_id'].tolist(), pairs['warehouse_id'].tolist(),
+            pairs['demand_rate'].tolist(), pairs['demand_std'].tolist(),
+            pairs['reorder_point'].tolist()
+        )
+    ]
+    if rows:
+        db.session.execute(db.insert(DemandStat), rows)
+    if updates:
+        table = Product.__table__
+        db.session.execute(
+            db.update(table).where(table.c.id == db.bindparam('pid'))
+                            .values(reorder_point=db.bindparam('rp')),
+            updates
+        )
+    db.session.commit()
+    return len(rows), thresholds
+
+def _init_worker():
+    # Worker processes get their own app and database connections
+    from app import create_app
+    create_app().app_context().push()
+
+def _compute_range_task(args):
+    return compute_range(*args)
+
+def product_ranges(chunk_products=REORDER_CHUNK_PRODUCTS):
+    # [(first_id, last_id)] covering every product id
+    low, high = db.session.query(db.func.min(Product.id), db.func.max(Product.id)).one()
+    if low is None:
+        return []
+    return [
+        (first_id, min(first_id + chunk_products - 1, high))
+        for first_id in range(low, high + 1, chunk_products)
+    ]
+
+def compute_reorder_points(workers=None, chunk_products=REORDER_CHUNK_PRODUCTS,
+                           today=None, on_range=None):
+    # Recomputes every product's reorder points and re-ranks the alerts of
+    # the products whose thresholds changed. workers: processes to use, default
+    # one per core; 1 runs in this process. Returns (pairs, changed products).
+    from app.utils.cache import set_stock_thresholds, uncache_products
+
+    start, end = demand_window(today)
+    ranges = product_ranges(chunk_products)
+    db.session.commit()
+    tasks = [(first_id, last_id, start, end) for first_id, last_id in ranges]
+
+    workers = workers or multiprocessing.cpu_count()
+    executor = None
+    if workers > 1 and len(tasks) > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=min(workers, len(tasks)),
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker
+        )
+        results = executor.map(_compute_range_task, tasks)
+    else:
+        results = map(_compute_range_task, tasks)
+
+    total_pairs = 0
+    changed = 0
+    try:
+        for (first_id, last_id, _, _), (pairs, thresholds) in zip(tasks, results):
+            product_ids = list(thresholds)
+            for i in range(0, len(product_ids), MAX_BULK_IDS):
+                batch = product_ids[i:i + MAX_BULK_IDS]
+                set_stock_thresholds({pid: thresholds[pid] for pid in batch})
+                uncache_products(batch)
+            total_pairs += pairs
+            changed += len(thresholds)
+            if on_range is not None:
+                on_range(first_id, last_id, pairs, len(thresholds))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return total_pairs, changed
@@ -0,0 +1,66 @@
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+import sqlalchemy as sa
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from app.utils.config import REPLICA_BIND_KEYS, REPLICA_STICKY_SECONDS, REPLICA_STICKY_COOKIE
+
+# Read-replica routing. Handlers decorated with replica_reads pick one replica
+# bind per request, and RoutingSession sends their queries to it. Flushes and
+# DML always go to the primary, as does everything outside those handlers
+# (writes, CLI commands, background threads).
+
+WRITE_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+def _replica_key():
+    if has_request_context():
+        return g.get('_db_replica')
+    return None
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        key = _replica_key()
+        if key is not None and bind is None and not self._flushing \
+                and not isinstance(clause, sa.UpdateBase):
+            return self._db.engines[key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def _recent_writer():
+    try:
+        return float(request.cookies.get(REPLICA_STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+def replica_reads(view):
+    # Sends the handler's queries to a replica, unless the client wrote
+    # recently and must read its own writes
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if REPLICA_BIND_KEYS and not _recent_writer():
+            g._db_replica = random.choice(REPLICA_BIND_KEYS)
+        return view(*args, **kwargs)
+    return wrapper
+
+@contextmanager
+def use_primary():
+    # Queries inside the block read the primary. Used for reads that fill
+    # shared caches, which must not keep a lagging replica's values.
+    key = g.pop('_db_replica', None) if has_request_context() else None
+    try:
+        yield
+    finally:
+        if key is not None:
+            g._db_replica = key
+
+def _mark_writer(response):
+    if REPLICA_BIND_KEYS and request.method in WRITE_METHODS and response.status_code < 400:
+        response.set_cookie(
+            REPLICA_STICKY_COOKIE, f"{time.time() + REPLICA_STICKY_SECONDS:.3f}",
+            max_age=REPLICA_STICKY_SECONDS, httponly=True
+        )
+    return response
+
+def init_app(app):
+    app.after_request(_mark_writer)
@@ -0,0 +1,197 @@
+import re
+import threading
+import uuid
+from redis.exceptions import RedisError
+from app import db, redis_client
+from app.utils.config import (
+    SEARCH_MIN_CHARS, SEARCH_SCAN_LIMIT, SEARCH_BUILD_BATCH, SEARCH_BUILD_LEASE,
+    SEARCH_WARM_ON_STARTUP
+)
+
+# Product search on name and SKU, indexed in Redis:
+#   search:prefix  sorted set of "<full name or sku>\0<id>" for prefix queries
+#   search:suffix  sorted set of "<suffix of a word>\0<id>" for substring
+#                  queries: a substring of a word is a prefix of its suffixes
+#   search:docs    hash of id -> "<name>\0<sku>", to check multi-word queries
+# Every member scores 0, so ZRANGEBYLEX answers a query in O(log n + limit)
+# whatever the catalog size. Text is lowercased before indexing and lookup.
+
+PREFIX_KEY = 'search:prefix'
+SUFFIX_KEY = 'search:suffix'
+DOCS_KEY = 'search:docs'
+READY_KEY = 'search:ready'
+BUILD_LEASE_KEY = 'search:build'
+
+WORD = re.compile(r'\w+')
+SEPARATOR = b'\x00'
+
+def normalize(text):
+    return ' '.join((text or '').lower().split())
+
+def _member(term, product_id):
+    # Zero-padded ids keep entries for the same term in id order
+    return term.encode() + SEPARATOR + f"{product_id:012d}".encode()
+
+def _product_id(member):
+    return int(member.rsplit(SEPARATOR, 1)[1])
+
+def _suffixes(text):
+    for word in WORD.findall(text):
+        for i in range(len(word) - SEARCH_MIN_CHARS + 1):
+            yield word[i:]
+
+# Indexing
+def queue_index_products(pipe, products):
+    # products: [{'id', 'name', 'sku'}]
+    for product in products:
+        product_id = product['id']
+        name = normalize(product['name'])
+        sku = normalize(product.get('sku'))
+
+        prefixes = {_member(name, product_id): 0}
+        suffixes = {_member(suffix, product_id): 0 for suffix in _suffixes(name)}
+        if sku:
+            prefixes[_member(sku, product_id)] = 0
+            suffixes.update((_member(suffix, product_id), 0) for suffix in _suffixes(sku))
+
+        pipe.zadd(PREFIX_KEY, prefixes)
+        if suffixes:
+            pipe.zadd(SUFFIX_KEY, suffixes)
+        pipe.hset(DOCS_KEY, product_id, f"{name}\x00{sku}")
+
+def index_products(products):
+    if not products:
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    queue_index_products(pipe, products)
+    pipe.execute()
+
+def rebuild_index(batch_size=SEARCH_BUILD_BATCH):
+    # Indexes every product, in id batches, then marks the index ready.
+    # Entries are idempotent, so a rebuild can run over a live index.
+    from app.models.product import Product
+
+    last_id = 0
+    total = 0
+    while True:
+        rows = db.session.query(Product.id, Product.name, Product.sku)\
+                         .filter(Product.id > last_id)\
+                         .order_by(Product.id).limit(batch_size).all()
+        if not rows:
+            break
+        index_products([row._asdict() for row in rows])
+        last_id = rows[-1].id
+        total += len(rows)
+    db.session.commit()
+
+    redis_client.set(READY_KEY, 1)
+    return total
+
+def index_ready():
+    # Checked on every query, so a flushed index falls back to the database
+    return bool(redis_client.exists(READY_KEY))
+
+def ensure_index(app):
+    # Starts a background rebuild when the index has never been built. A
+    # lease keeps concurrent workers from building it twice; if the builder
+    # dies, the lease expires and the next caller takes over.
+    try:
+        if index_ready():
+            return
+        token = uuid.uuid4().hex
+        if not redis_client.set(BUILD_LEASE_KEY, token, nx=True, ex=SEARCH_BUILD_LEASE):
+            return
+    except RedisError as e:
+        app.logger.warning('Search index check failed: %s', e)
+        return
+
+    def build():
+        with app.app_context():
+            try:
+                total = rebuild_index()
+                app.logger.info('Search index built for %d products', total)
+            finally:
+                if redis_client.get(BUILD_LEASE_KEY) == token.encode():
+                    redis_client.delete(BUILD_LEASE_KEY)
+
+    threading.Thread(target=build, daemon=True).start()
+
+def warm_on_startup(app):
+    # Checked on each worker's first request rather than in create_app, so a
+    # preloading master starts no threads and workers boot without Redis
+    if not SEARCH_WARM_ON_STARTUP:
+        return
+    state = {'checked': False}
+
+    @app.before_request
+    def warm_search_index():
+        if not state['checked']:
+            state['checked'] = True
+            ensure_index(app)
+
+# Lookup
+def _scan(key, term, limit, accept=None):
+    # Product ids whose members in key start with term, in index order. With
+    # accept, candidates are checked in batches and at most SEARCH_SCAN_LIMIT
+    # members are read.
+    low = b'[' + term.encode()
+    high = b'[' + term.encode() + b'\xff'
+    found = []
+    seen = set()
+    offset = 0
+    while len(found) < limit and offset < SEARCH_SCAN_LIMIT:
+        batch = min(max(limit * 2, 100), SEARCH_SCAN_LIMIT - offset)
+        members = redis_client.zrangebylex(key, low, high, start=offset, num=batch)
+        offset += len(members)
+
+        candidates = []
+        for member in members:
+            product_id = _product_id(member)
+            if product_id not in seen:
+                seen.add(product_id)
+                candidates.append(product_id)
+        if accept is not None:
+            candidates = accept(candidates)
+        found.extend(candidates)
+
+        if len(members) < batch:
+            break
+    return found[:limit]
+
+def _containing(query):
+    # Filter keeping the products whose name or sku contains query
+    def accept(product_ids):
+        if not product_ids:
+            return []
+        docs = redis_client.hmget(DOCS_KEY, product_ids)
+        return [
+            product_id for product_id, doc in zip(product_ids, docs)
+            if doc is not None and any(query in field for field in doc.decode().split('\x00'))
+        ]
+    return accept
+
+def search_product_ids(query, match='substring', limit=20):
+    # Product ids matching query, best effort in index order
+    query = normalize(query)
+    words = WORD.findall(query)
+    if match == 'prefix' or not words or max(len(w) for w in words) < SEARCH_MIN_CHARS:
+        return _scan(PREFIX_KEY, query, limit)
+
+    # The longest word narrows the candidates most; the others are checked
+    # against the indexed text
+    longest = max(words, key=len)
+    accept = None if query == longest else _containing(query)
+    return _scan(SUFFIX_KEY, longest, limit, accept)
+
+def search_product_ids_sql(query, match='substring', limit=20):
+    # Fallback while the index is being built
+    from app.models.product import Product
+
+    query = normalize(query)
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    pattern = f"{escaped}%" if match == 'prefix' else f"%{escaped}%"
+    rows = db.session.query(Product.id).filter(db.or_(
+        db.func.lower(Product.name).like(pattern, escape='\\'),
+        db.func.lower(Product.sku).like(pattern, escape='\\')
+    )).order_by(Product.id).limit(limit)
+    return [product_id for (product_id,) in rows]
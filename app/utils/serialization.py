@@ -0,0 +1,62 @@
+import json
+import time
+from datetime import date, datetime
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the standard library
+    orjson = None
+
+# Module-level encoder shared by jsonify and the Redis cache
+def _default(obj):
+    # Dates are rendered as ISO 8601, matching the models' to_dict output
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    return DefaultJSONProvider.default(obj)
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj):
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+
+    def loads(data):
+        return orjson.loads(data)
+else:
+    def dumps_bytes(obj):
+        return json.dumps(obj, default=_default, sort_keys=True,
+                          separators=(',', ':')).encode()
+
+    def loads(data):
+        return json.loads(data)
+
+def dumps(obj):
+    return dumps_bytes(obj).decode()
+
+class FastJSONProvider(DefaultJSONProvider):
+    # Encodes responses with orjson when it is installed
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            kwargs.setdefault('default', _default)
+            return super().dumps(obj, **kwargs)
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        # Encoding time is reported to the request metrics
+        from app.utils.metrics import add_timing
+        started = time.perf_counter()
+        if self._app.debug:
+            response = super().response(*args, **kwargs)
+        else:
+            obj = self._prepare_response_obj(args, kwargs)
+            response = self._app.response_class(dumps_bytes(obj), mimetype=self.mimetype)
+        add_timing('serialize', time.perf_counter() - started)
+        return response
+
+    default = staticmethod(_default)
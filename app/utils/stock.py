@@ -0,0 +1,130 @@
+from datetime import datetime
+from importlib import import_module
+from app import db
+from app.models.demand_stat import DemandStat
+from app.models.inventory import Inventory
+from app.models.product import Product
+from app.utils.replicas import use_primary
+
+# Inventory upserts
+def _dialect_name():
+    return db.session.get_bind().dialect.name
+
+def _dialect_insert(table):
+    # Only the dialect in use is imported; the others are slow to load
+    dialect = _dialect_name()
+    if dialect not in ('mysql', 'postgresql'):
+        dialect = 'sqlite'
+    return import_module(f'sqlalchemy.dialects.{dialect}').insert(table)
+
+def upsert_rows(model, rows, index_elements, add):
+    # Inserts rows, or adds the columns named in add to the existing row that
+    # matches index_elements (a unique key)
+    if not rows:
+        return
+
+    table = model.__table__
+    stmt = _dialect_insert(table)
+    # The models' own clock, not the database's: SQLite's CURRENT_TIMESTAMP
+    # drops the fraction, so updated_at would jump back and forth
+    now = datetime.utcnow()
+
+    if _dialect_name() == 'mysql':
+        values = {c: table.c[c] + stmt.inserted[c] for c in add}
+        stmt = stmt.on_duplicate_key_update(updated_at=now, **values)
+    else:
+        values = {c: table.c[c] + stmt.excluded[c] for c in add}
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c[c] for c in index_elements],
+            set_=dict(values, updated_at=now)
+        )
+
+    db.session.execute(stmt, rows)
+
+def upsert_inventory(rows):
+    # rows: [{'product_id', 'warehouse_id', 'quantity'}] where quantity is a delta
+    # that is added to the existing row, or inserted as-is when no row exists yet
+    upsert_rows(Inventory, rows, ['product_id', 'warehouse_id'], ['quantity'])
+
+def decrement_inventory(product_id, warehouse_id, quantity):
+    # Guarded compare-and-set: only succeeds when enough stock is on hand. A
+    # negative quantity would pass the guard and move stock backwards.
+    if quantity <= 0:
+        raise ValueError('quantity must be positive')
+
+    result = db.session.execute(
+        db.update(Inventory).where(
+            Inventory.product_id == product_id,
+            Inventory.warehouse_id == warehouse_id,
+            Inventory.quantity >= quantity
+        ).values(
+            quantity=Inventory.quantity - quantity,
+            updated_at=datetime.utcnow()
+        ).execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+def delete_empty_inventory(pairs):
+    # Drop inventory rows that were emptied, mirroring the single transfer
+    # path. Negative rows are kept: they are debits applied ahead of their
+    # stock, see negative_inventory.
+    if not pairs:
+        return 0
+
+    result = db.session.execute(
+        db.delete(Inventory).where(
+            db.tuple_(Inventory.product_id, Inventory.warehouse_id).in_(list(pairs)),
+            Inventory.quantity == 0
+        ).execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+def negative_inventory(pairs):
+    # [(product_id, warehouse_id)] of the given pairs whose stock is below zero
+    if not pairs:
+        return []
+    return db.session.query(Inventory.product_id, Inventory.warehouse_id).filter(
+        db.tuple_(Inventory.product_id, Inventory.warehouse_id).in_(list(pairs)),
+        Inventory.quantity < 0
+    ).all()
+
+@use_primary()
+def warehouse_stock_for(product_ids):
+    # {product_id: ({warehouse_id: quantity}, alert threshold, {warehouse_id:
+    # reorder point})} for existing products, read from inventory and
+    # demand_stat in two queries. Warehouses without a reorder point alert
+    # on the product threshold. It fills the stock cache, so it always
+    # reads the primary.
+    if not product_ids:
+        return {}
+
+    rows = db.session.query(
+        Product.id,
+        Product.stock_threshold,
+        Inventory.warehouse_id,
+        Inventory.quantity
+    ).outerjoin(
+        Inventory, Inventory.product_id == Product.id
+    ).filter(
+        Product.id.in_(list(product_ids))
+    ).all()
+
+    levels = {}
+    for product_id, min_stock_level, warehouse_id, quantity in rows:
+        quantities, _, _ = levels.setdefault(product_id, ({}, min_stock_level, {}))
+        if warehouse_id is not None:
+            quantities[warehouse_id] = quantity
+
+    for product_id, warehouse_id, reorder_point in warehouse_reorder_points(levels):
+        levels[product_id][2][warehouse_id] = reorder_point
+    return levels
+
+def warehouse_reorder_points(product_ids):
+    # [(product_id, warehouse_id, reorder point)] from demand_stat
+    if not product_ids:
+        return []
+    return db.session.query(
+        DemandStat.product_id,
+        DemandStat.warehouse_id,
+        DemandStat.reorder_point
+    ).filter(DemandStat.product_id.in_(list(product_ids))).all()
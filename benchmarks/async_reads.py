@@ -0,0 +1,242 @@
+# Sync vs async read serving benchmark
+#
+# Seeds a database as benchmarks/routes.py does, then serves it with the sync
+# deployment (gunicorn gthread, run:app) and the async read server (uvicorn,
+# asgi:app), one after the other with the same number of processes, and
+# drives each with a growing number of concurrent keep-alive connections that
+# request product and warehouse details, stock, movement history and alerts.
+# Reports p50/p99 latency, throughput and errors per server and concurrency.
+#
+#   python benchmarks/async_reads.py --fake-redis --concurrency 50,500,2000
+#   DATABASE_URI=mysql+pymysql://... REDIS_URL=redis://... \
+#       python benchmarks/async_reads.py --workers 4 --keep
+#
+# A gthread worker holds at most --threads requests in flight; the async
+# server holds as many as there are connections. The load generator is one
+# asyncio process, so on small machines run it with fewer connections than
+# it can open, or from another host (--sync-url/--async-url).
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from routes import percentile, prepare, seed
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+FAKE_REDIS = """
+import sys
+from fakeredis import TcpFakeServer
+server = TcpFakeServer(('127.0.0.1', int(sys.argv[1])))
+server.daemon_threads = True
+server.serve_forever()
+"""
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def request_paths(args):
+    # Functions of a random.Random returning the next path to request
+    products = args.products
+    warehouses = args.warehouses
+    return [
+        lambda rng: f'/products/{rng.randint(1, products)}',
+        lambda rng: f'/warehouses/{rng.randint(1, warehouses)}',
+        lambda rng: f'/products/{rng.randint(1, products)}/stock',
+        lambda rng: f'/warehouses/{rng.randint(1, warehouses)}/products/{rng.randint(1, products)}/stock',
+        lambda rng: f'/products/{rng.randint(1, products)}/movements',
+        lambda rng: '/alerts/?cursor=&limit=20',
+    ]
+
+# Servers
+def start_server(kind, args, env):
+    port = free_port()
+    if kind == 'sync':
+        # Empty settings, so the repository's gunicorn.conf.py is not picked up
+        config = os.path.join(tempfile.mkdtemp(), 'gunicorn.conf.py')
+        open(config, 'w').close()
+        command = [sys.executable, '-m', 'gunicorn', '--config', config, '--workers', str(args.workers),
+                   '--worker-class', 'gthread', '--threads', str(args.threads), '--backlog', '4096',
+                   '--bind', f'127.0.0.1:{port}', 'run:app']
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--workers', str(args.workers),
+                   '--backlog', '4096', '--no-access-log', '--log-level', 'warning',
+                   '--host', '127.0.0.1', '--port', str(port)]
+    process = subprocess.Popen(command, cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'{url}/warehouses/1', timeout=5).read()
+            return process, url
+        except urllib.error.HTTPError:
+            return process, url
+        except OSError:
+            if process.poll() is not None:
+                raise SystemExit(f"{kind} server exited with status {process.returncode}")
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit(f"{kind} server did not start")
+
+def start_fake_redis():
+    # fakeredis over TCP in its own process, away from the load generator's
+    # file descriptors and GIL
+    port = free_port()
+    process = subprocess.Popen([sys.executable, '-c', FAKE_REDIS, str(port)])
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, f'redis://127.0.0.1:{port}/0'
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit('fakeredis did not start')
+
+# Load generation
+async def read_response(reader):
+    # Status code of the next response, with its body read
+    head = await reader.readuntil(b'\r\n\r\n')
+    length = 0
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return int(head.split(b' ', 2)[1])
+
+async def client(host, port, paths, rng, deadline, timeout, latencies, failures):
+    # One keep-alive connection sending requests back to back; a request
+    # without a response within timeout seconds is an error and ends it
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        failures.append(1)
+        return
+    try:
+        while time.perf_counter() < deadline:
+            path = rng.choice(paths)(rng)
+            started = time.perf_counter()
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode())
+            status = await asyncio.wait_for(read_response(reader), timeout)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if status >= 500:
+                failures.append(1)
+    except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+        failures.append(1)
+    finally:
+        writer.close()
+
+async def drive(url, args, connections, duration):
+    host, port = url.split('//')[1].split(':')
+    paths = request_paths(args)
+    latencies = []
+    failures = []
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        client(host, int(port), paths, random.Random(i), deadline, args.timeout, latencies, failures)
+        for i in range(connections)
+    ])
+    return latencies, len(failures), time.perf_counter() - started
+
+def measure(url, args, connections):
+    # Untimed warm-up, so caches are filled before timing starts
+    asyncio.run(drive(url, args, min(connections, 50), args.warmup))
+    latencies, errors, wall = asyncio.run(drive(url, args, connections, args.duration))
+    if not latencies:
+        return {'requests': 0, 'errors': errors}
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.5), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'throughput_rps': round(len(latencies) / wall, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--movements', type=int, default=10000, help='seeded stock movements')
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--warehouses', type=int, default=10)
+    parser.add_argument('--days', type=int, default=90, help='days of movement history')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--concurrency', default='50,500,2000', help='comma-separated connection counts')
+    parser.add_argument('--duration', type=float, default=10, help='timed seconds per run')
+    parser.add_argument('--warmup', type=float, default=2, help='untimed seconds per run')
+    parser.add_argument('--timeout', type=float, default=10, help='seconds before a request fails')
+    parser.add_argument('--workers', type=int, default=1, help='processes per server')
+    parser.add_argument('--threads', type=int, default=32, help='threads per gunicorn worker')
+    parser.add_argument('--fake-redis', action='store_true', help='serve fakeredis over TCP')
+    parser.add_argument('--keep', action='store_true', help='reuse an already seeded database')
+    parser.add_argument('--sync-url', default=None, help='benchmark a running sync server')
+    parser.add_argument('--async-url', default=None, help='benchmark a running async server')
+    parser.add_argument('--output', default=None, help='results file [default: print only]')
+    # Seeding options of benchmarks/routes.py this benchmark has no use for
+    parser.set_defaults(hot_clients=0, hot_transfers=0)
+    args = parser.parse_args()
+
+    if 'DATABASE_URI' not in os.environ:
+        os.environ['DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ['SEARCH_WARM_ON_STARTUP'] = '0'
+    redis_server = None
+    if args.fake_redis:
+        redis_server, os.environ['REDIS_URL'] = start_fake_redis()
+
+    try:
+        from app import create_app, db
+        from app.models.product import Product
+
+        app = create_app()
+        with app.app_context():
+            seeded = db.session.query(Product.id).first() is not None
+            if seeded and not args.keep:
+                raise SystemExit('The database already holds products; pass --keep to benchmark it as is')
+            if not seeded:
+                started = time.perf_counter()
+                seed(args)
+                print(f"Seeded {args.products} products, {args.warehouses} warehouses and "
+                      f"{args.movements} movements in {time.perf_counter() - started:.1f}s")
+            prepare(app)
+            db.session.remove()
+
+        env = dict(os.environ, PYTHONPATH=ROOT, CREATE_SCHEMA_ON_STARTUP='0')
+        levels = [int(level) for level in args.concurrency.split(',')]
+        results = {}
+        for kind, url in (('sync', args.sync_url), ('async', args.async_url)):
+            process = None
+            if url is None:
+                process, url = start_server(kind, args, env)
+            try:
+                for connections in levels:
+                    results[f'{kind} {connections}'] = measure(url, args, connections)
+                    result = results[f'{kind} {connections}']
+                    print(f"{kind:<6} {connections:>6} connections  p50 {result.get('p50_ms', 0):9.2f} ms  "
+                          f"p99 {result.get('p99_ms', 0):9.2f} ms  {result.get('throughput_rps', 0):9.1f} rps  "
+                          f"{result['errors']} errors")
+            finally:
+                if process is not None:
+                    process.terminate()
+                    process.wait()
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({'options': vars(args), 'results': results}, f, indent=2)
+    finally:
+        if redis_server is not None:
+            redis_server.terminate()
+            redis_server.wait()
+
+if __name__ == '__main__':
+    main()
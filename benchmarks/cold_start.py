@@ -0,0 +1,143 @@
+# Worker cold-start benchmark
+#
+# Starts gunicorn with one worker and times it from spawn to the first served
+# request (GET /warehouses/), then kills the worker and times its replacement
+# the same way (Linux only), for each startup mode:
+#
+#   create_all   schema creation on startup (CREATE_SCHEMA_ON_STARTUP=1)
+#   no schema    schema left to migrations (CREATE_SCHEMA_ON_STARTUP=0)
+#   preload      no schema, app created in the master (gunicorn --preload)
+#
+# and, in a separate process, how long importing the app, create_app() and the
+# first request take.
+#
+#   DATABASE_URI=mysql+pymysql://... REDIS_URL=redis://... \
+#       python benchmarks/cold_start.py --runs 10
+#
+# Without DATABASE_URI a SQLite file is used, where schema creation is cheap;
+# on MySQL it costs network round trips for every table.
+import argparse
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+MODES = {
+    'create_all': ({'CREATE_SCHEMA_ON_STARTUP': '1'}, []),
+    'no schema': ({'CREATE_SCHEMA_ON_STARTUP': '0'}, []),
+    'preload': ({'CREATE_SCHEMA_ON_STARTUP': '0'}, ['--preload']),
+}
+
+PHASES = """
+import json, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+app.test_client().get('/warehouses/')
+served = time.perf_counter()
+print(json.dumps({'import': imported - started, 'create_app': created - imported,
+                  'first_request': served - created}))
+"""
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_for_response(process, url, started, timeout):
+    # Seconds from started until url answers
+    while time.perf_counter() - started < timeout:
+        try:
+            urllib.request.urlopen(url, timeout=5).read()
+            return time.perf_counter() - started
+        except urllib.error.HTTPError:
+            # Served, even if not successfully
+            return time.perf_counter() - started
+        except OSError:
+            if process.poll() is not None:
+                raise SystemExit(f"gunicorn exited:\n{process.stderr.read().decode()}")
+            time.sleep(0.002)
+    raise SystemExit(f"No response within {timeout}s")
+
+def worker_pid(master_pid):
+    with open(f'/proc/{master_pid}/task/{master_pid}/children') as f:
+        return int(f.read().split()[0])
+
+def measure(env, extra_args, config, timeout):
+    # (spawn to first request, worker replaced to first request) in seconds
+    port = free_port()
+    command = [sys.executable, '-m', 'gunicorn', '--config', config, '--workers', '1',
+               '--bind', f'127.0.0.1:{port}', *extra_args, 'run:app']
+    url = f'http://127.0.0.1:{port}/warehouses/'
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        boot = wait_for_response(process, url, started, timeout)
+        # A worker replacing a dead one, as on a crash, restart or scale-up
+        respawn = None
+        if os.path.exists(f'/proc/{process.pid}/task'):
+            killed = time.perf_counter()
+            os.kill(worker_pid(process.pid), signal.SIGKILL)
+            respawn = wait_for_response(process, url, killed, timeout)
+        return boot, respawn
+    finally:
+        process.terminate()
+        process.wait()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--output', default=None, help='results file [default: print only]')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URI', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'cold_start.db')}")
+    env['PYTHONPATH'] = ROOT
+    # Empty settings, so the repository's gunicorn.conf.py is not picked up
+    config = os.path.join(tempfile.mkdtemp(), 'gunicorn.conf.py')
+    open(config, 'w').close()
+
+    # Create the schema once, so the modes that skip it find it in place
+    subprocess.run([sys.executable, '-c', 'from app import create_app; create_app()'],
+                   cwd=ROOT, env=dict(env, CREATE_SCHEMA_ON_STARTUP='1'), check=True)
+
+    results = {}
+    for mode, (mode_env, extra_args) in MODES.items():
+        runs = [measure(dict(env, **mode_env), extra_args, config, args.timeout) for _ in range(args.runs)]
+        results[mode] = {'spawn_ms': round(statistics.median(run[0] for run in runs) * 1000, 1)}
+        line = f"{mode:<12} spawn to first request {results[mode]['spawn_ms']:7.1f} ms"
+        if runs[0][1] is not None:
+            results[mode]['worker_respawn_ms'] = round(statistics.median(run[1] for run in runs) * 1000, 1)
+            line += f"  worker respawn to first request {results[mode]['worker_respawn_ms']:7.1f} ms"
+        print(line + f"  (median of {args.runs})")
+
+    for schema in ('1', '0'):
+        runs = [json.loads(subprocess.run([sys.executable, '-c', PHASES], cwd=ROOT,
+                                          env=dict(env, CREATE_SCHEMA_ON_STARTUP=schema),
+                                          check=True, capture_output=True).stdout)
+                for _ in range(args.runs)]
+        phases = {phase: round(statistics.median(run[phase] for run in runs) * 1000, 1)
+                  for phase in runs[0]}
+        results[f'phases (CREATE_SCHEMA_ON_STARTUP={schema})'] = phases
+        print(f"CREATE_SCHEMA_ON_STARTUP={schema}: " +
+              '  '.join(f"{phase} {ms:.1f} ms" for phase, ms in phases.items()))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
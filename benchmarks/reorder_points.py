@@ -0,0 +1,72 @@
+# Reorder-point engine throughput benchmark
+#
+# Generates synthetic daily shipments (product, warehouse, day) and runs the
+# vectorized reorder-point computation over them in product-id ranges, first
+# in one process and then across worker processes. Data is generated inside
+# each task, so nothing large crosses process boundaries; the compute time
+# is reported separately from the wall-clock time.
+#
+#   python benchmarks/reorder_points.py --products 1000000 --rows 20000000
+#
+# The database-backed run (`flask stock reorder-points`) prints its own
+# elapsed time.
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+WINDOW_DAYS = 90
+
+def run_range(task):
+    import numpy as np
+    from app.utils.reorder import reorder_points
+
+    index, first_id, products, rows, warehouses = task
+    rng = np.random.default_rng(index)
+    product_ids = rng.integers(first_id, first_id + products, rows)
+    warehouse_ids = rng.integers(1, warehouses + 1, rows)
+    shipped = rng.poisson(4, rows) + 1
+
+    started = time.perf_counter()
+    pairs, _ = reorder_points(product_ids, warehouse_ids, shipped, WINDOW_DAYS)
+    return time.perf_counter() - started, len(pairs['product_id'])
+
+def run(tasks, workers):
+    started = time.perf_counter()
+    if workers == 1:
+        results = list(map(run_range, tasks))
+    else:
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            results = list(executor.map(run_range, tasks))
+    wall = time.perf_counter() - started
+    return wall, sum(r[0] for r in results), sum(r[1] for r in results)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=1000000)
+    parser.add_argument('--rows', type=int, default=20000000, help='daily shipment rows')
+    parser.add_argument('--warehouses', type=int, default=5)
+    parser.add_argument('--chunk-products', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+
+    rows_per_product = args.rows / args.products
+    tasks = []
+    for index, first_id in enumerate(range(1, args.products + 1, args.chunk_products)):
+        products = min(args.chunk_products, args.products + 1 - first_id)
+        tasks.append((index, first_id, products, round(products * rows_per_product), args.warehouses))
+    total_rows = sum(task[3] for task in tasks)
+
+    print(f"{args.products} products, {total_rows} shipment rows, {len(tasks)} ranges")
+    for workers in sorted({1, args.workers}):
+        wall, compute, pairs = run(tasks, workers)
+        print(f"workers={workers:<3} wall {wall:7.2f}s  {total_rows / wall:12,.0f} rows/s  "
+              f"compute {compute:7.2f}s  {total_rows / compute:12,.0f} rows/s per core  "
+              f"{pairs} pairs")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,542 @@
+# Route latency and throughput benchmark
+#
+# Seeds a database with a synthetic catalog and movement history, then sends
+# requests to every read endpoint and to POST /warehouses/transfer from
+# concurrent clients through the WSGI app, and reports p50/p99 latency and
+# throughput per endpoint. The If-None-Match scenarios revalidate pages the
+# clients already hold. The hot-SKU scenario has every client transfer
+# single units of one product, and checks that its stock is conserved.
+#
+#   python benchmarks/routes.py --fake-redis --movements 100000
+#   DATABASE_URI=mysql+pymysql://... REDIS_URL=redis://... \
+#       python benchmarks/routes.py --movements 10000000 --keep
+#
+# Without DATABASE_URI the data goes to a fresh SQLite file. A database that
+# already holds products is only used with --keep, which skips seeding.
+#
+# Results are written as JSON (--output). With --baseline, each endpoint is
+# compared with a stored run and the script exits with status 1 when median
+# latency or throughput is worse by more than --tolerance; --save-baseline
+# stores this run as the new baseline. Compare runs made with the same
+# options on the same machine.
+#
+# Before timing anything, every listing is requested with limit=5 and
+# limit=50 on cold caches while SQL statements are counted; the script exits
+# with status 1 if a listing issues more statements for the larger page (an
+# N+1 load), or returns too few items for the check to mean anything. One
+# product in LOW_STOCK_EVERY is seeded below its minimum so the alert
+# listing has pages to check. --check-queries runs only this check.
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baselines', 'routes.json')
+INSERT_BATCH = 50000
+OPENING_STOCK = 1000
+LOW_STOCK_EVERY = 10
+
+NAMES = ['wireless mouse', 'usb cable', 'steel shelf', 'led lamp', 'office chair',
+         'monitor stand', 'packing tape', 'label printer', 'hand truck', 'storage bin']
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+# Seeding
+def generate_movements(rng, args, start, home):
+    # Additions, removals and transfers spread over the last --days days, in
+    # timestamp order, and the resulting stock per (product, warehouse)
+    import numpy as np
+
+    n = args.movements
+    products = rng.integers(1, args.products + 1, n)
+    kinds = rng.choice(3, n, p=[0.6, 0.3, 0.1])
+    quantities = np.where(kinds == 0, rng.integers(5, 50, n), rng.integers(1, 10, n))
+    sources = rng.integers(1, args.warehouses + 1, n)
+    destinations = rng.integers(1, args.warehouses + 1, n)
+    # A transfer never stays in one warehouse
+    same = destinations == sources
+    destinations[same] = sources[same] % args.warehouses + 1
+    sources = np.where(kinds == 0, 0, sources)
+    destinations = np.where(kinds == 1, 0, destinations)
+    offsets = np.sort(rng.integers(0, args.days * 86400 * 1000000, n))
+
+    # Net stock per pair; pairs that went negative get an opening addition,
+    # and every product starts with OPENING_STOCK units in its home warehouse
+    # (transfers leave from there)
+    width = args.warehouses + 1
+    stock = np.zeros((args.products + 1) * width, dtype=np.int64)
+    np.add.at(stock, products * width + destinations, quantities)
+    np.subtract.at(stock, products * width + sources, quantities)
+    stock = stock.reshape(-1, width)
+    stock[:, 0] = 0
+    opening = np.maximum(-stock, 0)
+    opening[np.arange(1, args.products + 1), home[1:]] += OPENING_STOCK
+    # The hot SKU has enough for every hot transfer on top
+    opening[1, home[1]] += args.hot_clients * args.hot_transfers
+    stock += opening
+
+    movement_types = np.array(['addition', 'removal', 'transfer'])[kinds]
+    timestamps = (np.datetime64(start, 'us') + offsets.astype('timedelta64[us]')).tolist()
+    return {
+        'opening': opening,
+        'stock': stock,
+        'rows': (products, sources, destinations, quantities, movement_types, timestamps),
+    }
+
+def insert_batches(model, rows):
+    from app import db
+
+    for i in range(0, len(rows), INSERT_BATCH):
+        db.session.execute(db.insert(model), rows[i:i + INSERT_BATCH])
+        db.session.commit()
+
+def seed(args):
+    import numpy as np
+    from app.models.inventory import Inventory
+    from app.models.product import Product
+    from app.models.stock_movement import StockMovement
+    from app.models.warehouse import Warehouse
+
+    rng = np.random.default_rng(args.seed)
+    now = datetime.utcnow()
+    start = now - timedelta(days=args.days)
+    home = rng.integers(1, args.warehouses + 1, args.products + 1)
+    # The hot SKU is moved from warehouse 1 to warehouse 2
+    home[1] = 1
+    data = generate_movements(rng, args, start, home)
+
+    insert_batches(Warehouse, [
+        {'id': wid, 'name': f'Warehouse {wid}', 'location': f'Zone {wid}', 'created_at': now, 'updated_at': now}
+        for wid in range(1, args.warehouses + 1)
+    ])
+    min_levels = rng.integers(0, 40, args.products + 1)
+    # Every LOW_STOCK_EVERY-th product is set just above its stock, so the
+    # alert index has pages to list
+    low = np.arange(LOW_STOCK_EVERY, args.products + 1, LOW_STOCK_EVERY)
+    min_levels[low] = data['stock'][low].sum(axis=1) + 1
+    insert_batches(Product, [
+        {
+            'id': pid, 'name': f'Product {pid} {NAMES[pid % len(NAMES)]}', 'sku': f'SKU-{pid:08d}',
+            'min_stock_level': int(min_levels[pid]), 'warehouse_id': int(home[pid]),
+            'created_at': now, 'updated_at': now
+        }
+        for pid in range(1, args.products + 1)
+    ])
+
+    stock = data['stock']
+    pids, wids = np.nonzero(stock)
+    insert_batches(Inventory, [
+        {'product_id': int(pid), 'warehouse_id': int(wid), 'quantity': int(stock[pid, wid]),
+         'created_at': now, 'updated_at': now}
+        for pid, wid in zip(pids, wids)
+    ])
+
+    opening = data['opening']
+    pids, wids = np.nonzero(opening)
+    rows = [
+        {'product_id': int(pid), 'source_warehouse_id': None, 'destination_warehouse_id': int(wid),
+         'quantity': int(opening[pid, wid]), 'movement_type': 'addition', 'timestamp': start}
+        for pid, wid in zip(pids, wids)
+    ]
+    products, sources, destinations, quantities, movement_types, timestamps = data['rows']
+    for i in range(0, args.movements, INSERT_BATCH):
+        chunk = slice(i, i + INSERT_BATCH)
+        rows.extend(
+            {'product_id': int(pid), 'source_warehouse_id': int(src) or None,
+             'destination_warehouse_id': int(dst) or None, 'quantity': int(qty),
+             'movement_type': str(kind), 'timestamp': ts}
+            for pid, src, dst, qty, kind, ts in zip(
+                products[chunk], sources[chunk], destinations[chunk],
+                quantities[chunk], movement_types[chunk], timestamps[chunk]
+            )
+        )
+        insert_batches(StockMovement, rows)
+        rows = []
+
+def prepare(app):
+    # Snapshots, rollups, the alert index and the search index, as the
+    # maintenance commands would leave them in production
+    runner = app.test_cli_runner()
+    for command in (['stock', 'snapshot'],
+                    ['stock', 'rollup'],
+                    ['stock', 'rebuild-alerts'],
+                    ['stock', 'reindex-search']):
+        result = runner.invoke(args=command)
+        if result.exit_code != 0:
+            raise SystemExit(f"{' '.join(command)} failed:\n{result.output}")
+
+# N+1 guard
+QUERY_CHECK_LIMITS = (5, 50)
+
+def listing_paths(args, busiest):
+    # Listing requests as functions of the page size. busiest is the product
+    # with the most movements and their number; a short page of its history
+    # reads on into the archive, so its pages are kept full.
+    product_id, movements = busiest
+    ids = lambda n: ','.join(str(i) for i in range(1, n + 1))
+    return {
+        'GET /products/': lambda n: f'/products/?limit={n}',
+        'GET /products/?cursor=': lambda n: f'/products/?cursor=&limit={n}',
+        'GET /products/?ids=': lambda n: f'/products/?ids={ids(n)}',
+        'GET /products/search': lambda n: f'/products/search?q={NAMES[0][:3]}&limit={n}',
+        'GET /products/stock?ids=': lambda n: f'/products/stock?ids={ids(n)}',
+        'GET /products/{id}/movements': lambda n: (
+            f'/products/{product_id}/movements?limit={min(n, movements)}'),
+        'GET /warehouses/': lambda n: f'/warehouses/?limit={n}',
+        'GET /warehouses/{id}/products': lambda n: f'/warehouses/1/products?limit={n}',
+        'GET /alerts/?cursor=': lambda n: f'/alerts/?cursor=&limit={n}',
+    }
+
+def drop_read_caches():
+    # Cached rows, stock and pages, so a listing reads what it shows from SQL
+    from app import redis_client
+    from app.utils.cache import local_cache
+
+    for pattern in ('product:*', 'warehouse:*', 'stock:*', 'page:*', 'count:*'):
+        keys = list(redis_client.scan_iter(pattern, count=10000))
+        for i in range(0, len(keys), 10000):
+            redis_client.delete(*keys[i:i + 10000])
+    local_cache.clear()
+
+def check_query_counts(app, args, busiest):
+    # SQL statements per listing request at each of QUERY_CHECK_LIMITS;
+    # returns the listings whose count grows with the page size, or whose
+    # largest page is too short to show it
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    client = app.test_client()
+    failures = []
+    print(f"\n{'listing':<44} " + ' '.join(f"{f'limit={n}':>9}" for n in QUERY_CHECK_LIMITS)
+          + f" {'items':>7}")
+    event.listen(Engine, 'before_cursor_execute', count)
+    try:
+        for name, make_path in listing_paths(args, busiest).items():
+            counts = []
+            for n in QUERY_CHECK_LIMITS:
+                with app.app_context():
+                    drop_read_caches()
+                del statements[:]
+                response = client.get(make_path(n))
+                if response.status_code != 200:
+                    raise SystemExit(f"{make_path(n)} returned {response.status_code}")
+                counts.append(len(statements))
+            # Items on the largest page; a listing with no more items than the
+            # smallest page cannot show growth, so it fails the check too
+            body = response.get_json()
+            items = len(body['items'] if isinstance(body, dict) else body)
+            if counts[-1] > counts[0]:
+                flag = '  GROWS WITH PAGE SIZE'
+            elif items <= QUERY_CHECK_LIMITS[0]:
+                flag = '  TOO FEW ITEMS TO CHECK'
+            else:
+                flag = ''
+            print(f"{name:<44} " + ' '.join(f"{c:>9}" for c in counts) + f" {items:>7}{flag}")
+            if flag:
+                failures.append(name)
+    finally:
+        event.remove(Engine, 'before_cursor_execute', count)
+    return failures
+
+# Scenarios
+def scenarios(args, homes):
+    # name -> (method, function of a random.Random returning (path, json body));
+    # homes maps product ids to the warehouse transfers leave from
+    products = args.products
+    warehouses = args.warehouses
+
+    def ids(rng, count, top):
+        return ','.join(str(i) for i in rng.sample(range(1, top + 1), min(count, top)))
+
+    def transfer(rng):
+        # Product 1 is left to the hot-SKU scenario
+        product_id = rng.randint(2, products)
+        source = homes[product_id]
+        return '/warehouses/transfer', {
+            'product_id': product_id,
+            'source_warehouse_id': source,
+            'destination_warehouse_id': source % warehouses + 1,
+            'quantity': 1
+        }
+
+    today = datetime.utcnow().date()
+    return {
+        'GET /warehouses/': ('GET', lambda rng: ('/warehouses/', None)),
+        'GET /warehouses/{id}': ('GET', lambda rng: (f'/warehouses/{rng.randint(1, warehouses)}', None)),
+        'GET /warehouses/{id}/products': ('GET', lambda rng: (
+            f'/warehouses/{rng.randint(1, warehouses)}/products?page={rng.randint(1, 5)}', None)),
+        'GET /warehouses/{id}/products/{id}/stock': ('GET', lambda rng: (
+            f'/warehouses/{rng.randint(1, warehouses)}/products/{rng.randint(1, products)}/stock', None)),
+        'GET /products/': ('GET', lambda rng: (f'/products/?page={rng.randint(1, 20)}&limit=100', None)),
+        'GET /products/?ids=': ('GET', lambda rng: (f'/products/?ids={ids(rng, 100, products)}', None)),
+        'GET /products/search': ('GET', lambda rng: (
+            f'/products/search?q={rng.choice(NAMES).split()[rng.randint(0, 1)][:5]}', None)),
+        'GET /products/stock?ids=': ('GET', lambda rng: (f'/products/stock?ids={ids(rng, 100, products)}', None)),
+        'GET /products/{id}': ('GET', lambda rng: (f'/products/{rng.randint(1, products)}', None)),
+        'GET /products/{id}/stock': ('GET', lambda rng: (f'/products/{rng.randint(1, products)}/stock', None)),
+        'GET /products/{id}/movements': ('GET', lambda rng: (f'/products/{rng.randint(1, products)}/movements', None)),
+        'GET /inventory/matrix': ('GET', lambda rng: (
+            f'/inventory/matrix?product_ids={ids(rng, 100, products)}&warehouse_ids={ids(rng, 10, warehouses)}', None)),
+        'GET /alerts/': ('GET', lambda rng: ('/alerts/', None)),
+        'GET /alerts/?warehouse_id=': ('GET', lambda rng: (
+            f'/alerts/?warehouse_id={rng.randint(1, warehouses)}', None)),
+        'GET /analytics/movements': ('GET', lambda rng: (
+            f'/analytics/movements?from={today - timedelta(days=args.days)}&to={today}'
+            f'&warehouse_id={rng.randint(1, warehouses)}', None)),
+        'POST /warehouses/transfer': ('POST', transfer),
+    }
+
+def run_clients(app, clients, requests_per_client, send):
+    # Runs send(client, rng) from concurrent clients; returns latencies in
+    # milliseconds, the error count and the wall-clock time
+    import random
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(clients)
+
+    def worker(index):
+        client = app.test_client()
+        rng = random.Random(index)
+        local = []
+        failed = 0
+        barrier.wait()
+        for _ in range(requests_per_client):
+            started = time.perf_counter()
+            try:
+                ok = send(client, rng)
+            except Exception:
+                ok = False
+            local.append((time.perf_counter() - started) * 1000)
+            failed += not ok
+        with lock:
+            latencies.extend(local)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, sum(errors), time.perf_counter() - started
+
+def summarize(latencies, errors, wall):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.5), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'throughput_rps': round(len(latencies) / wall, 1),
+    }
+
+def bench_endpoints(app, args, homes):
+    results = {}
+    for name, (method, make_request) in scenarios(args, homes).items():
+        def send(client, rng):
+            path, body = make_request(rng)
+            response = client.open(path, method=method, json=body)
+            return response.status_code < 400
+
+        # One untimed pass warms the caches
+        run_clients(app, 1, args.warmup, send)
+        results[name] = summarize(*run_clients(app, args.clients, args.requests // args.clients, send))
+    return results
+
+def bench_revalidation(app, args):
+    # Clients sending If-None-Match with the ETag of a page they fetched
+    # earlier; a 304 is a success
+    import random
+
+    products = args.products
+    scenarios = {
+        'GET /warehouses/ (If-None-Match)': lambda rng: '/warehouses/',
+        'GET /products/ (If-None-Match)': lambda rng: f'/products/?page={rng.randint(1, 20)}&limit=100',
+        'GET /products/{id} (If-None-Match)': lambda rng: f'/products/{rng.randint(1, products)}',
+        'GET /products/{id}/movements (If-None-Match)': lambda rng: (
+            f'/products/{rng.randint(1, products)}/movements'),
+    }
+    results = {}
+    client = app.test_client()
+    for name, make_path in scenarios.items():
+        # ETags of a fixed set of pages, fetched untimed
+        rng = random.Random(args.seed)
+        etags = {}
+        for _ in range(args.warmup):
+            path = make_path(rng)
+            etags[path] = client.get(path).headers.get('ETag')
+        paths = list(etags)
+
+        def send(client, rng):
+            path = rng.choice(paths)
+            return client.get(path, headers={'If-None-Match': etags[path]}).status_code == 304
+
+        results[name] = summarize(*run_clients(app, args.clients, args.requests // args.clients, send))
+    return results
+
+def bench_hot_sku(app, args):
+    from app import db
+    from app.models.inventory import Inventory
+
+    payload = {'product_id': 1, 'source_warehouse_id': 1, 'destination_warehouse_id': 2, 'quantity': 1}
+
+    def on_hand():
+        with app.app_context():
+            quantities = dict(db.session.query(Inventory.warehouse_id, Inventory.quantity)
+                                        .filter_by(product_id=1).all())
+            db.session.remove()
+        return quantities.get(1, 0) + quantities.get(2, 0)
+
+    before = on_hand()
+
+    def send(client, rng):
+        return client.post('/warehouses/transfer', json=payload).status_code == 200
+
+    result = summarize(*run_clients(app, args.hot_clients, args.hot_transfers, send))
+    result['stock_conserved'] = on_hand() == before
+    return result
+
+# Reporting
+def compare(results, baseline, tolerance):
+    # Endpoints whose median latency or throughput is worse than the
+    # baseline by more than tolerance. p99 is reported but not judged: with
+    # in-process clients it is dominated by thread scheduling.
+    regressions = []
+    print(f"\n{'endpoint':<44} {'p50 ms':>9} {'baseline':>9} {'p99 ms':>9} {'baseline':>9} "
+          f"{'rps':>9} {'baseline':>9}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<44} {result['p50_ms']:>9.2f} {'-':>9} {result['p99_ms']:>9.2f} {'-':>9} "
+                  f"{result['throughput_rps']:>9.1f} {'-':>9}")
+            continue
+        slower = result['p50_ms'] > base['p50_ms'] * (1 + tolerance)
+        fewer = result['throughput_rps'] < base['throughput_rps'] / (1 + tolerance)
+        flag = '  REGRESSION' if slower or fewer else ''
+        print(f"{name:<44} {result['p50_ms']:>9.2f} {base['p50_ms']:>9.2f} "
+              f"{result['p99_ms']:>9.2f} {base['p99_ms']:>9.2f} "
+              f"{result['throughput_rps']:>9.1f} {base['throughput_rps']:>9.1f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--movements', type=int, default=10000, help='seeded stock movements')
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--warehouses', type=int, default=10)
+    parser.add_argument('--days', type=int, default=90, help='days of movement history')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--requests', type=int, default=400, help='timed requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=50, help='untimed requests per endpoint')
+    parser.add_argument('--clients', type=int, default=4, help='concurrent clients per endpoint')
+    parser.add_argument('--hot-clients', type=int, default=16)
+    parser.add_argument('--hot-transfers', type=int, default=50, help='hot-SKU transfers per client')
+    parser.add_argument('--fake-redis', action='store_true')
+    parser.add_argument('--keep', action='store_true', help='reuse an already seeded database')
+    parser.add_argument('--output', default=None, help='results file [default: print only]')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--check-queries', action='store_true',
+                        help='only run the statement-count check on listings')
+    args = parser.parse_args()
+
+    if 'DATABASE_URI' not in os.environ:
+        os.environ['DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ['SEARCH_WARM_ON_STARTUP'] = '0'
+
+    from sqlalchemy.engine import make_url
+    from app import create_app, db, redis_client
+    from app.models.product import Product
+    from app.models.stock_movement import StockMovement
+
+    app = create_app()
+    if args.fake_redis:
+        import fakeredis
+        redis_client._redis_client = fakeredis.FakeRedis()
+
+    with app.app_context():
+        seeded = db.session.query(Product.id).first() is not None
+        if seeded and not args.keep:
+            raise SystemExit('The database already holds products; pass --keep to benchmark it as is')
+        if not seeded:
+            started = time.perf_counter()
+            seed(args)
+            print(f"Seeded {args.products} products, {args.warehouses} warehouses and "
+                  f"{args.movements} movements in {time.perf_counter() - started:.1f}s")
+        started = time.perf_counter()
+        prepare(app)
+        print(f"Built snapshots, rollups and indexes in {time.perf_counter() - started:.1f}s")
+        homes = dict(db.session.query(Product.id, Product.warehouse_id))
+        busiest = db.session.query(StockMovement.product_id, db.func.count()).group_by(
+            StockMovement.product_id
+        ).order_by(db.func.count().desc()).first()
+        db.session.remove()
+
+    failures = check_query_counts(app, args, busiest)
+    if failures:
+        print(f"\n{len(failures)} listings issue more SQL statements for larger pages "
+              f"or return too few items to tell")
+        sys.exit(1)
+    if args.check_queries:
+        return
+
+    results = bench_endpoints(app, args, homes)
+    results.update(bench_revalidation(app, args))
+    results['POST /warehouses/transfer (hot SKU)'] = bench_hot_sku(app, args)
+
+    print(f"\n{'endpoint':<44} {'p50 ms':>9} {'p99 ms':>9} {'rps':>9} {'errors':>7}")
+    for name, result in results.items():
+        print(f"{name:<44} {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+              f"{result['throughput_rps']:>9.1f} {result['errors']:>7}")
+    if not results['POST /warehouses/transfer (hot SKU)']['stock_conserved']:
+        print('Hot-SKU stock was not conserved')
+
+    report = {
+        'run': {
+            'started_at': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'database': make_url(os.environ['DATABASE_URI']).get_backend_name(),
+            'redis': 'fakeredis' if args.fake_redis else 'redis',
+            'options': {k: v for k, v in vars(args).items()
+                        if k not in ('output', 'baseline', 'save_baseline', 'tolerance')},
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['run']['options'] != report['run']['options']:
+            print('\nNote: the baseline was recorded with different options')
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} endpoints regressed beyond {args.tolerance:.0%}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# Product search latency benchmark
+#
+# Fills the search index with synthetic products (straight into Redis, no
+# database rows) and times prefix, single-word and multi-word substring
+# queries through search_product_ids. Reports the index size (entries per
+# product, and Redis used_memory before and after the build) and p50/p99
+# latency per query kind.
+#
+#   REDIS_URL=redis://... python benchmarks/search.py --products 1000000
+#
+# Pass --fake-redis to run against fakeredis instead of a Redis server (use
+# fewer products; fakeredis is much slower than Redis, and has no memory
+# figures).
+import argparse
+import os
+import random
+import sys
+import time
+from redis.exceptions import ResponseError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+ADJECTIVES = ['wireless', 'ergonomic', 'compact', 'heavy', 'duty', 'smart', 'portable',
+              'premium', 'mini', 'steel', 'led', 'usb', 'magnetic', 'folding', 'digital']
+NOUNS = ['monitor', 'keyboard', 'mouse', 'cable', 'adapter', 'charger', 'lamp', 'stand',
+         'speaker', 'headset', 'camera', 'router', 'drive', 'hub', 'bracket', 'shelf']
+
+def used_memory(redis_client):
+    # Bytes, or None where the server has no INFO (fakeredis)
+    try:
+        return redis_client.info('memory')['used_memory']
+    except ResponseError:
+        return None
+
+def key_memory(redis_client, key):
+    try:
+        return redis_client.memory_usage(key, samples=0)
+    except ResponseError:
+        return None
+
+def mib(size):
+    return f"{size / 2 ** 20:9.1f} MiB" if size is not None else '      n/a'
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=500, help='queries per kind')
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--fake-redis', action='store_true')
+    parser.add_argument('--keep', action='store_true', help='reuse an index left by a previous run')
+    args = parser.parse_args()
+
+    os.environ['SEARCH_WARM_ON_STARTUP'] = '0'
+    from app import create_app, redis_client
+    from app.utils.search import index_products, search_product_ids, PREFIX_KEY, SUFFIX_KEY, DOCS_KEY
+
+    app = create_app()
+    if args.fake_redis:
+        import fakeredis
+        redis_client._redis_client = fakeredis.FakeRedis()
+
+    rng = random.Random(1)
+    with app.app_context():
+        if not args.keep:
+            redis_client.delete(PREFIX_KEY, SUFFIX_KEY, DOCS_KEY)
+            memory_before = used_memory(redis_client)
+            started = time.perf_counter()
+            batch = []
+            for product_id in range(1, args.products + 1):
+                name = f"{rng.choice(ADJECTIVES)} {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {rng.randint(1, 999)}"
+                batch.append({'id': product_id, 'name': name, 'sku': f"SKU-{product_id:08d}"})
+                if len(batch) == 5000:
+                    index_products(batch)
+                    batch = []
+            index_products(batch)
+            print(f"Indexed {args.products} products in {time.perf_counter() - started:.1f}s")
+
+            memory_after = used_memory(redis_client)
+            if memory_before is not None and memory_after is not None:
+                grown = memory_after - memory_before
+                print(f"used_memory {mib(memory_before)} before, {mib(memory_after)} after, "
+                      f"{grown / max(args.products, 1):.0f} bytes per product")
+
+        # The suffix index dominates: one entry per indexed character
+        for key in (PREFIX_KEY, SUFFIX_KEY, DOCS_KEY):
+            entries = redis_client.hlen(key) if key == DOCS_KEY else redis_client.zcard(key)
+            print(f"{key:<14} {entries:>11} entries  {entries / max(args.products, 1):6.1f} per product  "
+                  f"{mib(key_memory(redis_client, key))}")
+
+        kinds = {
+            'prefix': lambda: (f"{rng.choice(ADJECTIVES)} {rng.choice(ADJECTIVES)[:3]}", 'prefix'),
+            'sku prefix': lambda: (f"sku-{rng.randint(1, args.products):08d}"[:9], 'prefix'),
+            'substring': lambda: (rng.choice(NOUNS)[1:5], 'substring'),
+            'sku substring': lambda: (f"{rng.randint(1, args.products):08d}"[2:], 'substring'),
+            'multi-word': lambda: (f"{rng.choice(ADJECTIVES)[-3:]} {rng.choice(NOUNS)}", 'substring'),
+        }
+        for kind, make_query in kinds.items():
+            timings = []
+            hits = 0
+            for _ in range(args.queries):
+                query, match = make_query()
+                started = time.perf_counter()
+                hits += len(search_product_ids(query, match, args.limit))
+                timings.append((time.perf_counter() - started) * 1000)
+            print(f"{kind:<14} p50 {percentile(timings, 0.5):6.2f} ms  "
+                  f"p99 {percentile(timings, 0.99):6.2f} ms  "
+                  f"avg hits {hits / args.queries:5.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# Listing read-path benchmark
+#
+# Compares the ORM path (hydrate Product objects, to_dict, stdlib json) with
+# the column-row path (Core rows, JSON provider) for one page of products.
+#
+#   DATABASE_URI=sqlite:////tmp/bench.db python benchmarks/serialization.py --products 5000
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+def timed(fn, iterations):
+    fn()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    from app import create_app, db
+    from app.models.product import Product
+    from app.models.warehouse import Warehouse
+    from app.utils.readers import product_rows, serialize_rows
+    from app.utils.serialization import dumps_bytes, orjson
+
+    app = create_app()
+    with app.app_context():
+        if Product.query.count() < args.products:
+            warehouse = Warehouse(name=f'bench-{time.time_ns()}', location='bench')
+            db.session.add(warehouse)
+            db.session.flush()
+            db.session.execute(db.insert(Product), [
+                {'name': f'product {i}', 'sku': f'bench-{warehouse.id}-{i}',
+                 'description': 'benchmark product', 'warehouse_id': warehouse.id}
+                for i in range(args.products)
+            ])
+            db.session.commit()
+
+        def orm_page():
+            products = Product.query.options(*Product.serializer_options())\
+                                    .order_by(Product.id).limit(args.page_size).all()
+            json.dumps([p.to_dict() for p in products])
+            db.session.expunge_all()
+
+        def row_page():
+            rows = product_rows().order_by(Product.id).limit(args.page_size).all()
+            dumps_bytes(serialize_rows(rows))
+
+        orm_ms = timed(orm_page, args.iterations)
+        row_ms = timed(row_page, args.iterations)
+
+    encoder = 'orjson' if orjson is not None else 'json'
+    print(f"page_size={args.page_size} encoder={encoder}")
+    print(f"orm+to_dict+json: {orm_ms:.3f} ms/page")
+    print(f"rows+provider:    {row_ms:.3f} ms/page ({orm_ms / row_ms:.1f}x)")
+
+if __name__ == '__main__':
+    main()
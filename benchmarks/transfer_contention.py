@@ -0,0 +1,91 @@
+# Hot-SKU transfer contention benchmark
+#
+# Many concurrent clients transfer single units of the same product between
+# two warehouses through POST /warehouses/transfer. Reports transfers per
+# second and checks that no stock was lost or double-counted.
+#
+#   DATABASE_URI=mysql+pymysql://... REDIS_URL=redis://... \
+#       python benchmarks/transfer_contention.py --clients 32 --transfers 200
+#
+# Pass --fake-redis to run against fakeredis instead of a Redis server.
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--transfers', type=int, default=100, help='transfers per client')
+    parser.add_argument('--fake-redis', action='store_true')
+    args = parser.parse_args()
+
+    from app import create_app, db, redis_client
+    from app.models.inventory import Inventory
+
+    app = create_app()
+    if args.fake_redis:
+        import fakeredis
+        redis_client._redis_client = fakeredis.FakeRedis()
+
+    client = app.test_client()
+    suffix = str(time.time_ns())
+    source = client.post('/warehouses/', json={'name': f'bench-src-{suffix}', 'location': 'bench'}).json['warehouse']['id']
+    destination = client.post('/warehouses/', json={'name': f'bench-dst-{suffix}', 'location': 'bench'}).json['warehouse']['id']
+    initial_stock = args.clients * args.transfers
+    product_id = client.post('/products/', json={
+        'name': f'bench-{suffix}',
+        'warehouse_id': source,
+        'stock': initial_stock
+    }).json['product']['id']
+
+    payload = {
+        'product_id': product_id,
+        'source_warehouse_id': source,
+        'destination_warehouse_id': destination,
+        'quantity': 1
+    }
+    counts = {'ok': 0, 'failed': 0}
+    lock = threading.Lock()
+    barrier = threading.Barrier(args.clients)
+
+    def worker():
+        local = app.test_client()
+        ok = failed = 0
+        barrier.wait()
+        for _ in range(args.transfers):
+            try:
+                response = local.post('/warehouses/transfer', json=payload)
+                if response.status_code == 200:
+                    ok += 1
+                else:
+                    failed += 1
+            except Exception:
+                failed += 1
+        with lock:
+            counts['ok'] += ok
+            counts['failed'] += failed
+
+    threads = [threading.Thread(target=worker) for _ in range(args.clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        quantities = dict(db.session.query(Inventory.warehouse_id, Inventory.quantity)
+                                    .filter_by(product_id=product_id).all())
+
+    on_hand = quantities.get(source, 0) + quantities.get(destination, 0)
+    print(f"clients={args.clients} transfers={counts['ok']} failed={counts['failed']} "
+          f"elapsed={elapsed:.2f}s rate={counts['ok'] / elapsed:.1f}/s")
+    print(f"stock conserved={on_hand == initial_stock} "
+          f"destination matches={quantities.get(destination, 0) == counts['ok']}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+# Gunicorn settings for the API container: gunicorn run:app
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5001')
+workers = int(os.getenv('WEB_CONCURRENCY', 4))
+# Threaded workers, so open event streams do not hold a whole process
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 32))
+# The app is created once in the master and inherited by every worker;
+# create_app gives each worker fresh database pools after the fork
+preload_app = True
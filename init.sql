@@ -19,12 +19,14 @@ CREATE TABLE IF NOT EXISTS product (
     description TEXT,
     sku VARCHAR(50) UNIQUE,
     min_stock_level INT DEFAULT 10,
+    reorder_point INT NULL,
     warehouse_id INT NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     FOREIGN KEY (warehouse_id) REFERENCES warehouse(id),
     INDEX idx_product_sku (sku),
-    INDEX idx_product_warehouse (warehouse_id)
+    INDEX idx_product_warehouse (warehouse_id),
+    INDEX idx_product_updated_at (updated_at)
 );
 
 -- Stock Movements table
@@ -36,13 +38,97 @@ CREATE TABLE IF NOT EXISTS stock_movement (
     quantity INT NOT NULL,
     movement_type VARCHAR(20) NOT NULL,
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    event_id VARCHAR(32),
     FOREIGN KEY (product_id) REFERENCES product(id),
     FOREIGN KEY (source_warehouse_id) REFERENCES warehouse(id),
     FOREIGN KEY (destination_warehouse_id) REFERENCES warehouse(id),
     INDEX idx_movement_product (product_id),
     INDEX idx_movement_source (source_warehouse_id),
     INDEX idx_movement_destination (destination_warehouse_id),
-    INDEX idx_movement_timestamp (timestamp)
+    INDEX idx_movement_timestamp (timestamp),
+    INDEX idx_movement_product_timestamp (product_id, timestamp, id),
+    UNIQUE KEY uix_movement_event_id (event_id)
+);
+
+-- Inventory table: stock per product and warehouse
+CREATE TABLE IF NOT EXISTS inventory (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    product_id INT NOT NULL,
+    warehouse_id INT NOT NULL,
+    quantity INT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (product_id) REFERENCES product(id),
+    FOREIGN KEY (warehouse_id) REFERENCES warehouse(id),
+    UNIQUE KEY uix_inventory_product_warehouse (product_id, warehouse_id),
+    INDEX idx_inventory_updated_at (updated_at)
+);
+
+-- Stock snapshots: stock per product and warehouse as of a movement high-water mark
+CREATE TABLE IF NOT EXISTS stock_snapshot (
+    product_id INT NOT NULL,
+    warehouse_id INT NOT NULL,
+    quantity INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (product_id, warehouse_id),
+    FOREIGN KEY (product_id) REFERENCES product(id),
+    FOREIGN KEY (warehouse_id) REFERENCES warehouse(id)
+);
+
+CREATE TABLE IF NOT EXISTS stock_checkpoint (
+    id INT PRIMARY KEY,
+    last_movement_id INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS movement_segment (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    month VARCHAR(7) NOT NULL,
+    path VARCHAR(255) NOT NULL UNIQUE,
+    row_count INT NOT NULL,
+    min_movement_id INT NOT NULL,
+    max_movement_id INT NOT NULL,
+    min_product_id INT NOT NULL,
+    max_product_id INT NOT NULL,
+    min_timestamp DATETIME NOT NULL,
+    max_timestamp DATETIME NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_segment_month (month)
+);
+
+CREATE TABLE IF NOT EXISTS movement_segment_product (
+    product_id INT NOT NULL,
+    segment_id INT NOT NULL,
+    row_count INT NOT NULL,
+    PRIMARY KEY (product_id, segment_id),
+    FOREIGN KEY (segment_id) REFERENCES movement_segment(id)
+);
+
+CREATE TABLE IF NOT EXISTS movement_rollup (
+    day DATE NOT NULL,
+    warehouse_id INT NOT NULL,
+    product_id INT NOT NULL,
+    received INT NOT NULL DEFAULT 0,
+    shipped INT NOT NULL DEFAULT 0,
+    movements INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (day, warehouse_id, product_id),
+    INDEX idx_rollup_warehouse_day (warehouse_id, day),
+    INDEX idx_rollup_product_day (product_id, day),
+    FOREIGN KEY (warehouse_id) REFERENCES warehouse(id),
+    FOREIGN KEY (product_id) REFERENCES product(id)
+);
+
+CREATE TABLE IF NOT EXISTS demand_stat (
+    product_id INT NOT NULL,
+    warehouse_id INT NOT NULL,
+    demand_rate DOUBLE NOT NULL,
+    demand_std DOUBLE NOT NULL,
+    reorder_point INT NOT NULL,
+    computed_at DATETIME,
+    PRIMARY KEY (product_id, warehouse_id),
+    FOREIGN KEY (product_id) REFERENCES product(id),
+    FOREIGN KEY (warehouse_id) REFERENCES warehouse(id)
 );
 
 -- Insert some sample data
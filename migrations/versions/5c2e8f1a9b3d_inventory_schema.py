@@ -0,0 +1,166 @@
+"""inventory schema
+
+Creates the tables and indexes of init.sql that are missing, so it applies
+both to an empty database and to one created from an earlier init.sql.
+Columns added to existing tables come in their own revisions.
+
+Revision ID: 5c2e8f1a9b3d
+Revises:
+Create Date: 2026-10-18 21:52:06.418203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c2e8f1a9b3d'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+INDEXES = (
+    ('idx_warehouse_name', 'warehouse', ['name']),
+    ('idx_product_sku', 'product', ['sku']),
+    ('idx_product_warehouse', 'product', ['warehouse_id']),
+    ('idx_product_updated_at', 'product', ['updated_at']),
+    ('idx_movement_product', 'stock_movement', ['product_id']),
+    ('idx_movement_source', 'stock_movement', ['source_warehouse_id']),
+    ('idx_movement_destination', 'stock_movement', ['destination_warehouse_id']),
+    ('idx_movement_timestamp', 'stock_movement', ['timestamp']),
+    ('idx_movement_product_timestamp', 'stock_movement', ['product_id', 'timestamp', 'id']),
+    ('idx_inventory_updated_at', 'inventory', ['updated_at']),
+    ('idx_segment_month', 'movement_segment', ['month']),
+    ('idx_rollup_warehouse_day', 'movement_rollup', ['warehouse_id', 'day']),
+    ('idx_rollup_product_day', 'movement_rollup', ['product_id', 'day']),
+)
+
+
+def upgrade():
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'warehouse' not in tables:
+        op.create_table(
+            'warehouse',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('name', sa.String(100), nullable=False, unique=True),
+            sa.Column('location', sa.String(200), nullable=False),
+            sa.Column('created_at', sa.DateTime()),
+            sa.Column('updated_at', sa.DateTime())
+        )
+
+    if 'product' not in tables:
+        op.create_table(
+            'product',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('name', sa.String(100), nullable=False),
+            sa.Column('description', sa.Text()),
+            sa.Column('sku', sa.String(50), unique=True),
+            sa.Column('min_stock_level', sa.Integer()),
+            sa.Column('warehouse_id', sa.Integer(), sa.ForeignKey('warehouse.id'), nullable=False),
+            sa.Column('created_at', sa.DateTime()),
+            sa.Column('updated_at', sa.DateTime())
+        )
+
+    if 'stock_movement' not in tables:
+        op.create_table(
+            'stock_movement',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('product_id', sa.Integer(), sa.ForeignKey('product.id'), nullable=False),
+            sa.Column('source_warehouse_id', sa.Integer(), sa.ForeignKey('warehouse.id')),
+            sa.Column('destination_warehouse_id', sa.Integer(), sa.ForeignKey('warehouse.id')),
+            sa.Column('quantity', sa.Integer(), nullable=False),
+            sa.Column('movement_type', sa.String(20), nullable=False),
+            sa.Column('timestamp', sa.DateTime())
+        )
+
+    if 'inventory' not in tables:
+        op.create_table(
+            'inventory',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('product_id', sa.Integer(), sa.ForeignKey('product.id'), nullable=False),
+            sa.Column('warehouse_id', sa.Integer(), sa.ForeignKey('warehouse.id'), nullable=False),
+            sa.Column('quantity', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('created_at', sa.DateTime()),
+            sa.Column('updated_at', sa.DateTime()),
+            sa.UniqueConstraint('product_id', 'warehouse_id', name='uix_inventory_product_warehouse')
+        )
+
+    if 'stock_snapshot' not in tables:
+        op.create_table(
+            'stock_snapshot',
+            sa.Column('product_id', sa.Integer(), sa.ForeignKey('product.id'), primary_key=True),
+            sa.Column('warehouse_id', sa.Integer(), sa.ForeignKey('warehouse.id'), primary_key=True),
+            sa.Column('quantity', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('updated_at', sa.DateTime())
+        )
+
+    if 'stock_checkpoint' not in tables:
+        op.create_table(
+            'stock_checkpoint',
+            sa.Column('id', sa.Integer(), primary_key=True, autoincrement=False),
+            sa.Column('last_movement_id', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('updated_at', sa.DateTime())
+        )
+
+    if 'movement_segment' not in tables:
+        op.create_table(
+            'movement_segment',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('month', sa.String(7), nullable=False),
+            sa.Column('path', sa.String(255), nullable=False, unique=True),
+            sa.Column('row_count', sa.Integer(), nullable=False),
+            sa.Column('min_movement_id', sa.Integer(), nullable=False),
+            sa.Column('max_movement_id', sa.Integer(), nullable=False),
+            sa.Column('min_product_id', sa.Integer(), nullable=False),
+            sa.Column('max_product_id', sa.Integer(), nullable=False),
+            sa.Column('min_timestamp', sa.DateTime(), nullable=False),
+            sa.Column('max_timestamp', sa.DateTime(), nullable=False),
+            sa.Column('created_at', sa.DateTime())
+        )
+
+    if 'movement_segment_product' not in tables:
+        op.create_table(
+            'movement_segment_product',
+            sa.Column('product_id', sa.Integer(), primary_key=True, autoincrement=False),
+            sa.Column('segment_id', sa.Integer(), sa.ForeignKey('movement_segment.id'), primary_key=True),
+            sa.Column('row_count', sa.Integer(), nullable=False)
+        )
+
+    if 'movement_rollup' not in tables:
+        op.create_table(
+            'movement_rollup',
+            sa.Column('day', sa.Date(), primary_key=True),
+            sa.Column('warehouse_id', sa.Integer(), sa.ForeignKey('warehouse.id'), primary_key=True),
+            sa.Column('product_id', sa.Integer(), sa.ForeignKey('product.id'), primary_key=True),
+            sa.Column('received', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('shipped', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('movements', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('updated_at', sa.DateTime())
+        )
+
+    if 'demand_stat' not in tables:
+        op.create_table(
+            'demand_stat',
+            sa.Column('product_id', sa.Integer(), sa.ForeignKey('product.id'), primary_key=True),
+            sa.Column('warehouse_id', sa.Integer(), sa.ForeignKey('warehouse.id'), primary_key=True),
+            sa.Column('demand_rate', sa.Float(), nullable=False),
+            sa.Column('demand_std', sa.Float(), nullable=False),
+            sa.Column('reorder_point', sa.Integer(), nullable=False),
+            sa.Column('computed_at', sa.DateTime())
+        )
+
+    # A fresh inspector: the one above predates the new tables
+    inspector = sa.inspect(op.get_bind())
+    existing = {}
+    for name, table, columns in INDEXES:
+        if table not in existing:
+            existing[table] = {index['name'] for index in inspector.get_indexes(table)}
+        if name not in existing[table]:
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    # The baseline is not reverted: it may have found every table in place
+    pass
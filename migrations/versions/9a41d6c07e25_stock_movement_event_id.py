@@ -0,0 +1,35 @@
+"""stock_movement.event_id
+
+Idempotency key of movements written by the ingest worker. Skipped when the
+column is already there (databases created from the current init.sql).
+
+Revision ID: 9a41d6c07e25
+Revises: 5c2e8f1a9b3d
+Create Date: 2026-10-18 21:53:40.902715
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a41d6c07e25'
+down_revision = '5c2e8f1a9b3d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('stock_movement')}
+    if 'event_id' in columns:
+        return
+
+    # Nullable and appended last, so MySQL adds it without copying the table;
+    # the unique index is then built online
+    op.add_column('stock_movement', sa.Column('event_id', sa.String(32), nullable=True))
+    op.create_index('uix_movement_event_id', 'stock_movement', ['event_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('uix_movement_event_id', table_name='stock_movement')
+    op.drop_column('stock_movement', 'event_id')
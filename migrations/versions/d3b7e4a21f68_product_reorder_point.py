@@ -0,0 +1,31 @@
+"""product.reorder_point
+
+Alert threshold computed by `flask stock reorder-points`. Skipped when the
+column is already there (databases created from the current init.sql).
+
+Revision ID: d3b7e4a21f68
+Revises: 9a41d6c07e25
+Create Date: 2026-10-18 22:04:17.551390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3b7e4a21f68'
+down_revision = '9a41d6c07e25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('product')}
+    if 'reorder_point' in columns:
+        return
+
+    op.add_column('product', sa.Column('reorder_point', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('product', 'reorder_point')
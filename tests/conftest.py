@@ -0,0 +1,32 @@
+import os
+import tempfile
+import pytest
+
+# Configuration is read when app.utils.config is imported, so it is set
+# before the app is
+_db_dir = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_URI', f"sqlite:///{os.path.join(_db_dir, 'test.db')}")
+os.environ.setdefault('SEARCH_WARM_ON_STARTUP', '0')
+os.environ.setdefault('L1_CACHE_SIZE', '0')
+
+fakeredis = pytest.importorskip('fakeredis')
+
+from app import create_app, db, redis_client
+
+
+@pytest.fixture(scope='session')
+def app():
+    app = create_app()
+    redis_client._redis_client = fakeredis.FakeRedis()
+    return app
+
+
+@pytest.fixture
+def app_context(app):
+    # A fresh schema and Redis for every test
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        redis_client.flushall()
+        yield app
+        db.session.remove()
@@ -0,0 +1,75 @@
+import uuid
+from datetime import datetime
+import pytest
+from app import db, redis_client
+from app.models.inventory import Inventory
+from app.models.product import Product
+from app.models.warehouse import Warehouse
+from app.utils.config import MOVEMENT_STREAM_GROUP
+from app.utils.ingest import (
+    NegativeStockError, drain_movements, enqueue_addition, enqueue_transfer,
+    product_stream, write_events, _ensure_groups
+)
+
+
+@pytest.fixture
+def product(app_context):
+    for name in ('A', 'B'):
+        db.session.add(Warehouse(name=name, location='x'))
+    db.session.flush()
+    product = Product(name='P', min_stock_level=1, warehouse_id=1)
+    db.session.add(product)
+    db.session.commit()
+    return product.id
+
+
+def _event(movement_type, product_id, source, destination, quantity):
+    return {
+        'event_id': uuid.uuid4().hex,
+        'movement_type': movement_type,
+        'product_id': product_id,
+        'source_warehouse_id': source,
+        'destination_warehouse_id': destination,
+        'quantity': quantity,
+        'timestamp': datetime.utcnow().isoformat()
+    }
+
+
+def _inventory(product_id):
+    return {
+        (row.warehouse_id, row.quantity)
+        for row in Inventory.query.filter_by(product_id=product_id)
+    }
+
+
+def test_debit_ahead_of_its_stock_is_not_written(product):
+    addition = _event('addition', product, None, 1, 15)
+    transfer = _event('transfer', product, 1, 2, 15)
+    transfer['home_warehouse_id'] = 2
+
+    # Written before the addition, the transfer would leave -15 in the
+    # source; the batch is refused instead of dropping the debit
+    with pytest.raises(NegativeStockError):
+        write_events([transfer])
+    db.session.rollback()
+    assert _inventory(product) == set()
+
+    assert write_events([addition]) == 1
+    assert write_events([transfer]) == 1
+    assert _inventory(product) == {(2, 15)}
+
+
+def test_entries_left_pending_are_written_before_newer_ones(product):
+    enqueue_addition(product, 1, 25, 1)
+    enqueue_transfer(product, 1, 2, 25, 1)
+
+    # A consumer reads the addition and dies before writing it, so only the
+    # transfer is left to deliver as new
+    _ensure_groups()
+    redis_client.xreadgroup(
+        MOVEMENT_STREAM_GROUP, 'dead', {product_stream(product): '>'}, count=1
+    )
+
+    assert drain_movements('worker', until_empty=True, block_ms=10) == 2
+    assert _inventory(product) == {(2, 25)}
+    assert db.session.get(Product, product).warehouse_id == 2